@@ -0,0 +1,176 @@
+"""
+Compare the per-message cost of the old and new enforce_gban checks.
+
+    python benchmarks/enforce_gban.py --messages 200000 --gbanned 50000
+
+The new check is the enforce_gban that ships in tg_bot/modules/global_bans.py, read straight from that file; the old
+one is a copy of the handler before it looked at the gban list first. Both run against stub chats that count Bot API
+calls instead of making them, with an in-memory stand-in for global_bans_sql. Member lookups are counted as if they
+always missed the member cache.
+"""
+import argparse
+import ast
+import os
+import random
+import time
+
+GBAN_MODULE = os.path.join(os.path.dirname(__file__), "..", "tg_bot", "modules", "global_bans.py")
+GBANNED_BASE = 10 ** 6
+BOT_ID = 1000
+
+# enforce_gban as it was, asking for the bot's member entry and the sender's admin status before the gban list
+OLD_ENFORCE_GBAN = '''
+def enforce_gban(bot: Bot, update: Update):
+    # Not using @restrict handler to avoid spamming - just ignore if cant gban.
+    if sql.does_chat_gban(update.effective_chat.id) and update.effective_chat.get_member(bot.id).can_restrict_members:
+        user = update.effective_user  # type: Optional[User]
+        chat = update.effective_chat  # type: Optional[Chat]
+        msg = update.effective_message  # type: Optional[Message]
+
+        if user and not is_user_admin(chat, user.id):
+            check_and_ban(update, user.id)
+
+        if msg.new_chat_members:
+            new_members = update.effective_message.new_chat_members
+            for mem in new_members:
+                check_and_ban(update, mem.id)
+
+        if msg.reply_to_message:
+            user = msg.reply_to_message.from_user  # type: Optional[User]
+            if user and not is_user_admin(chat, user.id):
+                check_and_ban(update, user.id, should_message=False)
+'''
+
+
+class Member(object):
+    can_restrict_members = True
+    status = "member"
+
+
+class Chat(object):
+    type = "supergroup"
+    all_members_are_administrators = False
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.api_calls = 0
+
+    def get_member(self, user_id):
+        self.api_calls += 1
+        return Member()
+
+
+class User(object):
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class Bot(object):
+    id = BOT_ID
+
+
+class Message(object):
+    def __init__(self, from_user, new_chat_members=(), reply_to_message=None):
+        self.from_user = from_user
+        self.new_chat_members = list(new_chat_members)
+        self.reply_to_message = reply_to_message
+
+
+class Update(object):
+    def __init__(self, chat, message):
+        self.effective_chat = chat
+        self.effective_user = message.from_user
+        self.effective_message = message
+
+
+class GbanSql(object):
+    """
+    The in-memory parts of global_bans_sql that enforce_gban reads.
+    """
+
+    def __init__(self, num_gbanned):
+        self.gbanned = set(range(GBANNED_BASE, GBANNED_BASE + num_gbanned))
+        self.gbanstat = set()
+
+    def is_user_gbanned(self, user_id):
+        return user_id in self.gbanned
+
+    def does_chat_gban(self, chat_id):
+        return str(chat_id) not in self.gbanstat
+
+
+def load_shipped_source():
+    with open(GBAN_MODULE) as f:
+        tree = ast.parse(f.read(), GBAN_MODULE)
+    handler = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == "enforce_gban")
+    handler.decorator_list = []  # @run_async would hand the call to the dispatcher's thread pool
+    return ast.Module(body=[handler], type_ignores=[])
+
+
+def build_handler(source, gban_sql, bans):
+    def check_and_ban(update, user_id, should_message=True):
+        if gban_sql.is_user_gbanned(user_id):
+            bans.append(user_id)
+
+    def get_member(chat, user_id):
+        return chat.get_member(user_id)
+
+    def is_user_admin(chat, user_id):
+        return get_member(chat, user_id).status in ("administrator", "creator")
+
+    namespace = {"sql": gban_sql, "check_and_ban": check_and_ban, "get_member": get_member,
+                 "is_user_admin": is_user_admin, "Bot": Bot, "Update": Update}
+    exec(compile(source, GBAN_MODULE, "exec"), namespace)
+    return namespace["enforce_gban"]
+
+
+CHECKS = (
+    ("old", lambda: OLD_ENFORCE_GBAN),
+    ("shipped", load_shipped_source),
+)
+
+
+def make_updates(chat, num_messages, num_gbanned, gbanned_rate):
+    updates = []
+    for _ in range(num_messages):
+        if num_gbanned and random.random() < gbanned_rate:
+            sender = User(GBANNED_BASE + random.randrange(num_gbanned))
+        else:
+            sender = User(random.randrange(GBANNED_BASE))
+        roll = random.random()
+        if roll < 0.05:
+            message = Message(sender, new_chat_members=[sender])
+        elif roll < 0.25:
+            message = Message(sender, reply_to_message=Message(User(random.randrange(GBANNED_BASE))))
+        else:
+            message = Message(sender)
+        updates.append(Update(chat, message))
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000, help="messages to check")
+    parser.add_argument("--gbanned", type=int, default=50000, help="users on the gban list")
+    parser.add_argument("--gbanned-rate", type=float, default=0.001, help="share of messages sent by gbanned users")
+    args = parser.parse_args()
+
+    chat = Chat(-1001234567890)
+    updates = make_updates(chat, args.messages, args.gbanned, args.gbanned_rate)
+    bot = Bot()
+
+    print("{:<10}{:>12}{:>16}{:>10}".format("check", "us/msg", "API calls/msg", "bans"))
+    for label, source in CHECKS:
+        bans = []
+        enforce_gban = build_handler(source(), GbanSql(args.gbanned), bans)
+        chat.api_calls = 0
+        start = time.perf_counter()
+        for update in updates:
+            enforce_gban(bot, update)
+        elapsed = time.perf_counter() - start
+        print("{:<10}{:>12.2f}{:>16.3f}{:>10}".format(label, elapsed / len(updates) * 1e6,
+                                                      chat.api_calls / len(updates), len(bans)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+The bot package configures itself and connects to Telegram on import, so the tests stand a bare `tg_bot` package in
+for it: the real sources, with just the settings the modules under test read, on an in-memory SQLite database.
+"""
+import logging
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubDispatcher(object):
+    """
+    Just the handler bookkeeping of a dispatcher, for modules that register their handlers on import.
+    """
+
+    def __init__(self):
+        self.bot = types.SimpleNamespace(id=1000, username="test_bot", defaults=None)
+        self.handlers = {}
+        self.groups = []
+
+    def add_handler(self, handler, group=0):
+        if group not in self.handlers:
+            self.handlers[group] = []
+            self.groups = sorted(self.handlers)
+        self.handlers[group].append(handler)
+
+    def remove_handler(self, handler, group=0):
+        if handler in self.handlers.get(group, ()):
+            self.handlers[group].remove(handler)
+
+
+def _install_test_package():
+    package = types.ModuleType("tg_bot")
+    package.__path__ = [os.path.join(ROOT, "tg_bot")]
+    package.LOGGER = logging.getLogger("tg_bot")
+
+    package.DB_URI = "sqlite://"
+    package.DB_POOL_SIZE = 4
+    package.DB_MAX_OVERFLOW = 2
+    package.DB_POOL_TIMEOUT = 5
+    package.DB_POOL_RECYCLE = 1800
+    package.DB_POOL_PRE_PING = True
+
+    package.OWNER_ID = 1
+    package.SUDO_USERS = [1]
+    package.SUPPORT_USERS = []
+    package.WHITELIST_USERS = []
+    package.LOAD = []
+    package.NO_LOAD = []
+    package.DEL_CMDS = False
+    package.STRICT_GBAN = False
+    package.ALLOW_EXCL = False
+    package.dispatcher = StubDispatcher()
+
+    sys.modules["tg_bot"] = package
+
+
+_install_test_package()
@@ -0,0 +1,138 @@
+import datetime
+import types
+
+import pytest
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import CommandHandler
+
+from conftest import StubDispatcher
+from tg_bot.modules.helper_funcs.chat_status import ADMIN_CACHE, is_user_admin
+from tg_bot.modules.helper_funcs.handlers import install_command_router
+from tg_bot.modules.disable import DisableAbleCommandHandler
+from tg_bot.modules.sql import disable_sql, locks_sql
+
+CHAT_ID = -1001
+ADMIN_ID = 1  # a sudo user
+MEMBER_ID = 2
+BOT = types.SimpleNamespace(id=1000, username="test_bot")
+
+
+class LockableCommandHandler(CommandHandler):
+    # what locks.py swaps in for tg.CommandHandler
+    def check_update(self, update):
+        return super().check_update(update) and not (
+                locks_sql.is_restr_locked(update.effective_chat.id, 'messages') and not is_user_admin(
+                    update.effective_chat, update.effective_user.id))
+
+
+def make_update(text, user_id=MEMBER_ID, update_id=[0]):
+    update_id[0] += 1
+    chat = Chat(CHAT_ID, Chat.SUPERGROUP)
+    command = text.split(None, 1)[0]
+    message = Message(update_id[0], datetime.datetime.now(), chat, from_user=User(user_id, "user", False), text=text,
+                      entities=[MessageEntity(MessageEntity.BOT_COMMAND, 0, len(command))], bot=BOT)
+    return Update(update_id[0], message=message)
+
+
+def noop(bot, update):
+    pass
+
+
+@pytest.fixture
+def router():
+    dispatcher = StubDispatcher()
+    install_command_router(dispatcher)
+    ADMIN_CACHE.set(CHAT_ID, {})  # nobody but the sudo user is admin, without asking Telegram
+    yield dispatcher
+    ADMIN_CACHE.pop(CHAT_ID)
+    for command in ("info", "rules"):
+        disable_sql.enable_command(CHAT_ID, command)
+    locks_sql.update_restriction(CHAT_ID, 'messages', locked=False)
+
+
+def routed(dispatcher, update):
+    router, = dispatcher.handlers[0]
+    if router.check_update(update):
+        return router._chosen.handler
+    return None
+
+
+def test_routes_by_command(router):
+    info = CommandHandler("info", noop)
+    rules = CommandHandler(["rules", "rule"], noop)
+    router.add_handler(info)
+    router.add_handler(rules)
+
+    assert len(router.handlers[0]) == 1
+    assert routed(router, make_update("/info")) is info
+    assert routed(router, make_update("/rule@test_bot now")) is rules
+    assert routed(router, make_update("/rules@other_bot")) is None
+    assert routed(router, make_update("/unknown")) is None
+
+    router.remove_handler(info)
+    assert routed(router, make_update("/info")) is None
+
+
+def test_disabled_commands(router):
+    info = DisableAbleCommandHandler("info", noop)
+    rules = DisableAbleCommandHandler("rules", noop, admin_ok=True)
+    router.add_handler(info)
+    router.add_handler(rules)
+    disable_sql.disable_command(CHAT_ID, "info")
+    disable_sql.disable_command(CHAT_ID, "rules")
+
+    assert routed(router, make_update("/info")) is None
+    assert routed(router, make_update("/info", user_id=ADMIN_ID)) is None
+    # admins can still use disabled commands registered as admin_ok
+    assert routed(router, make_update("/rules")) is None
+    assert routed(router, make_update("/rules", user_id=ADMIN_ID)) is rules
+
+    disable_sql.enable_command(CHAT_ID, "info")
+    assert routed(router, make_update("/info")) is info
+
+
+def test_messages_lock(router):
+    info = LockableCommandHandler("info", noop)
+    router.add_handler(info)
+    locks_sql.update_restriction(CHAT_ID, 'messages', locked=True)
+
+    assert routed(router, make_update("/info")) is None
+    assert routed(router, make_update("/info", user_id=ADMIN_ID)) is info
+
+
+def test_falls_through_to_next_handler(router):
+    locked = LockableCommandHandler("info", noop)
+    fallback = CommandHandler("info", noop)
+    router.add_handler(locked)
+    router.add_handler(fallback)
+    locks_sql.update_restriction(CHAT_ID, 'messages', locked=True)
+
+    assert routed(router, make_update("/info")) is fallback
+
+
+def dispatch(dispatcher, update, context=None):
+    # the way the dispatcher hands an update to the first handler of a group that accepts it
+    router, = dispatcher.handlers[0]
+    check = router.check_update(update)
+    assert check is not None and check is not False
+    return router.handle_update(update, dispatcher, check, context)
+
+
+def test_handle_update_passes_args(router):
+    calls = []
+    router.add_handler(CommandHandler("info", lambda bot, update, args: calls.append(args), pass_args=True))
+    router.add_handler(DisableAbleCommandHandler("rules", lambda bot, update, args: calls.append(args),
+                                                 pass_args=True, admin_ok=True))
+    disable_sql.disable_command(CHAT_ID, "rules")
+
+    dispatch(router, make_update("/info @someone 3"))
+    dispatch(router, make_update("/rules now", user_id=ADMIN_ID))
+    assert calls == [["@someone", "3"], ["now"]]
+
+
+def test_handle_update_with_context(router):
+    seen = []
+    router.add_handler(CommandHandler("info", lambda update, context: seen.append(context.args)))
+
+    dispatch(router, make_update("/info me"), context=types.SimpleNamespace())
+    assert seen == [["me"]]
@@ -0,0 +1,23 @@
+import time
+
+from sqlalchemy import create_engine, event
+
+from tg_bot.modules.sql import POOL_STATS, POOL_WAIT_THRESHOLD, MeteredQueuePool
+
+
+def test_connect_time_is_not_counted_as_waiting(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "pool.db"), poolclass=MeteredQueuePool,
+                           pool_size=1, max_overflow=1)
+
+    @event.listens_for(engine, "connect")
+    def slow_connect(dbapi_connection, connection_record):
+        time.sleep(POOL_WAIT_THRESHOLD * 4)
+
+    before = POOL_STATS.snapshot()
+    with engine.connect(), engine.connect():  # the second one is an overflow connection
+        pass
+    after = POOL_STATS.snapshot()
+
+    assert after["checkouts"] - before["checkouts"] == 2
+    assert after["waits"] == before["waits"]
+    assert after["peak_in_use"] >= 2
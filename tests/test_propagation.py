@@ -0,0 +1,22 @@
+from telegram.error import BadRequest
+
+from tg_bot.modules.helper_funcs.propagation import OUTCOME_OK, PropagationJob
+
+
+def test_failing_error_handler_is_recorded(monkeypatch):
+    monkeypatch.setattr("tg_bot.modules.helper_funcs.propagation.PROPAGATION_MIN_INTERVAL", 0)
+    done = []
+
+    def action(chat_id):
+        if chat_id == "-2":
+            raise BadRequest("Chat not found")
+
+    def on_error(chat_id, excp):
+        raise RuntimeError("database went away")
+
+    job = PropagationJob(["-1", "-2", "-3"], action, on_error=on_error, on_done=done.append, workers=2,
+                         checkpoint=lambda job, last: True, checkpoint_every=2)
+    job.run()
+
+    assert done == [job]
+    assert job.results == {"-1": OUTCOME_OK, "-2": "database went away", "-3": OUTCOME_OK}
@@ -0,0 +1,153 @@
+import importlib
+import os
+
+import pytest
+
+from conftest import ROOT
+
+SQL_MODULES = sorted(name[:-3] for name in os.listdir(os.path.join(ROOT, "tg_bot", "modules", "sql"))
+                     if name.endswith(".py") and name not in ("__init__.py", "backends.py"))
+
+
+@pytest.mark.parametrize("name", SQL_MODULES)
+def test_sql_module_imports_on_sqlite(name):
+    importlib.import_module("tg_bot.modules.sql." + name)
+
+
+def test_warn_reasons_round_trip():
+    warns_sql = importlib.import_module("tg_bot.modules.sql.warns_sql")
+    warns_sql.warn_user(42, -100, "spam")
+    num, reasons = warns_sql.warn_user(42, -100, "flood")
+    assert num == 2
+    assert reasons == ["spam", "flood"]
+
+
+def test_note_buttons_keep_their_order():
+    notes_sql = importlib.import_module("tg_bot.modules.sql.notes_sql")
+    notes_sql.add_note_button_to_db(-100, "rules", "first", "https://example.com/1", False)
+    notes_sql.add_note_button_to_db(-100, "rules", "second", "https://example.com/2", True)
+    assert [button.name for button in notes_sql.get_buttons(-100, "rules")] == ["first", "second"]
+
+
+def test_username_index_creation_is_repeatable():
+    users_sql = importlib.import_module("tg_bot.modules.sql.users_sql")
+    # what the next start against an existing database runs
+    with users_sql.SESSION.get_bind().begin() as conn:
+        conn.execute(users_sql.text(users_sql.USERNAME_LOWER_INDEX))
+
+
+def test_flood_tracker_follows_a_changed_limit():
+    antiflood_sql = importlib.import_module("tg_bot.modules.sql.antiflood_sql")
+    antiflood_sql.set_flood(-200, 5)
+    for _ in range(3):
+        assert not antiflood_sql.update_flood(-200, 42)
+
+    # a limit that changes under a live tracker, without set_flood dropping it first
+    antiflood_sql.CHAT_FLOOD["-200"] = 2
+    antiflood_sql.update_flood(-200, 42)
+    assert antiflood_sql.FLOOD_TRACKERS["-200"].limit == 2
+
+
+def test_failed_user_flush_keeps_the_buffer(monkeypatch):
+    users_sql = importlib.import_module("tg_bot.modules.sql.users_sql")
+    users_sql.buffer_user(77, "requeued", -300, "chat")
+
+    def broken_scope():
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(users_sql, "session_scope", broken_scope)
+    assert users_sql.flush_user_buffer() == 0
+    assert (77, "-300") in users_sql.USER_BUFFER
+
+    monkeypatch.undo()
+    assert users_sql.flush_user_buffer() >= 1
+    assert users_sql.get_chat_members(-300)[0].user == 77
+
+
+def test_superseded_gban_fanout_is_cancelled():
+    global_bans_sql = importlib.import_module("tg_bot.modules.sql.global_bans_sql")
+    first = global_bans_sql.start_fanout(55, "gban")
+    global_bans_sql.start_fanout(55, "ungban")
+    latest = global_bans_sql.start_fanout(55, "gban")
+
+    # the first gban run must not touch the newer run of the same action
+    assert not global_bans_sql.set_fanout_cursor(55, first, "-100")
+    global_bans_sql.finish_fanout(55, first)
+    assert global_bans_sql.get_pending_fanouts() == [(55, "gban", latest, "")]
+
+    assert global_bans_sql.set_fanout_cursor(55, latest, "-100")
+    global_bans_sql.finish_fanout(55, latest)
+    assert global_bans_sql.get_pending_fanouts() == []
+
+
+def test_clean_welcome_updates_the_cached_settings_in_place(monkeypatch):
+    welcome_sql = importlib.import_module("tg_bot.modules.sql.welcome_sql")
+    welcome_sql.set_welcome_security(-400, "soft")
+    cached = welcome_sql.get_welcome_settings(-400)
+
+    def no_reads(chat_id):
+        raise AssertionError("set_clean_welcome reloaded every welcome table")
+
+    monkeypatch.setattr(welcome_sql, "__read_welcome_settings", no_reads)
+    welcome_sql.set_clean_welcome(-400, 1234)
+
+    settings = welcome_sql.get_welcome_settings(-400)
+    assert settings.clean_welcome == 1234
+    assert settings.security == "soft"
+    assert cached.clean_welcome != 1234  # instances handed out earlier are never mutated
+
+
+def test_fban_list_is_a_snapshot():
+    feds_sql = importlib.import_module("tg_bot.modules.sql.feds_sql")
+    assert feds_sql.get_all_fban_users("unknown-fed") == set()
+    assert "unknown-fed" not in feds_sql.FEDERATION_BANNED_USERID
+
+    feds_sql.fban_user("fed-500", 501, "first", None, None, "spam")
+    banned = feds_sql.get_all_fban_users("fed-500")
+    feds_sql.fban_user("fed-500", 502, "second", None, None, "spam")
+    feds_sql.un_fban_user("fed-500", 501)
+
+    assert banned == {501}
+    assert feds_sql.get_all_fban_users("fed-500") == {502}
+    assert feds_sql.get_all_fban_users_target("fed-500", 501) is False
+
+
+def test_unparseable_legacy_fed_admins_are_kept():
+    feds_sql = importlib.import_module("tg_bot.modules.sql.feds_sql")
+    feds_sql.SESSION.add(feds_sql.Federations("600", "good", "fed-good", None, str({'owner': 600, 'members': "[601]"})))
+    feds_sql.SESSION.add(feds_sql.Federations("700", "broken", "fed-broken", None, "{'owner': 700, 'memb"))
+    feds_sql.SESSION.commit()
+
+    getattr(feds_sql, "__load_all_fed_admins")()
+
+    assert feds_sql.FEDERATION_ADMINS["fed-good"] == {601}
+    assert feds_sql.SESSION.query(feds_sql.Federations).get("fed-good").fed_users is None
+    assert feds_sql.SESSION.query(feds_sql.Federations).get("fed-broken").fed_users == "{'owner': 700, 'memb"
+    feds_sql.SESSION.close()
+
+
+def test_removed_chat_is_written_again():
+    users_sql = importlib.import_module("tg_bot.modules.sql.users_sql")
+    users_sql.buffer_user(81, "member", -800, "chat")
+    users_sql.flush_user_buffer()
+    users_sql.rem_chat(-800)
+
+    users_sql.buffer_user(81, "member", -800, "chat")
+    assert (81, "-800") in users_sql.USER_BUFFER
+    users_sql.flush_user_buffer()
+    assert [chat.chat_id for chat in users_sql.get_all_chats()].count("-800") == 1
+
+
+def test_migrated_chat_moves_its_buffered_members():
+    users_sql = importlib.import_module("tg_bot.modules.sql.users_sql")
+    users_sql.buffer_user(82, "member", -810, "group")
+    users_sql.flush_user_buffer()
+    users_sql.buffer_user(83, "other", -810, "group")
+
+    users_sql.migrate_chat(-810, -820)
+    assert (83, "-810") not in users_sql.USER_BUFFER
+    users_sql.flush_user_buffer()
+
+    chat_ids = {chat.chat_id for chat in users_sql.get_all_chats()}
+    assert "-810" not in chat_ids
+    assert {member.user for member in users_sql.get_chat_members(-820)} == {82, 83}
@@ -60,6 +60,11 @@ if ENV:
     DEL_CMDS = bool(os.environ.get("DEL_CMDS", False))
     STRICT_GBAN = bool(os.environ.get("STRICT_GBAN", False))
     WORKERS = int(os.environ.get("WORKERS", 8))
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", WORKERS + 4))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "True").lower() not in ("0", "false", "no")
     BAN_STICKER = os.environ.get("BAN_STICKER", "CAADAgADOwADPPEcAXkko5EB3YGYAg")
     KICK_STICKER = os.environ.get("KICK_STICKER", False)
     ALLOW_EXCL = os.environ.get("ALLOW_EXCL", False)
@@ -96,6 +101,11 @@ else:
     DEL_CMDS = Config.DEL_CMDS
     STRICT_GBAN = Config.STRICT_GBAN
     WORKERS = Config.WORKERS
+    DB_POOL_SIZE = Config.DB_POOL_SIZE or WORKERS + 4
+    DB_MAX_OVERFLOW = Config.DB_MAX_OVERFLOW
+    DB_POOL_TIMEOUT = Config.DB_POOL_TIMEOUT
+    DB_POOL_RECYCLE = Config.DB_POOL_RECYCLE
+    DB_POOL_PRE_PING = Config.DB_POOL_PRE_PING
     BAN_STICKER = Config.BAN_STICKER
     KICK_STICKER = Config.KICK_STICKER
     ALLOW_EXCL = Config.ALLOW_EXCL
@@ -117,9 +127,12 @@ WHITELIST_USERS = list(WHITELIST_USERS)
 SUPPORT_USERS = list(SUPPORT_USERS)
 
 # Import custom handlers after variables are set
-from tg_bot.modules.helper_funcs.handlers import CustomCommandHandler, CustomRegexHandler
+from tg_bot.modules.helper_funcs.handlers import CustomCommandHandler, CustomRegexHandler, install_command_router
 
 # Override telegram.ext handlers if needed
 tg.RegexHandler = CustomRegexHandler
 if ALLOW_EXCL:
     tg.CommandHandler = CustomCommandHandler
+
+# Route commands through a single lookup per handler group instead of asking every command handler in turn
+COMMAND_ROUTERS = install_command_router(dispatcher)
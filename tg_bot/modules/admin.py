@@ -4,18 +4,21 @@ from typing import Optional, List
 from telegram import Message, Chat, Update, Bot, User
 from telegram import ParseMode
 from telegram.error import BadRequest
-from telegram.ext import CommandHandler, Filters
+from telegram.ext import CommandHandler, MessageHandler, Filters
 from telegram.ext.dispatcher import run_async
 from telegram.utils.helpers import escape_markdown, mention_html
 
 from tg_bot import dispatcher
 from tg_bot.modules.disable import DisableAbleCommandHandler
-from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin
+from tg_bot.modules.helper_funcs.chat_status import bot_admin, can_promote, user_admin, can_pin, invalidate_member, \
+    get_chat_admins, refresh_admin_cache, invalidate_admin_cache
 from tg_bot.modules.helper_funcs.extraction import extract_user
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.connection import connected
 from tg_bot.modules.translations.strings import tld
 
+MEMBER_CACHE_GROUP = -1
+
 @run_async
 @bot_admin
 @user_admin
@@ -63,6 +66,8 @@ def promote(bot: Bot, update: Update, args: List[str]) -> str:
                           can_restrict_members=bot_member.can_restrict_members,
                           can_pin_messages=bot_member.can_pin_messages,
                           can_promote_members=bot_member.can_promote_members)
+    invalidate_member(chatD.id, user_id)
+    invalidate_admin_cache(chatD.id)
 
     message.reply_text(tld(chat.id, f"Successfully promoted {mention_html(user_member.user.id, user_member.user.first_name)} in {html.escape(chatD.title)}!"), parse_mode=ParseMode.HTML)
     return f"<b>{html.escape(chatD.title)}:</b>" \
@@ -120,6 +125,8 @@ def demote(bot: Bot, update: Update, args: List[str]) -> str:
                               can_restrict_members=False,
                               can_pin_messages=False,
                               can_promote_members=False)
+        invalidate_member(chatD.id, user_id)
+        invalidate_admin_cache(chatD.id)
         message.reply_text(tld(chat.id, f"Successfully demoted in *{chatD.title}*!"), parse_mode=ParseMode.MARKDOWN)
         return f"<b>{html.escape(chatD.title)}:</b>" \
                 "\n#DEMOTED" \
@@ -210,9 +217,10 @@ def invite(bot: Bot, update: Update):
 
 @run_async
 def adminlist(bot: Bot, update: Update):
-    administrators = update.effective_chat.get_administrators()
+    chat = update.effective_chat  # type: Optional[Chat]
+    administrators = get_chat_admins(chat).values()
     msg = update.effective_message
-    text = "Admins in *{}*:".format(update.effective_chat.title or "this chat")
+    text = "Admins in *{}*:".format(chat.title or "this chat")
     for admin in administrators:
         user = admin.user
         status = admin.status
@@ -225,19 +233,35 @@ def adminlist(bot: Bot, update: Update):
     for admin in administrators:
         user = admin.user
         status = admin.status
-        chat = update.effective_chat
-        count = chat.get_members_count()
         name = "[{}](tg://user?id={})".format(user.first_name + " " + (user.last_name or ""), user.id)
         if user.username:
             name = escape_markdown("@" + user.username)
             
         if status == "administrator":
             text += "\n`👮🏻 `{}".format(name)
-            members = "\n\n*Members:*\n`🧒 ` {} users".format(count)
-            
+
+    count = chat.get_members_count()
+    members = "\n\n*Members:*\n`🧒 ` {} users".format(count)
     msg.reply_text(text + members, parse_mode=ParseMode.MARKDOWN)
 
 
+@run_async
+@user_admin
+def admincache(bot: Bot, update: Update):
+    refresh_admin_cache(update.effective_chat)
+    invalidate_member(update.effective_chat.id)
+    update.effective_message.reply_text(tld(update.effective_chat.id, "Admin list refreshed!"))
+
+
+def member_update(bot: Bot, update: Update):
+    chat = update.effective_chat  # type: Optional[Chat]
+    message = update.effective_message  # type: Optional[Message]
+    for new_member in message.new_chat_members or []:
+        invalidate_member(chat.id, new_member.id)
+    if message.left_chat_member:
+        invalidate_member(chat.id, message.left_chat_member.id)
+        invalidate_admin_cache(chat.id, message.left_chat_member.id)
+
 
 def __chat_settings__(chat_id, user_id):
     return "You are *admin*: `{}`".format(
@@ -253,6 +277,7 @@ __help__ = """
  - /invitelink: gets invitelink
  - /promote: promotes the user replied to
  - /demote: demotes the user replied to
+ - /admincache: refresh the cached list of admins, eg after promoting someone without using the bot
 """
 
 __mod_name__ = "Admin"
@@ -266,6 +291,9 @@ PROMOTE_HANDLER = CommandHandler("promote", promote, pass_args=True, filters=Fil
 DEMOTE_HANDLER = CommandHandler("demote", demote, pass_args=True, filters=Filters.group)
 
 ADMINLIST_HANDLER = DisableAbleCommandHandler("adminlist", adminlist, filters=Filters.group)
+ADMINCACHE_HANDLER = CommandHandler("admincache", admincache, filters=Filters.group)
+MEMBER_UPDATE_HANDLER = MessageHandler(Filters.status_update.new_chat_members | Filters.status_update.left_chat_member,
+                                       member_update)
 
 dispatcher.add_handler(PIN_HANDLER)
 dispatcher.add_handler(UNPIN_HANDLER)
@@ -273,3 +301,5 @@ dispatcher.add_handler(INVITE_HANDLER)
 dispatcher.add_handler(PROMOTE_HANDLER)
 dispatcher.add_handler(DEMOTE_HANDLER)
 dispatcher.add_handler(ADMINLIST_HANDLER)
+dispatcher.add_handler(ADMINCACHE_HANDLER)
+dispatcher.add_handler(MEMBER_UPDATE_HANDLER, MEMBER_CACHE_GROUP)
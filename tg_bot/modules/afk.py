@@ -35,7 +35,7 @@ def no_longer_afk(bot: Bot, update: Update):
     user = update.effective_user  # type: Optional[User]
     chat = update.effective_chat  # type: Optional[Chat]
 
-    if not user:  # ignore channels
+    if not user or not sql.is_afk(user.id):  # ignore channels and the (many) users who aren't AFK
         return
 
     res = sql.rm_afk(user.id)
@@ -49,19 +49,24 @@ def no_longer_afk(bot: Bot, update: Update):
 
 @run_async
 def reply_afk(bot: Bot, update: Update):
+    if not sql.any_afk():
+        return
+
     message = update.effective_message  # type: Optional[Message]
     if message.entities and message.parse_entities([MessageEntity.TEXT_MENTION, MessageEntity.MENTION]):
         entities = message.parse_entities([MessageEntity.TEXT_MENTION, MessageEntity.MENTION])
         for ent in entities:
             if ent.type == MessageEntity.TEXT_MENTION:
                 user_id = ent.user.id
+                if not sql.is_afk(user_id):
+                    continue
                 fst_name = ent.user.first_name
 
             elif ent.type == MessageEntity.MENTION:
                 user_id = get_user_id(message.text[ent.offset:ent.offset + ent.length])
-                if not user_id:
-                    # Should never happen, since for a user to become AFK they must have spoken. Maybe changed username?
-                    return
+                # an unknown username can't belong to an AFK user, since they must have spoken to become AFK
+                if not user_id or not sql.is_afk(user_id):
+                    continue
                 try:
                     chat = bot.get_chat(user_id)
                 except BadRequest:
@@ -82,13 +87,15 @@ def reply_afk(bot: Bot, update: Update):
 
 def check_afk(bot, update, user_id, fst_name):
     chat = update.effective_chat  # type: Optional[Chat]
-    if sql.is_afk(user_id):
-        user = sql.check_afk_status(user_id)
-        if not user.reason:
-            res = tld(chat.id, f"{fst_name} is AFK!")
-        else:
-            res = tld(chat.id, f"{fst_name} is AFK! says its because of:\n{user.reason}")
-        update.effective_message.reply_text(res)
+    reason = sql.get_afk_reason(user_id)
+    if reason is None:
+        return
+
+    if not reason:
+        res = tld(chat.id, f"{fst_name} is AFK!")
+    else:
+        res = tld(chat.id, f"{fst_name} is AFK! says its because of:\n{reason}")
+    update.effective_message.reply_text(res)
 
 
 __help__ = """
@@ -10,7 +10,7 @@ from tg_bot.modules.helper_funcs.extraction import extract_user_and_text
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, User, CallbackQuery
 
 from tg_bot import dispatcher
-from tg_bot.modules.helper_funcs.chat_status import is_user_admin, user_admin, can_restrict
+from tg_bot.modules.helper_funcs.chat_status import is_user_admin, user_admin, can_restrict, invalidate_member
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import antiflood_sql as sql
 from tg_bot.modules.connection import connected
@@ -29,31 +29,53 @@ def check_flood(bot: Bot, update: Update) -> str:
     if not user:  # ignore channels
         return ""
 
-    # ignore admins
+    # antiflood disabled, no need to look at the sender at all
+    if not sql.get_flood_limit(chat.id):
+        return ""
+
+    # ignore admins; answered from the cached admin roster, not a get_member call per message
     if is_user_admin(chat, user.id):
-        sql.update_flood(chat.id, None)
         return ""
 
-    should_ban = sql.update_flood(chat.id, user.id)
-    if not should_ban:
+    should_act = sql.update_flood(chat.id, user.id)
+    if not should_act:
         return ""
 
+    flood_type, value = sql.get_flood_setting(chat.id)
     try:
-        bot.restrict_chat_member(chat.id, user.id, can_send_messages=False)
-        msg.reply_text(tld(chat.id, "Alright! {} has been Muted for flooding the chat.".format(mention_html(user.id, user.first_name))), parse_mode=ParseMode.HTML)
+        if flood_type == sql.FLOOD_BAN:
+            chat.kick_member(user.id)
+            action, tag = "banned", "BANNED"
+        elif flood_type == sql.FLOOD_KICK:
+            chat.kick_member(user.id)
+            chat.unban_member(user.id)
+            action, tag = "kicked", "KICKED"
+        elif flood_type == sql.FLOOD_TBAN:
+            chat.kick_member(user.id, until_date=extract_time(msg, value))
+            action, tag = "temporarily banned for {}".format(value), "TBAN"
+        elif flood_type == sql.FLOOD_TMUTE:
+            bot.restrict_chat_member(chat.id, user.id, can_send_messages=False, until_date=extract_time(msg, value))
+            action, tag = "temporarily muted for {}".format(value), "TMUTE"
+        else:
+            bot.restrict_chat_member(chat.id, user.id, can_send_messages=False)
+            action, tag = "muted", "MUTED"
+        invalidate_member(chat.id, user.id)
+
+        msg.reply_text(tld(chat.id, "Alright! {} has been {} for flooding the chat.").format(
+            mention_html(user.id, user.first_name), action), parse_mode=ParseMode.HTML)
 
-        return "#MUTED" \
+        return "#{}" \
                "\n<b>Chat:</b> {}" \
                "\n<b>User:</b> {}" \
-               "\nFlooded the group.".format(html.escape(chat.title),
+               "\nFlooded the group.".format(tag, html.escape(chat.title),
                                              mention_html(user.id, user.first_name))
 
     except BadRequest:
-        msg.reply_text(tld(chat.id, "I can't Mute people here, give me permissions first! Until then, I'll disable antiflood."))
+        msg.reply_text(tld(chat.id, "I can't restrict people here, give me permissions first! Until then, I'll disable antiflood."))
         sql.set_flood(chat.id, 0)
         return "#INFO" \
                "\n<b>Chat:</b> {}" \
-               "\nDon't have Mute permissions, so automatically disabled antiflood.".format(chat.title)
+               "\nDon't have restrict permissions, so automatically disabled antiflood.".format(chat.title)
 
 
 @run_async
@@ -100,6 +122,27 @@ def set_flood(bot: Bot, update: Update, args: List[str]) -> str:
     return ""
 
 
+FLOOD_MODES = {
+    'ban': sql.FLOOD_BAN,
+    'kick': sql.FLOOD_KICK,
+    'mute': sql.FLOOD_MUTE,
+    'tban': sql.FLOOD_TBAN,
+    'tmute': sql.FLOOD_TMUTE,
+}
+
+
+def describe_flood_mode(flood_type, value) -> str:
+    if flood_type == sql.FLOOD_BAN:
+        return "ban"
+    elif flood_type == sql.FLOOD_KICK:
+        return "kick"
+    elif flood_type == sql.FLOOD_TBAN:
+        return "temporarily ban for {}".format(value)
+    elif flood_type == sql.FLOOD_TMUTE:
+        return "temporarily mute for {}".format(value)
+    return "mute"
+
+
 @run_async
 def flood(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
@@ -109,14 +152,14 @@ def flood(bot: Bot, update: Update):
         update.effective_message.reply_text(tld(chat.id, "I'm not currently enforcing flood control!"))
     else:
         update.effective_message.reply_text(tld(chat.id,
-            "I'm currently Muting users if they send more than {} consecutive messages.").format(limit))
+            "I'm currently going to {} users if they send more than {} messages in {} seconds.").format(
+            describe_flood_mode(*sql.get_flood_setting(chat.id)), limit, sql.FLOOD_WINDOW))
+
 
 @run_async
 @user_admin
-def set_flood_mode(bot: Bot, update: Update, args: List[str]):
-    spam = (update.effective_message.text, update.effective_message.from_user.id, update.effective_chat.id, update.effective_message)
-    if spam == True:
-        return
+@loggable
+def set_flood_mode(bot: Bot, update: Update, args: List[str]) -> str:
     chat = update.effective_chat  # type: Optional[Chat]
     user = update.effective_user  # type: Optional[User]
     msg = update.effective_message  # type: Optional[Message]
@@ -125,73 +168,53 @@ def set_flood_mode(bot: Bot, update: Update, args: List[str]):
     if conn:
         chat = dispatcher.bot.getChat(conn)
         chat_id = conn
-        chat_name = dispatcher.bot.getChat(conn).title
+        chat_name = chat.title
     else:
-        if update.effective_message.chat.type == "private":
-            update.effective_message.reply_text(tl(update.effective_message, "Use This Command in Groups,NOT in PM"))
+        if chat.type == "private":
+            msg.reply_text(tld(chat.id, "Use this command in groups, not in PM."))
             return ""
-        chat = update.effective_chat
-        chat_id = update.effective_chat.id
-        chat_name = update.effective_message.chat.title
-
-    if args:
-        if args[0].lower() == 'ban':
-            settypeflood = (update.effective_message, 'Banned')
-            sql.set_flood_strength(chat_id, 1, "0")
-        elif args[0].lower() == 'kick':
-            settypeflood = (update.effective_message, 'Kicked')
-            sql.set_flood_strength(chat_id, 2, "0")
-        elif args[0].lower() == 'mute':
-            settypeflood = (update.effective_message, 'Muted')
-            sql.set_flood_strength(chat_id, 3, "0")
-        elif args[0].lower() == 'tban':
-            if len(args) == 1:
-                teks = (update.effective_message, """Sepertinya Anda mencoba menetapkan nilai sementara untuk anti-banjir, tetapi belum menentukan waktu; gunakan `/setfloodmode tban <timevalue>`.
-Contoh nilai waktu: 4m = 4 menit, 3h = 3 jam, 6d = 6 hari, 5w = 5 minggu.""")
-                msg.reply_text(teks, parse_mode="markdown")
-                return
-            settypeflood = (update.effective_message, "blokir sementara selama {}").format(args[1])
-            sql.set_flood_strength(chat_id, 4, str(args[1]))
-        elif args[0].lower() == 'tmute':
-            if len(args) == 1:
-                teks = (update.effective_message, """Sepertinya Anda mencoba menetapkan nilai sementara untuk anti-banjir, tetapi belum menentukan waktu; gunakan `/setfloodmode tban <timevalue>`.
-Contoh nilai waktu: 4m = 4 menit, 3h = 3 jam, 6d = 6 hari, 5w = 5 minggu.""")
-                msg.reply_text(teks, parse_mode="markdown")
-                return
-            settypeflood = (update.effective_message, 'bisukan sementara selama {}').format(args[1])
-            sql.set_flood_strength(chat_id, 5, str(args[1]))
-        else:
-            msg.reply_text((update.effective_message, "I understand only ban/kick/mute/tban/tmute"))
-            return
-        if conn:
-            text = (update.effective_message, "Terlalu banyak mengirim pesan sekarang akan menghasilkan `{}` pada *{}*!").format(settypeflood, chat_name)
-        else:
-            text = (update.effective_message, "Terlalu banyak mengirim pesan sekarang akan menghasilkan `{}`!").format(settypeflood)
-        msg.reply_text(text, parse_mode="markdown")
-        return "<b>{}:</b>\n" \
-                "<b>Admin:</b> {}\n" \
-                "Has changed antiflood mode. User will {}.".format(settypeflood, html.escape(chat.title),
-                                                                            mention_html(user.id, user.first_name))
-    else:
-        getmode, getvalue = sql.get_flood_setting(chat.id)
-        if getmode == 1:
-            settypeflood = (update.effective_message, 'blokir')
-        elif getmode == 2:
-            settypeflood = (update.effective_message, 'tendang')
-        elif getmode == 3:
-            settypeflood = (update.effective_message, 'bisukan')
-        elif getmode == 4:
-            settypeflood = (update.effective_message, 'blokir sementara selama {}').format(getvalue)
-        elif getmode == 5:
-            settypeflood = (update.effective_message, 'bisukan sementara selama {}').format(getvalue)
+        chat_id = chat.id
+        chat_name = chat.title
+
+    if not args:
+        mode = describe_flood_mode(*sql.get_flood_setting(chat_id))
         if conn:
-            text = (update.effective_message, "Jika member mengirim pesan beruntun, maka dia akan *di {}* pada *{}*.").format(settypeflood, chat_name)
+            text = tld(chat.id, "I'll *{}* users who flood *{}*.").format(mode, chat_name)
         else:
-            text = (update.effective_message, "Jika member mengirim pesan beruntun, maka dia akan *di {}*.").format(settypeflood)
+            text = tld(chat.id, "I'll *{}* users who flood this chat.").format(mode)
         msg.reply_text(text, parse_mode=ParseMode.MARKDOWN)
-    return ""
-   
-        
+        return ""
+
+    flood_type = FLOOD_MODES.get(args[0].lower())
+    if flood_type is None:
+        msg.reply_text(tld(chat.id, "I only understand ban/kick/mute/tban/tmute!"))
+        return ""
+
+    value = "0"
+    if flood_type in (sql.FLOOD_TBAN, sql.FLOOD_TMUTE):
+        if len(args) == 1:
+            msg.reply_text(tld(chat.id, "You need to give a time for that mode, eg `/setfloodmode {} 3h`. "
+                                        "Valid units are m, h and d.").format(args[0].lower()),
+                           parse_mode=ParseMode.MARKDOWN)
+            return ""
+        if not extract_time(msg, args[1]):
+            return ""
+        value = args[1]
+
+    sql.set_flood_strength(chat_id, flood_type, value)
+    mode = describe_flood_mode(flood_type, value)
+    if conn:
+        text = tld(chat.id, "Done! I'll now *{}* users who flood *{}*.").format(mode, chat_name)
+    else:
+        text = tld(chat.id, "Done! I'll now *{}* users who flood this chat.").format(mode)
+    msg.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+
+    return "#SETFLOODMODE" \
+           "\n<b>Chat:</b> {}" \
+           "\n<b>Admin:</b> {}" \
+           "\nSet antiflood mode to {}.".format(html.escape(chat_name), mention_html(user.id, user.first_name), mode)
+
+
 def __migrate__(old_chat_id, new_chat_id):
     sql.migrate_chat(old_chat_id, new_chat_id)
 
@@ -202,13 +225,15 @@ def __chat_settings__(bot, update, chat, chatP, user):
     if limit == 0:
         return "*Not* currently enforcing flood control."
     else:
-        return "Antiflood is set to `{}` messages.".format(limit)
+        return "Antiflood is set to `{}` messages in {} seconds.".format(limit, sql.FLOOD_WINDOW)
 
 
 __help__ = """
  - /flood: Get the current flood control setting
 *Admin only:*
  - /setflood <int/'no'/'off'>: enables or disables flood control
+ - /setfloodmode <ban/kick/mute/tban/tmute> <value>: what to do with users who flood. tban and tmute take a \
+time, eg `/setfloodmode tmute 3h`.
 """
 
 __mod_name__ = "AntiFlood"
@@ -10,7 +10,7 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, User
 from tg_bot import dispatcher, BAN_STICKER, KICK_STICKER, LOGGER, OWNER_ID
 from tg_bot.modules.disable import DisableAbleCommandHandler
 from tg_bot.modules.helper_funcs.chat_status import bot_admin, user_admin, is_user_ban_protected, can_restrict, \
-    is_user_admin, is_user_in_chat, is_bot_admin
+    is_user_admin, is_user_in_chat, is_bot_admin, invalidate_member
 from tg_bot.modules.helper_funcs.extraction import extract_user_and_text
 from tg_bot.modules.helper_funcs.string_handling import extract_time
 from tg_bot.modules.log_channel import loggable
@@ -97,6 +97,7 @@ def ban(bot: Bot, update: Update, args: List[str]) -> str:
         
     try:
         chat.kick_member(user_id)
+        invalidate_member(chat.id, user_id)
         keyboard = []
         bot.send_sticker(chat.id, BAN_STICKER)
         message.reply_text(reply, reply_markup=keyboard, parse_mode=ParseMode.HTML)
@@ -177,6 +178,7 @@ def temp_ban(bot: Bot, update: Update, args: List[str]) -> str:
 
     try:
         chat.kick_member(user_id, until_date=bantime)
+        invalidate_member(chat.id, user_id)
         bot.send_sticker(chat.id, BAN_STICKER)
         message.reply_text("Banned! User will be banned for {}.".format(time_val))
         return log
@@ -228,6 +230,7 @@ def kick(bot: Bot, update: Update, args: List[str]) -> str:
         return ""
 
     res = chat.unban_member(user_id)  # unban on current user = kick
+    invalidate_member(chat.id, user_id)
     if res:
         log = "<b>{}:</b>" \
               "\n#KICKED" \
@@ -263,6 +266,7 @@ def kickme(bot: Bot, update: Update):
         return
 
     res = update.effective_chat.unban_member(user_id)  # unban on current user = kick
+    invalidate_member(update.effective_chat.id, user_id)
     if res:
         update.effective_message.reply_text("No problem.")
     else:
@@ -303,6 +307,7 @@ def unban(bot: Bot, update: Update, args: List[str]) -> str:
 
     
     chat.unban_member(user_id)
+    invalidate_member(chat.id, user_id)
     message.reply_text("Yep, {} can join back in {}!".format(mention_html(member.user.id, member.user.first_name), html.escape(chat.title)), parse_mode=ParseMode.HTML)
 
 
@@ -374,6 +379,7 @@ def rban(bot: Bot, update: Update, args: List[str]):
 
     try:
         chat.kick_member(user_id)
+        invalidate_member(chat.id, user_id)
         message.reply_text("Banned!")
     except BadRequest as excp:
         if excp.message == "Reply message not found":
@@ -441,6 +447,7 @@ def runban(bot: Bot, update: Update, args: List[str]):
 
     try:
         chat.unban_member(user_id)
+        invalidate_member(chat.id, user_id)
         message.reply_text("Yep, this user can join that chat!")
     except BadRequest as excp:
         if excp.message == "Reply message not found":
@@ -497,6 +504,7 @@ def sban(bot: Bot, update: Update, args: List[str]) -> str:
 
     try:
         chat.kick_member(user_id)
+        invalidate_member(chat.id, user_id)
         return log
 
     except BadRequest as excp:
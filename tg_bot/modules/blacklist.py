@@ -1,5 +1,4 @@
 import html
-import re
 from typing import Optional, List
 
 from telegram import Message, Chat, Update, Bot, ParseMode
@@ -116,18 +115,14 @@ def del_blacklist(bot: Bot, update: Update):
     if not to_match:
         return
 
-    chat_filters = sql.get_chat_blacklist(chat.id)
-    for trigger in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(trigger) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            try:
-                message.delete()
-            except BadRequest as excp:
-                if excp.message == "Message to delete not found":
-                    pass
-                else:
-                    LOGGER.exception("Error while deleting blacklist message.")
-            break
+    if sql.is_blacklisted_text(chat.id, to_match):
+        try:
+            message.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
+            else:
+                LOGGER.exception("Error while deleting blacklist message.")
 
 
 def __migrate__(old_chat_id, new_chat_id):
@@ -1,8 +1,7 @@
-import re
 from typing import Optional
 import html
 import telegram
-from telegram import ParseMode, InlineKeyboardMarkup, Message, Chat
+from telegram import Message, Chat
 from telegram import Update, Bot
 from telegram.error import BadRequest
 from telegram.ext import CommandHandler, MessageHandler, DispatcherHandlerStop, run_async
@@ -14,7 +13,6 @@ from tg_bot.modules.disable import DisableAbleCommandHandler
 from tg_bot.modules.helper_funcs.chat_status import user_admin
 from tg_bot.modules.helper_funcs.extraction import extract_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
-from tg_bot.modules.helper_funcs.misc import build_keyboard
 from tg_bot.modules.helper_funcs.string_handling import split_quotes, button_markdown_parser
 from tg_bot.modules.sql import cust_filters_sql as sql
 
@@ -195,51 +193,30 @@ def reply_filter(bot: Bot, update: Update):
     if not to_match:
         return
 
-    chat_filters = sql.get_chat_triggers(chat.id)
-    for keyword in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(keyword) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            filt = sql.get_filter(chat.id, keyword)
-            if filt.is_sticker:
-                message.reply_sticker(filt.reply)
-            elif filt.is_document:
-                message.reply_document(filt.reply)
-            elif filt.is_image:
-                message.reply_photo(filt.reply)
-            elif filt.is_audio:
-                message.reply_audio(filt.reply)
-            elif filt.is_voice:
-                message.reply_voice(filt.reply)
-            elif filt.is_video:
-                message.reply_video(filt.reply)
-            elif filt.has_markdown:
-                buttons = sql.get_buttons(chat.id, filt.keyword)
-                keyb = build_keyboard(buttons)
-                keyboard = InlineKeyboardMarkup(keyb)
-
-                try:
-                    message.reply_text(filt.reply, parse_mode=ParseMode.MARKDOWN,
-                                       disable_web_page_preview=True,
-                                       reply_markup=keyboard)
-                except BadRequest as excp:
-                    if excp.message == "Unsupported url protocol":
-                        message.reply_text("You seem to be trying to use an unsupported url protocol. Telegram "
-                                           "doesn't support buttons for some protocols, such as tg://. Please try "
-                                           "again, or ask in @CtrlSupport for help.")
-                    elif excp.message == "Reply message not found":
-                        bot.send_message(chat.id, filt.reply, parse_mode=ParseMode.MARKDOWN,
-                                         disable_web_page_preview=True,
-                                         reply_markup=keyboard)
-                    else:
-                        message.reply_text("This note could not be sent, as it is incorrectly formatted. Ask in "
-                                           "@CtrlSupport if you can't figure out why!")
-                        LOGGER.warning("Message %s could not be parsed", str(filt.reply))
-                        LOGGER.exception("Could not parse filter %s in chat %s", str(filt.keyword), str(chat.id))
-
-            else:
-                # LEGACY - all new filters will have has_markdown set to True.
-                message.reply_text(filt.reply)
-            break
+    keyword = sql.get_chat_filter_match(chat.id, to_match)
+    if not keyword:
+        return
+
+    filt = sql.get_filter_reply(chat.id, keyword)
+    if not filt:
+        return
+
+    try:
+        filt.send(message, filt.reply, **filt.send_kwargs)
+    except BadRequest as excp:
+        if not filt.parse_mode:
+            raise
+        if excp.message == "Unsupported url protocol":
+            message.reply_text("You seem to be trying to use an unsupported url protocol. Telegram "
+                               "doesn't support buttons for some protocols, such as tg://. Please try "
+                               "again, or ask in @CtrlSupport for help.")
+        elif excp.message == "Reply message not found":
+            bot.send_message(chat.id, filt.reply, **filt.send_kwargs)
+        else:
+            message.reply_text("This note could not be sent, as it is incorrectly formatted. Ask in "
+                               "@CtrlSupport if you can't figure out why!")
+            LOGGER.warning("Message %s could not be parsed", str(filt.reply))
+            LOGGER.exception("Could not parse filter %s in chat %s", str(filt.keyword), str(chat.id))
 
 
 def __stats__():
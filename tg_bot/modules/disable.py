@@ -6,7 +6,7 @@ from telegram.ext import CommandHandler, RegexHandler, Filters
 from telegram.utils.helpers import escape_markdown
 
 from tg_bot import dispatcher
-from tg_bot.modules.helper_funcs.handlers import CMD_STARTERS
+from tg_bot.modules.helper_funcs.handlers import CMD_STARTERS, parse_command
 from tg_bot.modules.helper_funcs.misc import is_module_loaded
 
 FILENAME = __name__.rsplit(".", 1)[-1]
@@ -38,17 +38,18 @@ if is_module_loaded(FILENAME):
         def check_update(self, update):
             chat = update.effective_chat  # type: Optional[Chat]
             user = update.effective_user  # type: Optional[User]
-            if super().check_update(update):
-                # Should be safe since check_update passed.
-                command = update.effective_message.text_html.split(None, 1)[0][1:].split('@')[0]
+            check = super().check_update(update)
+            if check:
+                # Should be safe since check_update passed; parse_command hands back what it already parsed.
+                command = parse_command(update)[1]
 
-                # disabled, admincmd, user admin
+                # disabled, admincmd, user admin. The parent's result is handed back, as it carries the args.
                 if sql.is_command_disabled(chat.id, command):
-                    return command in ADMIN_CMDS and is_user_admin(chat, user.id)
+                    return check if command in ADMIN_CMDS and is_user_admin(chat, user.id) else False
 
                 # not disabled
                 else:
-                    return True
+                    return check
 
             return False
 
@@ -1,5 +1,5 @@
 import html
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 from typing import Optional, List
 import random
 import uuid
@@ -17,8 +17,9 @@ from telegram.utils.helpers import escape_markdown, mention_html, mention_markdo
 from tg_bot import dispatcher, OWNER_ID, SUDO_USERS, WHITELIST_USERS, MESSAGE_DUMP, LOGGER
 from tg_bot.modules.helper_funcs.handlers import CMD_STARTERS
 from tg_bot.modules.helper_funcs.misc import is_module_loaded, send_to_list
-from tg_bot.modules.helper_funcs.chat_status import is_user_admin
+from tg_bot.modules.helper_funcs.chat_status import is_user_admin, get_chat_admins
 from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
+from tg_bot.modules.helper_funcs.propagation import PropagationJob
 from tg_bot.modules.helper_funcs.string_handling import markdown_parser
 from tg_bot.modules.disable import DisableAbleCommandHandler
 
@@ -35,6 +36,8 @@ import tg_bot.modules.sql.feds_sql as sql
 #
 # Total spended for making this features is 68+ hours
 
+FBAN_IMPORT_MAX_SIZE = 20 * 1024 * 1024  # the most the bot API lets us download
+
 LOGGER.info("Original federation module by MrYacha, reworked by Mizukito Akito (@RealAkito) on Telegram.")
 
 def escape_html(word):
@@ -162,7 +165,7 @@ def join_fed(bot: Bot, update: Update, args: List[str]):
     chat = update.effective_chat  # type: Optional[Chat]
     user = update.effective_user  # type: Optional[User]
     message = update.effective_message
-    administrators = chat.get_administrators()
+    administrators = get_chat_admins(chat).values()
     fed_id = sql.get_fed_id(chat.id)
 
     if user.id in SUDO_USERS:
@@ -236,8 +239,7 @@ def user_join_fed(bot: Bot, update: Update, args: List[str]):
 		getuser = sql.search_user_in_fed(fed_id, user_id)
 		fed_id = sql.get_fed_id(chat.id)
 		info = sql.get_fed_info(fed_id)
-		get_owner = eval(info['fusers'])['owner']
-		get_owner = bot.get_chat(get_owner).id
+		get_owner = int(info['owner'])
 		if user_id == get_owner:
 			update.effective_message.reply_text("Why are you trying to promote the federation owner?")
 			return
@@ -375,6 +377,46 @@ def fed_admin(bot: Bot, update: Update, args: List[str]):
 	update.effective_message.reply_text(text, parse_mode=ParseMode.HTML)
 
 
+FED_CHAT_LEFT = "left"
+
+
+def __fban_error_handler(fed_name, ignored_errors):
+	def on_error(fed_chat, excp):
+		if excp.message in ignored_errors:
+			try:
+				dispatcher.bot.getChat(fed_chat)
+			except Unauthorized:
+				sql.chat_leave_fed(fed_chat)
+				LOGGER.info("Chat {} has left fed {} because bot has been kicked.".format(fed_chat, fed_name))
+				return FED_CHAT_LEFT
+			except TelegramError:
+				pass
+		else:
+			LOGGER.warning("Could not update fban in {} because: {}".format(fed_chat, excp.message))
+		return excp.message
+
+	return on_error
+
+
+def __propagate(message, fed_chats, action, on_error, title):
+	# Apply an fban/unfban to every federation chat in the background, reporting progress in one status message.
+	if not fed_chats:
+		return
+	status = message.reply_text("{}: applying in {} chats...".format(title, len(fed_chats)))
+
+	def on_progress(job):
+		status.edit_text("{}: {}/{} chats done...".format(title, job.processed, job.total))
+
+	def on_done(job):
+		text = "{} applied in {}/{} chats in {:.1f}s.".format(title, job.succeeded, job.total, job.elapsed)
+		left = job.count(FED_CHAT_LEFT)
+		if left:
+			text += " Left {} chats I was removed from.".format(left)
+		status.edit_text(text)
+
+	PropagationJob(fed_chats, action, on_error=on_error, on_progress=on_progress, on_done=on_done).start()
+
+
 @run_async
 def fed_ban(bot: Bot, update: Update, args: List[str]):
 	chat = update.effective_chat  # type: Optional[Chat]
@@ -465,17 +507,8 @@ def fed_ban(bot: Bot, update: Update, args: List[str]):
 			message.reply_text("Failed to ban from the federation! If this problem persists, reach out to us @CtrlSupport.")
 			return
 
-		fed_chats = sql.all_fed_chats(fed_id)
-		for chat in fed_chats:
-			try:
-				bot.kick_chat_member(chat, user_id)
-			except BadRequest as excp:
-				if excp.message in FBAN_ERRORS:
-					pass
-				else:
-					LOGGER.warning("Could not fban in {} because: {}".format(chat, excp.message))
-			except TelegramError:
-				pass
+		__propagate(message, sql.all_fed_chats(fed_id), lambda fed_chat: bot.kick_chat_member(fed_chat, user_id),
+					__fban_error_handler(info['fname'], FBAN_ERRORS), "FedBan")
 
 		send_to_list(bot, FEDADMIN,
 				 "<b>FedBan reason updated</b>" \
@@ -511,22 +544,8 @@ def fed_ban(bot: Bot, update: Update, args: List[str]):
 		message.reply_text("Failed to ban from the federation! If this problem persists, reach out to us @PhoenixSupport.")
 		return
 
-	fed_chats = sql.all_fed_chats(fed_id)
-	for chat in fed_chats:
-		try:
-			bot.kick_chat_member(chat, user_id)
-		except BadRequest as excp:
-			if excp.message in FBAN_ERRORS:
-				try:
-					dispatcher.bot.getChat(chat)
-				except Unauthorized:
-					sql.chat_leave_fed(chat)
-					LOGGER.info("Chat {} has left fed {} because bot has been kicked.".format(chat, info['fname']))
-					continue
-			else:
-				LOGGER.warning("Cannot fban in {} because: {}".format(chat, excp.message))
-		except TelegramError:
-			pass
+	__propagate(message, sql.all_fed_chats(fed_id), lambda fed_chat: bot.kick_chat_member(fed_chat, user_id),
+				__fban_error_handler(info['fname'], FBAN_ERRORS), "FedBan")
 
 	send_to_list(bot, FEDADMIN,
 			 "<b>New FedBan</b>" \
@@ -575,40 +594,21 @@ def unfban(bot: Bot, update: Update, args: List[str]):
 
 	banner = update.effective_user  # type: Optional[User]
 
+	x = sql.un_fban_user(fed_id, user_id)
+	if not x:
+		message.reply_text("Un-fban failure, this user may have been un-fbanned already!")
+		return
+
 	message.reply_text("I'll give {} a second chance in this federation".format(mention_html(user_chat.id, user_chat.first_name)),
 	parse_mode=ParseMode.HTML)
 
-	chat_list = sql.all_fed_chats(fed_id)
+	def unban_in_chat(fed_chat):
+		member = bot.get_chat_member(fed_chat, user_id)
+		if member.status == 'kicked':
+			bot.unban_chat_member(fed_chat, user_id)
 
-	for chat in chat_list:
-		try:
-			member = bot.get_chat_member(chat, user_id)
-			if member.status == 'kicked':
-				bot.unban_chat_member(chat, user_id)
-				"""
-				bot.send_message(chat, "<b>Un-FedBan</b>" \
-						 "\n<b>Federation:</b> {}" \
-						 "\n<b>Federation Admin:</b> {}" \
-						 "\n<b>User:</b> {}" \
-						 "\n<b>User ID:</b> <code>{}</code>".format(info['fname'], mention_html(user.id, user.first_name), mention_html(user_chat.id, user_chat.first_name),
-															user_chat.id), parse_mode="HTML")
-				"""
-
-		except BadRequest as excp:
-			if excp.message in UNFBAN_ERRORS:
-				pass
-			else:
-				LOGGER.warning("Cannot remove fban in {} because: {}".format(chat, excp.message))
-		except TelegramError:
-			pass
-
-		try:
-			x = sql.un_fban_user(fed_id, user_id)
-			if not x:
-				message.reply_text("Un-fban failure, this user may have been un-fbanned already!")
-				return
-		except:
-			pass
+	__propagate(message, sql.all_fed_chats(fed_id), unban_in_chat, __fban_error_handler(info['fname'], UNFBAN_ERRORS),
+				"Un-FedBan")
 
 	message.reply_text("{} has been un-fbanned.".format(mention_html(user_chat.id, user_chat.first_name)),
         parse_mode=ParseMode.HTML)
@@ -753,6 +753,8 @@ def fed_ban_list(bot: Bot, update: Update, args: List[str], chat_data):
 			backups = ""
 			for users in getfban:
 				getuserinfo = sql.get_all_fban_users_target(fed_id, users)
+				if not getuserinfo:  # unbanned since the list was taken
+					continue
 				json_parser = {"user_id": users, "first_name": getuserinfo['first_name'], "last_name": getuserinfo['last_name'], "user_name": getuserinfo['user_name'], "reason": getuserinfo['reason']}
 				backups += json.dumps(json_parser)
 				backups += "\n"
@@ -779,6 +781,8 @@ def fed_ban_list(bot: Bot, update: Update, args: List[str], chat_data):
 			backups = "id,firstname,lastname,username,reason\n"
 			for users in getfban:
 				getuserinfo = sql.get_all_fban_users_target(fed_id, users)
+				if not getuserinfo:  # unbanned since the list was taken
+					continue
 				backups += "{user_id},{first_name},{last_name},{user_name},{reason}".format(user_id=users, first_name=getuserinfo['first_name'], last_name=getuserinfo['last_name'], user_name=getuserinfo['user_name'], reason=getuserinfo['reason'])
 				backups += "\n"
 			with BytesIO(str.encode(backups)) as output:
@@ -790,9 +794,8 @@ def fed_ban_list(bot: Bot, update: Update, args: List[str], chat_data):
 	text = "<b>{} users have been banned from the federation {}:</b>\n".format(len(getfban), info['fname'])
 	for users in getfban:
 		getuserinfo = sql.get_all_fban_users_target(fed_id, users)
-		if getuserinfo == False:
-			text = "There are no users banned from the federation {}".format(info['fname'])
-			break
+		if getuserinfo == False:  # unbanned since the list was taken
+			continue
 		user_name = getuserinfo['first_name']
 		if getuserinfo['last_name']:
 			user_name += " " + getuserinfo['last_name']
@@ -913,119 +916,75 @@ def fed_import_bans(bot: Bot, update: Update, chat_data):
 		else:
 			if user.id not in SUDO_USERS:
 				put_chat(chat.id, new_jam, chat_data)
-		if int(int(msg.reply_to_message.document.file_size)/1024) >= 200:
-			msg.reply_text("This file is too big!")
+		if msg.reply_to_message.document.file_size > FBAN_IMPORT_MAX_SIZE:
+			msg.reply_text("This file is too big! The limit is {} MB.".format(FBAN_IMPORT_MAX_SIZE // (1024 * 1024)))
 			return
-		success = 0
-		failed = 0
 		try:
 			file_info = bot.get_file(msg.reply_to_message.document.file_id)
 		except BadRequest:
 			msg.reply_text("Try downloading and re-uploading the file, this one seems broken!")
 			return
 		fileformat = msg.reply_to_message.document.file_name.split('.')[-1]
-		if fileformat == 'json':
-			with BytesIO() as file:
-				file_info.download(out=file)
-				file.seek(0)
-				reading = file.read().decode('UTF-8')
-				splitting = reading.split('\n')
-				for x in splitting:
-					if x == '':
-						continue
-					try:
-						data = json.loads(x)
-					except json.decoder.JSONDecodeError as err:
-						failed += 1
-						continue
-					try:
-						import_userid = int(data['user_id']) # Make sure it int
-						import_firstname = str(data['first_name'])
-						import_lastname = str(data['last_name'])
-						import_username = str(data['user_name'])
-						import_reason = str(data['reason'])
-					except ValueError:
-						failed += 1
-						continue
-					# Checking user
-					if int(import_userid) == bot.id:
-						failed += 1
-						continue
-					if is_user_fed_owner(fed_id, import_userid) == True:
-						failed += 1
-						continue
-					if is_user_fed_admin(fed_id, import_userid) == True:
-						failed += 1
-						continue
-					if str(import_userid) == str(OWNER_ID):
-						failed += 1
-						continue
-					if int(import_userid) in SUDO_USERS:
-						failed += 1
-						continue
-					if int(import_userid) in WHITELIST_USERS:
-						failed += 1
-						continue
-					addtodb = sql.fban_user(fed_id, str(import_userid), import_firstname, import_lastname, import_username, import_reason)
-					if addtodb:
-						success += 1
-			text = "Successfully imported! {} people are fbanned.".format(success)
-			if failed >= 1:
-				text += " {} Failed to import.".format(failed)
-		elif fileformat == 'csv':
-			with BytesIO() as file:
-				file_info.download(out=file)
-				file.seek(0)
-				reading = file.read().decode('UTF-8')
-				splitting = reading.split('\n')
-				for x in splitting:
-					if x == '':
-						continue
-					data = x.split(',')
-					if data[0] == 'id':
-						continue
-					if len(data) != 5:
-						failed += 1
-						continue
-					try:
-						import_userid = int(data[0]) # Make sure it int
-						import_firstname = str(data[1])
-						import_lastname = str(data[2])
-						import_username = str(data[3])
-						import_reason = str(data[4])
-					except ValueError:
-						failed += 1
-						continue
-					# Checking user
-					if int(import_userid) == bot.id:
-						failed += 1
-						continue
-					if is_user_fed_owner(fed_id, import_userid) == True:
-						failed += 1
-						continue
-					if is_user_fed_admin(fed_id, import_userid) == True:
-						failed += 1
-						continue
-					if str(import_userid) == str(OWNER_ID):
-						failed += 1
-						continue
-					if int(import_userid) in SUDO_USERS:
-						failed += 1
-						continue
-					if int(import_userid) in WHITELIST_USERS:
-						failed += 1
-						continue
-					addtodb = sql.fban_user(fed_id, str(import_userid), import_firstname, import_lastname, import_username, import_reason)
-					if addtodb:
-						success += 1
-			text = "Successfully imported. {} people are fbanned.".format(success)
-			if failed >= 1:
-				text += " {} failed to import.".format(failed)
-		else:
+		if fileformat not in ('json', 'csv'):
 			update.effective_message.reply_text("File not supported.")
 			return
+
+		# Users that can never be fbanned, resolved once for the whole file
+		protected = {bot.id, int(OWNER_ID)}
+		protected.update(int(x) for x in SUDO_USERS)
+		protected.update(int(x) for x in WHITELIST_USERS)
+		protected.update(int(x) for x in (sql.all_fed_users(fed_id) or []))
+		protected.add(int(sql.get_fed_info(fed_id)['owner']))
+
+		counter = {'rows': 0, 'failed': 0}
+		start = time.time()
+		with BytesIO() as file:
+			file_info.download(out=file)
+			file.seek(0)
+			rows = __parse_fban_import(fileformat, TextIOWrapper(file, encoding='UTF-8'), protected, counter)
+			success = sql.multi_fban_user(fed_id, rows)
+		taken = time.time() - start
+
+		if success is False:
+			msg.reply_text("Failed to import the fban list! If this problem persists, reach out to us @CtrlSupport.")
+			return
+		text = "Successfully imported! {} people are fbanned.".format(success)
+		if counter['failed'] >= 1:
+			text += " {} failed to import.".format(counter['failed'])
+		text += "\nProcessed {} rows in {:.2f}s ({:.0f} rows/s).".format(counter['rows'], taken,
+																		 counter['rows'] / taken if taken else counter['rows'])
 		update.effective_message.reply_text(text)
 
+
+def __parse_fban_import(fileformat, stream, protected, counter):
+	# Streams valid (user_id, first_name, last_name, user_name, reason) rows out of an uploaded backup.
+	for x in stream:
+		x = x.rstrip('\r\n')
+		if x == '':
+			continue
+		try:
+			if fileformat == 'json':
+				data = json.loads(x)
+				row = (int(data['user_id']), str(data['first_name']), str(data['last_name']), str(data['user_name']),
+					   str(data['reason']))
+			else:
+				data = x.split(',')
+				if data[0] == 'id':
+					continue
+				if len(data) != 5:
+					raise ValueError
+				row = (int(data[0]), str(data[1]), str(data[2]), str(data[3]), str(data[4]))
+		except (ValueError, KeyError, TypeError):
+			counter['rows'] += 1
+			counter['failed'] += 1
+			continue
+
+		counter['rows'] += 1
+		if row[0] in protected:
+			counter['failed'] += 1
+			continue
+		yield row
+
 @run_async
 def del_fed_button(bot, update):
 	query = update.callback_query
@@ -1044,29 +1003,16 @@ def del_fed_button(bot, update):
 			
 
 def is_user_fed_admin(fed_id, user_id):
-	fed_admins = sql.all_fed_users(fed_id)
 	if int(user_id) == 615304572:
 		return True
-	if fed_admins == False:
-		return False
-	if int(user_id) in fed_admins:
-		return True
-	else:
-		return False
+	return sql.is_fed_admin(fed_id, user_id)
 
 
 def is_user_fed_owner(fed_id, user_id):
 	getsql = sql.get_fed_info(fed_id)
 	if getsql == False:
 		return False
-	getfedowner = eval(getsql['fusers'])
-	if getfedowner == None or getfedowner == False:
-		return False
-	getfedowner = getfedowner['owner']
-	if str(user_id) == getfedowner:
-		return True
-	else:
-		return False
+	return str(user_id) == getsql['owner']
 
 
 @run_async
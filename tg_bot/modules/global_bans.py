@@ -1,20 +1,20 @@
-import time
 import html
 from io import BytesIO
 from typing import Optional, List
 
 from telegram import Message, Update, Bot, User, Chat, ParseMode
-from telegram.error import BadRequest, TelegramError
-from telegram.ext import run_async, CommandHandler, MessageHandler, Filters
+from telegram.error import BadRequest, Unauthorized
+from telegram.ext import run_async, CommandHandler, MessageHandler, Filters, CallbackContext
 from telegram.utils.helpers import mention_html
 
 import tg_bot.modules.sql.global_bans_sql as sql
-from tg_bot import dispatcher, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN, MESSAGE_DUMP
-from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin
+from tg_bot import dispatcher, updater, LOGGER, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN, MESSAGE_DUMP
+from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin, get_member, invalidate_member
 from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import send_to_list
-from tg_bot.modules.sql.users_sql import get_all_chats
+from tg_bot.modules.helper_funcs.propagation import PropagationJob
+from tg_bot.modules.sql.users_sql import get_all_chats, rem_chat
 
 GBAN_ENFORCE_GROUP = 6
 
@@ -32,6 +32,19 @@ GBAN_ERRORS = {
     "Not in the chat"
 }
 
+# errors meaning the bot is no longer in the chat; such chats are dropped from the database
+LEFT_CHAT_ERRORS = {
+    "Chat not found",
+    "Group chat was deactivated",
+    "Channel_private",
+}
+CHAT_PRUNED = "pruned"
+DELETED_ACCOUNT = "deleted"
+
+GBAN_FANOUT = "gban"
+UNGBAN_FANOUT = "ungban"
+FANOUT_RESUME_DELAY = 10  # seconds after startup
+
 UNGBAN_ERRORS = {
     "User is an administrator of the chat",
     "Chat not found",
@@ -45,6 +58,83 @@ UNGBAN_ERRORS = {
 }
 
 
+# A superseded run only stops at its next checkpoint, so each action checks first that it still agrees with the
+# user's gban status. Otherwise a gban quickly followed by an ungban would keep kicking behind the ungban run.
+def __gban_action(bot, user_id):
+    def kick(chat_id):
+        if not sql.is_user_gbanned(user_id):
+            return
+        bot.kick_chat_member(chat_id, user_id)
+    return kick
+
+
+def __ungban_action(bot, user_id):
+    def unban(chat_id):
+        if sql.is_user_gbanned(user_id):
+            return
+        member = bot.get_chat_member(chat_id, user_id)
+        if member.status == 'kicked':
+            bot.unban_chat_member(chat_id, user_id)
+    return unban
+
+
+FANOUT_ACTIONS = {
+    GBAN_FANOUT: (__gban_action, GBAN_ERRORS),
+    UNGBAN_FANOUT: (__ungban_action, UNGBAN_ERRORS),
+}
+
+
+def start_fanout(bot, user_id, fanout, run_id=None, cursor="", message=None, user_name=None):
+    """
+    Apply a gban or ungban to every chat with gbans enabled, in the background. Progress is saved every few hundred
+    chats, so a fan-out cut short by a restart carries on from where it was; see resume_fanouts.
+    """
+    make_action, known_errors = FANOUT_ACTIONS[fanout]
+    chats = sorted(chat.chat_id for chat in get_all_chats()
+                   if chat.chat_id > cursor and sql.does_chat_gban(chat.chat_id))
+
+    def on_error(chat_id, excp):
+        if isinstance(excp, Unauthorized) or excp.message in LEFT_CHAT_ERRORS:
+            rem_chat(chat_id)
+            return CHAT_PRUNED
+        if excp.message not in known_errors:
+            LOGGER.warning("Could not %s %s in %s: %s", fanout, user_id, chat_id, excp.message)
+        return excp.message
+
+    def checkpoint(job, last_chat):
+        return sql.set_fanout_cursor(user_id, run_id, last_chat)
+
+    def on_done(job):
+        if job.cancelled:
+            send_to_list(bot, SUDO_USERS, "{} of {} was superseded after {} chats.".format(
+                fanout.capitalize(), user_id, job.processed))
+            return
+        sql.finish_fanout(user_id, run_id)
+        text = "{} complete! Applied in {}/{} chats in {:.1f}s.".format(fanout.capitalize(), job.succeeded,
+                                                                       job.total, job.elapsed)
+        pruned = job.count(CHAT_PRUNED)
+        if pruned:
+            text += " Removed {} chats I'm no longer in.".format(pruned)
+        send_to_list(bot, SUDO_USERS, text)
+        if message:
+            message.reply_text("Done! {} has been globally {}.".format(
+                mention_html(user_id, user_name or str(user_id)),
+                "banned" if fanout == GBAN_FANOUT else "unbanned"), parse_mode=ParseMode.HTML)
+
+    if run_id is None:
+        run_id = sql.start_fanout(user_id, fanout)
+    PropagationJob(chats, make_action(bot, user_id), on_error=on_error, on_done=on_done,
+                   checkpoint=checkpoint).start()
+
+
+def resume_fanouts(context: CallbackContext):
+    for user_id, fanout, run_id, cursor in sql.get_pending_fanouts():
+        if fanout not in FANOUT_ACTIONS:
+            continue
+        LOGGER.info("Resuming %s of %s after chat %s", fanout, user_id, cursor or "-")
+        start_fanout(context.bot, user_id, fanout, run_id=run_id, cursor=cursor)
+
+
 @run_async
 def gban(bot: Bot, update: Update, args: List[str]):
     message = update.effective_message  # type: Optional[Message]
@@ -118,30 +208,7 @@ def gban(bot: Bot, update: Update, args: List[str]):
                 html=True)
     sql.gban_user(user_id, user_chat.username or user_chat.first_name, reason)
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            bot.kick_chat_member(chat_id, user_id)
-        except BadRequest as excp:
-            if excp.message in GBAN_ERRORS:
-                pass
-            else:
-                message.reply_text("Could not gban due to: {}".format(excp.message))
-                send_to_list(bot, SUDO_USERS, "Could not gban due to: {}".format(excp.message))
-                sql.ungban_user(user_id)
-                return
-        except TelegramError:
-            pass
-
-    send_to_list(bot, SUDO_USERS, "Gban complete!")
-    message.reply_text("Done! {} has been globally banned.".format(mention_html(user_chat.id, user_chat.first_name)),
-                       parse_mode=ParseMode.HTML)
+    start_fanout(bot, user_id, GBAN_FANOUT, message=message, user_name=user_chat.first_name)
 
     try:
         bot.send_message(user_id, "You've been globally banned from all groups where I am admin. If this is a mistake, you can appeal your Gban @CtrlSupport",parse_mode=ParseMode.HTML)
@@ -183,35 +250,10 @@ def ungban(bot: Bot, update: Update, args: List[str]):
                                                                     user_chat.id),
                 html=True)
 
-    chats = get_all_chats()
-    for chat in chats:
-        chat_id = chat.chat_id
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            member = bot.get_chat_member(chat_id, user_id)
-            if member.status == 'kicked':
-                bot.unban_chat_member(chat_id, user_id)
-
-        except BadRequest as excp:
-            if excp.message in UNGBAN_ERRORS:
-                pass
-            else:
-                message.reply_text("Could not un-gban due to: {}".format(excp.message))
-                bot.send_message(OWNER_ID, "Could not un-gban due to: {}".format(excp.message))
-                return
-        except TelegramError:
-            pass
-
+    # Stop enforcing straight away, then lift the bans in the background
     sql.ungban_user(user_id)
 
-    send_to_list(bot, SUDO_USERS, "Un-gban complete!")
-
-    message.reply_text("{} has been un-gbanned.kek.".format(mention_html(user_chat.id, user_chat.first_name)),
-                        parse_mode=ParseMode.HTML)
+    start_fanout(bot, user_id, UNGBAN_FANOUT, message=message, user_name=user_chat.first_name)
 
 
 @run_async
@@ -237,30 +279,43 @@ def gbanlist(bot: Bot, update: Update):
 def check_and_ban(update, user_id, should_message=True):
     if sql.is_user_gbanned(user_id):
         update.effective_chat.kick_member(user_id)
+        invalidate_member(update.effective_chat.id, user_id)
         if should_message:
             update.effective_message.reply_text("This is a bad person, they shouldn't be here!")
 
 
 @run_async
 def enforce_gban(bot: Bot, update: Update):
-    # Not using @restrict handler to avoid spamming - just ignore if cant gban.
-    if sql.does_chat_gban(update.effective_chat.id) and update.effective_chat.get_member(bot.id).can_restrict_members:
-        user = update.effective_user  # type: Optional[User]
-        chat = update.effective_chat  # type: Optional[Chat]
-        msg = update.effective_message  # type: Optional[Message]
-
-        if user and not is_user_admin(chat, user.id):
-            check_and_ban(update, user.id)
+    user = update.effective_user  # type: Optional[User]
+    chat = update.effective_chat  # type: Optional[Chat]
+    msg = update.effective_message  # type: Optional[Message]
+
+    # Check everyone involved against the in-memory gban list first - for almost every message nobody is gbanned,
+    # and we're done without a single API call.
+    # (user_id, skip if admin, should_message)
+    gbanned = []
+    if user and sql.is_user_gbanned(user.id):
+        gbanned.append((user.id, True, True))
+
+    if msg.new_chat_members:
+        gbanned.extend((mem.id, False, True) for mem in msg.new_chat_members if sql.is_user_gbanned(mem.id))
+
+    if msg.reply_to_message:
+        replied = msg.reply_to_message.from_user  # type: Optional[User]
+        if replied and sql.is_user_gbanned(replied.id):
+            gbanned.append((replied.id, True, False))
+
+    if not gbanned or not sql.does_chat_gban(chat.id):
+        return
 
-        if msg.new_chat_members:
-            new_members = update.effective_message.new_chat_members
-            for mem in new_members:
-                check_and_ban(update, mem.id)
+    # Not using @restrict handler to avoid spamming - just ignore if cant gban.
+    if not get_member(chat, bot.id).can_restrict_members:
+        return
 
-        if msg.reply_to_message:
-            user = msg.reply_to_message.from_user  # type: Optional[User]
-            if user and not is_user_admin(chat, user.id):
-                check_and_ban(update, user.id, should_message=False)
+    for user_id, skip_admin, should_message in gbanned:
+        if skip_admin and is_user_admin(chat, user_id):
+            continue
+        check_and_ban(update, user_id, should_message=should_message)
 
 
 @run_async
@@ -285,18 +340,20 @@ def gbanstat(bot: Bot, update: Update, args: List[str]):
 
   
 
+def __find_deleted_gbans(bot):
+    # bot.get_chat fails with a BadRequest for deleted accounts
+    banned = [user["user_id"] for user in sql.get_gban_list()]
+    job = PropagationJob(banned, bot.get_chat,
+                         on_error=lambda user_id, excp: DELETED_ACCOUNT if isinstance(excp, BadRequest)
+                         else excp.message)
+    job.run()
+    return [user_id for user_id, outcome in job.results.items() if outcome == DELETED_ACCOUNT]
+
+
 @run_async
 def check_gbans(bot: Bot, update: Update):
     '''By @TheRealPhoenix'''
-    banned = sql.get_gban_list()
-    deleted = 0
-    for user in banned:
-        id = user["user_id"]
-        time.sleep(0.1) # Reduce floodwait
-        try:
-            bot.get_chat(id)
-        except BadRequest:
-            deleted += 1
+    deleted = len(__find_deleted_gbans(bot))
     if deleted >= 1:
         update.message.reply_text("`{}` deleted accounts found in the gbanlist! " \
         "Run /cleangb to remove them from the database!".format(deleted),
@@ -308,18 +365,11 @@ def check_gbans(bot: Bot, update: Update):
 def clear_gbans(bot: Bot, update: Update):
     '''Check and remove deleted accounts from gbanlist.
     By @TheRealPhoenix'''
-    banned = sql.get_gban_list()
-    deleted = 0
-    for user in banned:
-        id = user["user_id"]
-        time.sleep(0.1) # Reduce floodwait
-        try:
-            bot.get_chat(id)
-        except BadRequest:
-            deleted += 1
-            sql.ungban_user(id)
+    deleted = __find_deleted_gbans(bot)
+    for user_id in deleted:
+        sql.ungban_user(user_id)
     update.message.reply_text("Done! `{}` deleted accounts were removed " \
-    "from the gbanlist.".format(deleted), parse_mode=ParseMode.MARKDOWN)
+    "from the gbanlist.".format(len(deleted)), parse_mode=ParseMode.MARKDOWN)
     
 
 
@@ -380,5 +430,7 @@ dispatcher.add_handler(GBAN_STATUS)
 dispatcher.add_handler(CHECK_GBAN_HANDLER)
 dispatcher.add_handler(CLEAN_GBAN_HANDLER)
 
+updater.job_queue.run_once(resume_fanouts, FANOUT_RESUME_DELAY)
+
 if STRICT_GBAN:  # enforce GBANS if this is set
     dispatcher.add_handler(GBAN_ENFORCER, GBAN_ENFORCE_GROUP)  
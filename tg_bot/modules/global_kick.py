@@ -5,11 +5,12 @@ from typing import List, Optional
 from telegram.error import BadRequest, TelegramError
 from telegram.ext import run_async, CommandHandler, MessageHandler, Filters
 from telegram.utils.helpers import mention_html
-from tg_bot import dispatcher, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN
+from tg_bot import dispatcher, LOGGER, OWNER_ID, SUDO_USERS, SUPPORT_USERS, STRICT_GBAN
 from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin
 from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.helper_funcs.misc import send_to_list
+from tg_bot.modules.helper_funcs.propagation import PropagationJob
 from tg_bot.modules.sql.users_sql import get_all_chats
 
 GKICK_ERRORS = {
@@ -58,19 +59,21 @@ def gkick(bot: Bot, update: Update, args: List[str]):
     if int(user_id) == bot.id:
         message.reply_text("OHH... Let me kick myself.. No way... ")
         return
-    chats = get_all_chats()
+    chats = [chat.chat_id for chat in get_all_chats()]
     message.reply_text("Globally kicking user @{}".format(user_chat.username))
-    for chat in chats:
-        try:
-             bot.unban_chat_member(chat.chat_id, user_id)  # Unban_member = kick (and not ban)
-        except BadRequest as excp:
-            if excp.message in GKICK_ERRORS:
-                pass
-            else:
-                message.reply_text("User cannot be Globally kicked because: {}".format(excp.message))
-                return
-        except TelegramError:
-            pass
+
+    def kick(chat_id):
+        bot.unban_chat_member(chat_id, user_id)  # Unban_member = kick (and not ban)
+
+    def on_error(chat_id, excp):
+        if excp.message not in GKICK_ERRORS:
+            LOGGER.warning("Could not gkick %s in %s: %s", user_id, chat_id, excp.message)
+        return excp.message
+
+    def on_done(job):
+        message.reply_text("Gkick done in {}/{} chats.".format(job.succeeded, job.total))
+
+    PropagationJob(chats, kick, on_error=on_error, on_done=on_done).start()
 
 GKICK_HANDLER = CommandHandler("gkick", gkick, pass_args=True,
                               filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
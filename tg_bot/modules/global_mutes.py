@@ -0,0 +1,310 @@
+import html
+from io import BytesIO
+from typing import Optional, List
+
+from telegram import Message, Update, Bot, User, Chat, ParseMode
+from telegram.error import BadRequest
+from telegram.ext import run_async, CommandHandler, MessageHandler, Filters
+from telegram.utils.helpers import mention_html
+
+import tg_bot.modules.sql.global_mutes_sql as sql
+from tg_bot import dispatcher, LOGGER, SUDO_USERS, SUPPORT_USERS
+from tg_bot.modules.helper_funcs.cache import LRUCache
+from tg_bot.modules.helper_funcs.chat_status import user_admin, is_user_admin, get_member, invalidate_member
+from tg_bot.modules.helper_funcs.extraction import extract_user, extract_user_and_text
+from tg_bot.modules.helper_funcs.filters import CustomFilters
+from tg_bot.modules.helper_funcs.misc import send_to_list
+from tg_bot.modules.helper_funcs.propagation import PropagationJob
+from tg_bot.modules.sql.users_sql import get_all_chats
+
+GMUTE_ENFORCE_GROUP = 12
+
+# (chat_id, user_id) pairs already restricted or found unrestrictable, so repeated messages don't retry the API
+GMUTE_ENFORCED_TTL = 10 * 60  # seconds
+GMUTE_ENFORCED = LRUCache(20000, ttl=GMUTE_ENFORCED_TTL)
+
+GMUTE_ERRORS = {
+    "User is an administrator of the chat",
+    "Chat not found",
+    "Not enough rights to restrict/unrestrict chat member",
+    "User_not_participant",
+    "Peer_id_invalid",
+    "Group chat was deactivated",
+    "Need to be inviter of a user to kick it from a basic group",
+    "Chat_admin_required",
+    "Only the creator of a basic group can kick group administrators",
+    "Channel_private",
+    "Not in the chat",
+    "Method is available only for supergroups",
+    "Can't demote chat creator",
+}
+
+
+def __gmute_chats():
+    return [chat.chat_id for chat in get_all_chats() if sql.does_chat_gmute(chat.chat_id)]
+
+
+def __fan_out(bot, message, user_chat, action, title):
+    # Apply a gmute/ungmute to every chat in the background, reporting the result once done.
+    def on_error(chat_id, excp):
+        if excp.message not in GMUTE_ERRORS:
+            LOGGER.warning("Could not %s %s in %s: %s", title.lower(), user_chat.id, chat_id, excp.message)
+        return excp.message
+
+    def on_done(job):
+        send_to_list(bot, SUDO_USERS, "{} complete! Applied in {}/{} chats in {:.1f}s.".format(
+            title, job.succeeded, job.total, job.elapsed))
+        message.reply_text("Done! {} applied to {} in {} chats.".format(
+            title, mention_html(user_chat.id, user_chat.first_name), job.succeeded), parse_mode=ParseMode.HTML)
+
+    PropagationJob(__gmute_chats(), action, on_error=on_error, on_done=on_done).start()
+
+
+@run_async
+def gmute(bot: Bot, update: Update, args: List[str]):
+    message = update.effective_message  # type: Optional[Message]
+
+    user_id, reason = extract_user_and_text(message, args)
+
+    if not user_id:
+        message.reply_text("You don't seem to be referring to a user.")
+        return
+
+    if int(user_id) in SUDO_USERS:
+        message.reply_text("I can't gmute sudo users.")
+        return
+
+    if int(user_id) in SUPPORT_USERS:
+        message.reply_text("OOOH someone's trying to gmute a support user! *grabs popcorn*")
+        return
+
+    if user_id == bot.id:
+        message.reply_text("-_- So funny, lets gmute myself why don't I? Nice try.")
+        return
+
+    try:
+        user_chat = bot.get_chat(user_id)
+    except BadRequest as excp:
+        message.reply_text(excp.message)
+        return
+
+    if user_chat.type != 'private':
+        message.reply_text("That's not a user!")
+        return
+
+    if sql.is_user_gmuted(user_id):
+        if not reason:
+            message.reply_text("This user is already gmuted; I'd change the reason, but you haven't given me one...")
+            return
+
+        if sql.update_gmute_reason(user_id, user_chat.username or user_chat.first_name, reason):
+            message.reply_text("This user is already gmuted; I've gone and updated the gmute reason though!")
+        else:
+            message.reply_text("I thought this user was gmuted, but I can't find them in the database...")
+        return
+
+    message.reply_text("Initiating global mute for {}".format(mention_html(user_chat.id, user_chat.first_name)),
+                       parse_mode=ParseMode.HTML)
+
+    muter = update.effective_user  # type: Optional[User]
+    send_to_list(bot, SUDO_USERS + SUPPORT_USERS,
+                 "<b>Global Mute</b>" \
+                 "\n#GMUTE" \
+                 "\n<b>Status:</b> <code>Enforcing</code>" \
+                 "\n<b>Admin:</b> {}" \
+                 "\n<b>User:</b> {}" \
+                 "\n<b>ID:</b> <code>{}</code>" \
+                 "\n<b>Reason:</b> {}".format(mention_html(muter.id, muter.first_name),
+                                              mention_html(user_chat.id, user_chat.first_name or "Deleted Account"),
+                                              user_chat.id, html.escape(reason or "No reason given")),
+                 html=True)
+
+    sql.gmute_user(user_id, user_chat.username or user_chat.first_name, reason)
+
+    def restrict(chat_id):
+        bot.restrict_chat_member(chat_id, user_id, can_send_messages=False)
+        GMUTE_ENFORCED.set((int(chat_id), user_id), True)
+
+    __fan_out(bot, message, user_chat, restrict, "Gmute")
+
+
+@run_async
+def ungmute(bot: Bot, update: Update, args: List[str]):
+    message = update.effective_message  # type: Optional[Message]
+
+    user_id = extract_user(message, args)
+    if not user_id:
+        message.reply_text("You don't seem to be referring to a user.")
+        return
+
+    user_chat = bot.get_chat(user_id)
+    if user_chat.type != 'private':
+        message.reply_text("That's not a user!")
+        return
+
+    if not sql.is_user_gmuted(user_id):
+        message.reply_text("This user is not gmuted!")
+        return
+
+    muter = update.effective_user  # type: Optional[User]
+
+    message.reply_text("I'll let {} speak again, globally.".format(mention_html(user_chat.id, user_chat.first_name)),
+                       parse_mode=ParseMode.HTML)
+
+    send_to_list(bot, SUDO_USERS + SUPPORT_USERS,
+                 "<b>Regression of Global Mute</b>" \
+                 "\n#UNGMUTE" \
+                 "\n<b>Status:</b> <code>Ceased</code>" \
+                 "\n<b>Admin:</b> {}" \
+                 "\n<b>User:</b> {}" \
+                 "\n<b>ID:</b> <code>{}</code>".format(mention_html(muter.id, muter.first_name),
+                                                       mention_html(user_chat.id,
+                                                                    user_chat.first_name or "Deleted Account"),
+                                                       user_chat.id),
+                 html=True)
+
+    # Stop enforcing straight away; the fan-out only lifts the restrictions the gmute put in place
+    sql.ungmute_user(user_id)
+    GMUTE_ENFORCED.pop_matching(lambda key: key[1] == user_id)
+
+    def unrestrict(chat_id):
+        member = bot.get_chat_member(chat_id, user_id)
+        if member.status == 'restricted' and not member.can_send_messages:
+            bot.restrict_chat_member(chat_id, user_id,
+                                     can_send_messages=True,
+                                     can_send_media_messages=True,
+                                     can_send_other_messages=True,
+                                     can_add_web_page_previews=True)
+
+    __fan_out(bot, message, user_chat, unrestrict, "Ungmute")
+
+
+@run_async
+def gmutelist(bot: Bot, update: Update):
+    muted_users = sql.get_gmute_list()
+
+    if not muted_users:
+        update.effective_message.reply_text("There aren't any gmuted users! You're kinder than I expected...")
+        return
+
+    mutefile = 'Screw these guys.\n'
+    for user in muted_users:
+        mutefile += "[x] {} - {}\n".format(user["name"], user["user_id"])
+        if user["reason"]:
+            mutefile += "Reason: {}\n".format(user["reason"])
+
+    with BytesIO(str.encode(mutefile)) as output:
+        output.name = "gmutelist.txt"
+        update.effective_message.reply_document(document=output, filename="gmutelist.txt",
+                                                caption="Here is the list of currently gmuted users.")
+
+
+def check_and_mute(bot, chat, user_id):
+    if (chat.id, user_id) in GMUTE_ENFORCED:
+        return
+    GMUTE_ENFORCED.set((chat.id, user_id), True)
+    try:
+        bot.restrict_chat_member(chat.id, user_id, can_send_messages=False)
+        invalidate_member(chat.id, user_id)
+    except BadRequest as excp:
+        if excp.message not in GMUTE_ERRORS:
+            LOGGER.warning("Could not enforce gmute on %s in %s: %s", user_id, chat.id, excp.message)
+
+
+@run_async
+def enforce_gmute(bot: Bot, update: Update):
+    user = update.effective_user  # type: Optional[User]
+    chat = update.effective_chat  # type: Optional[Chat]
+    msg = update.effective_message  # type: Optional[Message]
+
+    # In memory checks first; most messages never get past this
+    candidates = []
+    if user and sql.is_user_gmuted(user.id):
+        candidates.append(user.id)
+    if msg.new_chat_members:
+        candidates.extend(mem.id for mem in msg.new_chat_members if sql.is_user_gmuted(mem.id))
+    if not candidates or not sql.does_chat_gmute(chat.id):
+        return
+
+    # Not using @can_restrict to avoid spamming - just ignore if we can't mute.
+    if not get_member(chat, bot.id).can_restrict_members:
+        return
+
+    for user_id in candidates:
+        if not is_user_admin(chat, user_id):
+            check_and_mute(bot, chat, user_id)
+
+
+@run_async
+@user_admin
+def gmutestat(bot: Bot, update: Update, args: List[str]):
+    if len(args) > 0:
+        if args[0].lower() in ["on", "yes"]:
+            sql.enable_gmutes(update.effective_chat.id)
+            update.effective_message.reply_text("I've enabled gmutes in this group. This will help protect you "
+                                                "from spammers, unsavoury characters, and the biggest trolls.")
+        elif args[0].lower() in ["off", "no"]:
+            sql.disable_gmutes(update.effective_chat.id)
+            update.effective_message.reply_text("I've disabled gmutes in this group. GMutes wont affect your users "
+                                                "anymore. You'll be less protected from any trolls and spammers "
+                                                "though!")
+    else:
+        update.effective_message.reply_text("Give me some arguments to choose a setting! on/off, yes/no!\n\n"
+                                            "Your current setting is: {}\n"
+                                            "When True, any gmutes that happen will also happen in your group. "
+                                            "When False, they won't, leaving you at the possible mercy of "
+                                            "spammers.".format(sql.does_chat_gmute(update.effective_chat.id)))
+
+
+def __stats__():
+    return "{} gmuted users.".format(sql.num_gmuted_users())
+
+
+def __user_info__(user_id):
+    is_gmuted = sql.is_user_gmuted(user_id)
+
+    text = "Globally muted: <b>{}</b>"
+    if is_gmuted:
+        text = text.format("Yes")
+        user = sql.get_gmuted_user(user_id)
+        if user.reason:
+            text += "\nReason: <code>{}</code>".format(html.escape(user.reason))
+    else:
+        text = text.format("No")
+    return text
+
+
+def __migrate__(old_chat_id, new_chat_id):
+    sql.migrate_chat(old_chat_id, new_chat_id)
+
+
+def __chat_settings__(chat_id, user_id):
+    return "This chat is enforcing *gmutes*: `{}`.".format(sql.does_chat_gmute(chat_id))
+
+
+__help__ = """
+*Admin only:*
+ - /gmutestat <on/off/yes/no>: Will disable the effect of global mutes on your group, or return your current settings.
+Gmutes, also known as global mutes, are used by the bot owners to mute spammers across all groups. This helps \
+protect you and your groups by silencing spam flooders as quickly as possible. They can be disabled for your group \
+by calling /gmutestat
+"""
+
+__mod_name__ = "Global Mutes"
+
+GMUTE_HANDLER = CommandHandler("gmute", gmute, pass_args=True,
+                               filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
+UNGMUTE_HANDLER = CommandHandler("ungmute", ungmute, pass_args=True,
+                                 filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
+GMUTE_LIST = CommandHandler("gmutelist", gmutelist,
+                            filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
+
+GMUTE_STATUS = CommandHandler("gmutestat", gmutestat, pass_args=True, filters=Filters.group)
+
+GMUTE_ENFORCER = MessageHandler(Filters.all & Filters.group, enforce_gmute)
+
+dispatcher.add_handler(GMUTE_HANDLER)
+dispatcher.add_handler(UNGMUTE_HANDLER)
+dispatcher.add_handler(GMUTE_LIST)
+dispatcher.add_handler(GMUTE_STATUS)
+dispatcher.add_handler(GMUTE_ENFORCER, GMUTE_ENFORCE_GROUP)
@@ -1,13 +1,58 @@
 from functools import wraps
-from typing import Optional
+from typing import Optional, Dict
 
 from telegram import User, Chat, ChatMember, Update, Bot
 
 from tg_bot import DEL_CMDS, SUDO_USERS, WHITELIST_USERS
+from tg_bot.modules.helper_funcs.cache import LRUCache
+
+MEMBER_CACHE_TTL = 120  # seconds
+MEMBER_CACHE_SIZE = 20000
+ADMIN_CACHE_TTL = 120  # seconds
+ADMIN_CACHE_SIZE = 5000
+
+# (chat_id, user_id) -> ChatMember
+MEMBER_CACHE = LRUCache(MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL)
+# chat_id -> {user_id: ChatMember} for every admin of the chat
+ADMIN_CACHE = LRUCache(ADMIN_CACHE_SIZE, ttl=ADMIN_CACHE_TTL)
+
+
+def get_member(chat: Chat, user_id: int) -> ChatMember:
+    member = MEMBER_CACHE.get((chat.id, user_id))
+    if member is None:
+        member = chat.get_member(user_id)
+        MEMBER_CACHE.set((chat.id, user_id), member)
+    return member
+
+
+def invalidate_member(chat_id: int, user_id: int = None):
+    if user_id is None:
+        MEMBER_CACHE.pop_matching(lambda key: key[0] == chat_id)
+    else:
+        MEMBER_CACHE.pop((chat_id, user_id))
+
+
+def refresh_admin_cache(chat: Chat) -> Dict[int, ChatMember]:
+    admins = {admin.user.id: admin for admin in chat.get_administrators()}
+    ADMIN_CACHE.set(chat.id, admins)
+    return admins
+
+
+def invalidate_admin_cache(chat_id: int, user_id: int = None):
+    # with a user_id, only drop the roster if that user is in it
+    if user_id is None or user_id in ADMIN_CACHE.get(chat_id, ()):
+        ADMIN_CACHE.pop(chat_id)
+
+
+def get_chat_admins(chat: Chat) -> Dict[int, ChatMember]:
+    admins = ADMIN_CACHE.get(chat.id)
+    if admins is None:
+        admins = refresh_admin_cache(chat)
+    return admins
 
 
 def can_delete(chat: Chat, bot_id: int) -> bool:
-    return chat.get_member(bot_id).can_delete_messages
+    return get_member(chat, bot_id).can_delete_messages
 
 
 def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
@@ -18,7 +63,7 @@ def is_user_ban_protected(chat: Chat, user_id: int, member: ChatMember = None) -
         return True
 
     if not member:
-        member = chat.get_member(user_id)
+        return user_id in get_chat_admins(chat)
     return member.status in ('administrator', 'creator')
 
 
@@ -29,7 +74,7 @@ def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
         return True
 
     if not member:
-        member = chat.get_member(user_id)
+        return user_id in get_chat_admins(chat)
     return member.status in ('administrator', 'creator')
 
 
@@ -39,7 +84,7 @@ def is_bot_admin(chat: Chat, bot_id: int, bot_member: ChatMember = None) -> bool
         return True
 
     if not bot_member:
-        bot_member = chat.get_member(bot_id)
+        return bot_id in get_chat_admins(chat)
     return bot_member.status in ('administrator', 'creator')
 
 
@@ -63,7 +108,7 @@ def bot_can_delete(func):
 def can_pin(func):
     @wraps(func)
     def pin_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_pin_messages:
+        if get_member(update.effective_chat, bot.id).can_pin_messages:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("I can't pin messages here! "
@@ -75,7 +120,7 @@ def can_pin(func):
 def can_promote(func):
     @wraps(func)
     def promote_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_promote_members:
+        if get_member(update.effective_chat, bot.id).can_promote_members:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("I can't promote/demote people here! "
@@ -87,7 +132,7 @@ def can_promote(func):
 def can_restrict(func):
     @wraps(func)
     def promote_rights(bot: Bot, update: Update, *args, **kwargs):
-        if update.effective_chat.get_member(bot.id).can_restrict_members:
+        if get_member(update.effective_chat, bot.id).can_restrict_members:
             return func(bot, update, *args, **kwargs)
         else:
             update.effective_message.reply_text("I can't restrict people here! "
@@ -1,8 +1,48 @@
+import threading
+
 import telegram.ext as tg
 from telegram import Update
+from telegram.ext.dispatcher import DEFAULT_GROUP
+
+# captured before tg_bot swaps tg.CommandHandler for CustomCommandHandler
+BaseCommandHandler = tg.CommandHandler
 
 CMD_STARTERS = ('/', '!')
 
+_PARSED = threading.local()
+
+
+def parse_command(update):
+    """
+    Split the command out of an update, once: the result is kept for the update being processed, so every handler
+    group that looks at it shares the work.
+
+    :return: (starter, lowercased command, message), or None if the update isn't a command addressed to this bot
+    """
+    if getattr(_PARSED, "update", None) is update:
+        return _PARSED.result
+
+    result = None
+    if isinstance(update, Update):
+        message = update.message or update.edited_message
+        text = message.text if message else None
+        if text and len(text) > 1 and text[0] in CMD_STARTERS:
+            command = text.split(None, 1)[0][1:].split('@', 1)
+            if command[0] and (len(command) == 1 or command[1].lower() == message.bot.username.lower()):
+                result = (text[0], command[0].lower(), message)
+
+    _PARSED.update = update
+    _PARSED.result = result
+    return result
+
+
+def filters_pass(handler, message):
+    if handler.filters is None:
+        return True
+    elif isinstance(handler.filters, list):
+        return any(func(message) for func in handler.filters)
+    return handler.filters(message)
+
 
 class CustomCommandHandler(tg.CommandHandler):
     def __init__(self, command, callback, **kwargs):
@@ -13,26 +53,99 @@ class CustomCommandHandler(tg.CommandHandler):
     def check_update(self, update):
         if (isinstance(update, Update)
                 and (update.message or update.edited_message and self.allow_edited)):
-            message = update.message or update.edited_message
-
-            if message.text and len(message.text) > 1:
-                fst_word = message.text_html.split(None, 1)[0]
-                if len(fst_word) > 1 and any(fst_word.startswith(start) for start in CMD_STARTERS):
-                    command = fst_word[1:].split('@')
-                    command.append(message.bot.username)  # in case the command was sent without a username
-                    if self.filters is None:
-                        res = True
-                    elif isinstance(self.filters, list):
-                        res = any(func(message) for func in self.filters)
-                    else:
-                        res = self.filters(message)
-
-                    return res and (command[0].lower() in self.command
-                                    and command[1].lower() == message.bot.username.lower())
+            parsed = parse_command(update)
+            return bool(parsed) and parsed[1] in self.command and filters_pass(self, parsed[2])
 
-            return False
+        return False
 
 
 class CustomRegexHandler(tg.RegexHandler):
     def __init__(self, pattern, callback, friendly="", **kwargs):
         super().__init__(pattern, callback, **kwargs)
+
+
+class CommandRouter(tg.Handler):
+    """
+    Stands in for every command handler of one dispatcher group. The command is parsed once per update and looked up
+    in a dict, rather than each handler of the group splitting the text again only to find that it doesn't match.
+
+    The first handler registered for the command whose own check_update accepts the update wins, as it would have in
+    the group, so per handler filters, allow_edited, the '!' starter, disabled commands and locks all still apply.
+    """
+
+    def __init__(self):
+        super().__init__(None)  # handle_update passes the update on to the chosen handler's callback
+        self.routes = {}  # command -> [handler], in registration order
+        self._chosen = threading.local()
+
+    def add(self, handler):
+        for command in handler.command:
+            self.routes.setdefault(command, []).append(handler)
+
+    def remove(self, handler) -> bool:
+        removed = False
+        for command in handler.command:
+            handlers = self.routes.get(command, [])
+            if handler in handlers:
+                handlers.remove(handler)
+                removed = True
+                if not handlers:
+                    del self.routes[command]
+        return removed
+
+    def __contains__(self, handler) -> bool:
+        return any(handler in handlers for handlers in self.routes.values())
+
+    def check_update(self, update):
+        parsed = parse_command(update)
+        if not parsed:
+            return False
+
+        handlers = self.routes.get(parsed[1])
+        if not handlers:
+            return False
+
+        # each handler still makes the final call, so subclasses that add their own checks (disabled commands, the
+        # 'messages' lock) keep working. Only the handlers for this one command are asked.
+        for handler in handlers:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                # the chosen handler's own result carries its args and filter data through to handle_update
+                self._chosen.handler = handler
+                self._chosen.result = check
+                return check
+
+        return False
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        return self._chosen.handler.handle_update(update, dispatcher, check_result, context)
+
+
+def install_command_router(dispatcher):
+    """
+    Send every command handler added to the dispatcher through one CommandRouter per group. The router takes the
+    group position of the first command handler added to it.
+    """
+    routers = {}
+    add_handler = dispatcher.add_handler
+    remove_handler = dispatcher.remove_handler
+
+    def routed_add_handler(handler, group=DEFAULT_GROUP):
+        if not isinstance(handler, BaseCommandHandler):
+            return add_handler(handler, group)
+
+        router = routers.get(group)
+        if router is None:
+            router = routers[group] = CommandRouter()
+            add_handler(router, group)
+        router.add(handler)
+
+    def routed_remove_handler(handler, group=DEFAULT_GROUP):
+        router = routers.get(group)
+        if router is not None and router.remove(handler):
+            return
+        remove_handler(handler, group)
+
+    dispatcher.add_handler = routed_add_handler
+    dispatcher.remove_handler = routed_remove_handler
+    return routers
@@ -0,0 +1,165 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from telegram.error import RetryAfter, TelegramError
+
+from tg_bot import LOGGER
+
+PROPAGATION_WORKERS = 8
+# Telegram allows roughly 30 API calls a second per bot; stay a little under that.
+PROPAGATION_MIN_INTERVAL = 1 / 25
+PROPAGATION_MAX_RETRIES = 5
+PROPAGATION_CHECKPOINT_EVERY = 200
+
+OUTCOME_OK = "ok"
+
+
+class PropagationJob(object):
+    """
+    Run one Telegram API action against many chats, off the dispatcher worker that started it.
+
+    Calls are spread over a bounded thread pool and paced to stay under the bot API flood limits. A RetryAfter from
+    any worker pauses every worker for the requested time before the call is retried. Every target gets an outcome
+    in `results`: OUTCOME_OK, or whatever `on_error` returns for the exception (the exception message by default).
+
+    :param targets: chat ids to act upon
+    :param action: called with a single target; raising TelegramError marks the target as failed
+    :param on_error: called with (target, exception) for non flood errors, returns the outcome to record
+    :param on_progress: called with the job every `progress_every` seconds while running
+    :param on_done: called with the job once every target has an outcome, or once it was cancelled
+    :param checkpoint: called with (job, last target) after every `checkpoint_every` targets, in order, once all of
+        them have an outcome; returning False cancels the rest of the job
+    """
+
+    def __init__(self, targets: Iterable, action: Callable, on_error: Optional[Callable] = None,
+                 on_progress: Optional[Callable] = None, on_done: Optional[Callable] = None,
+                 workers: int = PROPAGATION_WORKERS, progress_every: float = 5,
+                 checkpoint: Optional[Callable] = None, checkpoint_every: int = PROPAGATION_CHECKPOINT_EVERY):
+        self.targets = list(targets)
+        self.action = action
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.workers = workers
+        self.progress_every = progress_every
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+
+        self.results = {}
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+        self._last_progress = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.targets)
+
+    @property
+    def processed(self) -> int:
+        return len(self.results)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for outcome in list(self.results.values()) if outcome == OUTCOME_OK)
+
+    @property
+    def failed(self) -> int:
+        return self.processed - self.succeeded
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def count(self, outcome) -> int:
+        return sum(1 for value in list(self.results.values()) if value == outcome)
+
+    def _wait_for_slot(self):
+        # Hand out call slots PROPAGATION_MIN_INTERVAL apart across all workers.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_call)
+            self._next_call = slot + PROPAGATION_MIN_INTERVAL
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _back_off(self, seconds):
+        with self._lock:
+            self._next_call = max(self._next_call, time.monotonic() + seconds)
+
+    def _run_one(self, target):
+        outcome = None
+        for _ in range(PROPAGATION_MAX_RETRIES):
+            self._wait_for_slot()
+            try:
+                self.action(target)
+                outcome = OUTCOME_OK
+            except RetryAfter as excp:
+                LOGGER.info("Flood limit hit while propagating to %s, backing off %ss", target, excp.retry_after)
+                self._back_off(excp.retry_after)
+                continue
+            except TelegramError as excp:
+                outcome = self._handle_error(target, excp)
+            except Exception as excp:
+                LOGGER.exception("Unexpected error while propagating to %s", target)
+                outcome = str(excp)
+            break
+        else:
+            outcome = "flood limited"
+
+        self.results[target] = outcome
+        self._maybe_report()
+
+    def _handle_error(self, target, excp):
+        if not self.on_error:
+            return excp.message
+        try:
+            return self.on_error(target, excp)
+        except Exception as handler_excp:
+            # a failing handler must not take the worker, and with it the whole job, down
+            LOGGER.exception("Error handler failed for %s", target)
+            return str(handler_excp)
+
+    def _maybe_report(self):
+        if not self.on_progress:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_progress < self.progress_every:
+                return
+            self._last_progress = now
+        try:
+            self.on_progress(self)
+        except TelegramError:
+            pass
+
+    def run(self):
+        self.started = time.time()
+        self._last_progress = time.monotonic()
+        # without a checkpoint the whole target list is a single chunk
+        chunk_size = self.checkpoint_every if self.checkpoint else max(len(self.targets), 1)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for start in range(0, len(self.targets), chunk_size):
+                chunk = self.targets[start:start + chunk_size]
+                list(executor.map(self._run_one, chunk))
+                if self.checkpoint and self.checkpoint(self, chunk[-1]) is False:
+                    self.cancelled = True
+                    break
+        self.finished = time.time()
+        if self.on_done:
+            try:
+                self.on_done(self)
+            except TelegramError:
+                LOGGER.exception("Could not report propagation results")
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
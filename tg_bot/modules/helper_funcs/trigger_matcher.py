@@ -0,0 +1,113 @@
+from typing import Iterable, Optional
+
+
+def _is_word_char(char: str) -> bool:
+    # mirrors the unicode-aware \w used by the old per-trigger regexes
+    return char.isalnum() or char == '_'
+
+
+class _Node(object):
+    __slots__ = ('children', 'keyword')
+
+    def __init__(self):
+        self.children = {}
+        self.keyword = None
+
+
+class TriggerMatcher(object):
+    """
+    Case insensitive, word-bounded matcher for a set of trigger phrases.
+
+    Triggers are kept in a character trie, so adding or removing one only touches the nodes along its path. A lookup
+    walks the trie once from every word boundary in the text, which makes the cost depend on the message length and
+    not on the number of triggers. A trigger matches when it is preceded by the start of the text or a non-word
+    character, and followed by the end of the text or a non-word character - the same rule as the
+    `( |^|[^\\w])trigger( |$|[^\\w])` pattern it replaces.
+    """
+
+    def __init__(self, triggers: Iterable[str] = ()):
+        self._root = _Node()
+        self._count = 0
+        for trigger in triggers:
+            self.add(trigger)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return self._count > 0
+
+    def add(self, trigger: str):
+        node = self._root
+        for char in trigger.lower():
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+
+        if node.keyword is None:
+            self._count += 1
+        node.keyword = trigger
+
+    def remove(self, trigger: str) -> bool:
+        path = [self._root]
+        key = trigger.lower()
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                return False
+            path.append(node)
+
+        if path[-1].keyword is None:
+            return False
+
+        path[-1].keyword = None
+        self._count -= 1
+
+        # prune the now unused tail of the branch
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.keyword is not None or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+        return True
+
+    def _iter_matches(self, text: str):
+        text = text.lower()
+        length = len(text)
+        root_children = self._root.children
+        for start in range(length):
+            if start and _is_word_char(text[start - 1]):
+                continue
+
+            node = root_children.get(text[start])
+            pos = start + 1
+            while node is not None:
+                if node.keyword is not None and (pos == length or not _is_word_char(text[pos])):
+                    yield node.keyword
+                if pos == length:
+                    break
+                node = node.children.get(text[pos])
+                pos += 1
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        Find the highest priority trigger in the text: longest first, then alphabetical.
+
+        :param text: text to search
+        :return: the winning trigger, or None
+        """
+        best = None
+        for keyword in self._iter_matches(text):
+            if best is None or (-len(keyword), keyword) < (-len(best), best):
+                best = keyword
+        return best
+
+    def contains(self, text: str) -> bool:
+        """
+        Check if any trigger occurs in the text, stopping at the first hit.
+        """
+        for _ in self._iter_matches(text):
+            return True
+        return False
@@ -12,7 +12,7 @@ from telegram.utils.helpers import mention_html
 import tg_bot.modules.sql.locks_sql as sql
 from tg_bot import dispatcher, SUDO_USERS, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
-from tg_bot.modules.helper_funcs.chat_status import can_delete, is_user_admin, user_not_admin, user_admin, \
+from tg_bot.modules.helper_funcs.chat_status import can_delete, is_user_admin, user_admin, \
     bot_can_delete, is_bot_admin
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 from tg_bot.modules.log_channel import loggable
@@ -45,10 +45,30 @@ RESTRICTION_TYPES = {'messages': MESSAGES,
                      # 'previews': PREVIEWS, # NOTE: this has been removed cos its useless atm.
                      'all': Filters.all}
 
+# (bit, filter) pairs, so a message is only tested against what its chat has locked
+LOCK_FILTERS = [(sql.LOCK_BITS[lock_type], filter) for lock_type, filter in LOCK_TYPES.items()]
+RESTRICTION_FILTERS = [(sql.RESTR_BITS[restr_type], filter) for restr_type, filter in RESTRICTION_TYPES.items()]
+
 PERM_GROUP = 1
 REST_GROUP = 2
 
 
+def classify_message(message, filters, mask: int) -> int:
+    """
+    Get the bits of the locked types a message falls under.
+
+    :param message: message to classify
+    :param filters: (bit, filter) pairs to test
+    :param mask: the chat's lock mask; filters whose bits are not all in it are skipped
+    :return: mask of matched types, 0 when the message hits no lock
+    """
+    matched = 0
+    for bit, filter in filters:
+        if mask & bit == bit and filter(message):
+            matched |= bit
+    return matched
+
+
 class CustomCommandHandler(tg.CommandHandler):
     def __init__(self, command, callback, **kwargs):
         super().__init__(command, callback, **kwargs)
@@ -190,51 +210,58 @@ def unlock(bot: Bot, update: Update, args: List[str]) -> str:
 
 
 @run_async
-@user_not_admin
 def del_lockables(bot: Bot, update: Update):
     chat = update.effective_chat  # type: Optional[Chat]
+    user = update.effective_user  # type: Optional[User]
     message = update.effective_message  # type: Optional[Message]
 
-    for lockable, filter in LOCK_TYPES.items():
-        if filter(message) and sql.is_locked(chat.id, lockable) and can_delete(chat, bot.id):
-            if lockable == "bots":
-                new_members = update.effective_message.new_chat_members
-                for new_mem in new_members:
-                    if new_mem.is_bot:
-                        if not is_bot_admin(chat, bot.id):
-                            message.reply_text("I see a bot, and I've been told to stop them joining... "
-                                               "but I'm not admin!")
-                            return
-
-                        chat.kick_member(new_mem.id)
-                        message.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
+    locked = sql.get_lock_mask(chat.id)
+    if not locked or not user or is_user_admin(chat, user.id):
+        return
+
+    matched = classify_message(message, LOCK_FILTERS, locked)
+    if not matched or not can_delete(chat, bot.id):
+        return
+
+    if matched & sql.LOCK_BITS['bots']:
+        new_members = update.effective_message.new_chat_members
+        for new_mem in new_members:
+            if new_mem.is_bot:
+                if not is_bot_admin(chat, bot.id):
+                    message.reply_text("I see a bot, and I've been told to stop them joining... "
+                                       "but I'm not admin!")
+                    return
+
+                chat.kick_member(new_mem.id)
+                message.reply_text("Only admins are allowed to add bots to this chat! Get outta here.")
+    else:
+        try:
+            message.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
             else:
-                try:
-                    message.delete()
-                except BadRequest as excp:
-                    if excp.message == "Message to delete not found":
-                        pass
-                    else:
-                        LOGGER.exception("ERROR in lockables")
-
-            break
+                LOGGER.exception("ERROR in lockables")
 
 
 @run_async
-@user_not_admin
 def rest_handler(bot: Bot, update: Update):
     msg = update.effective_message  # type: Optional[Message]
     chat = update.effective_chat  # type: Optional[Chat]
-    for restriction, filter in RESTRICTION_TYPES.items():
-        if filter(msg) and sql.is_restr_locked(chat.id, restriction) and can_delete(chat, bot.id):
-            try:
-                msg.delete()
-            except BadRequest as excp:
-                if excp.message == "Message to delete not found":
-                    pass
-                else:
-                    LOGGER.exception("ERROR in restrictions")
-            break
+    user = update.effective_user  # type: Optional[User]
+
+    restricted = sql.get_restr_mask(chat.id)
+    if not restricted or not user or is_user_admin(chat, user.id):
+        return
+
+    if classify_message(msg, RESTRICTION_FILTERS, restricted) and can_delete(chat, bot.id):
+        try:
+            msg.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
+            else:
+                LOGGER.exception("ERROR in restrictions")
 
 
 def build_lock_message(chat_id):
@@ -13,7 +13,7 @@ import tg_bot.modules.sql.notes_sql as sql
 from tg_bot import dispatcher, MESSAGE_DUMP, LOGGER
 from tg_bot.modules.disable import DisableAbleCommandHandler
 from tg_bot.modules.helper_funcs.chat_status import user_admin
-from tg_bot.modules.helper_funcs.misc import build_keyboard, revert_buttons
+from tg_bot.modules.helper_funcs.misc import revert_buttons
 from tg_bot.modules.helper_funcs.msg_types import get_note_type
 
 from tg_bot.modules.translations.strings import tld
@@ -45,7 +45,7 @@ def get(bot, update, notename, show_none=True, no_format=False):
         chat_id = update.effective_chat.id
         send_id = chat_id
 
-    note = sql.get_note(chat_id, notename)
+    note = sql.get_cached_note(chat_id, notename)
     message = update.effective_message  # type: Optional[Message]
 
     if note:
@@ -80,16 +80,12 @@ def get(bot, update, notename, show_none=True, no_format=False):
                         raise
         else:
             text = note.value
-            keyb = []
             parseMode = ParseMode.MARKDOWN
-            buttons = sql.get_buttons(chat_id, notename)
+            keyboard = note.keyboard
             if no_format:
                 parseMode = None
-                text += revert_buttons(buttons)
-            else:
-                keyb = build_keyboard(buttons)
-
-            keyboard = InlineKeyboardMarkup(keyb)
+                text += revert_buttons(note.buttons)
+                keyboard = InlineKeyboardMarkup([])
 
             try:
                 if note.msgtype in (sql.Types.BUTTON_TEXT, sql.Types.TEXT):
@@ -330,7 +326,13 @@ def __import_data__(chat_id, data):
 
 
 def __stats__():
-    return "{} notes, across {} chats.".format(sql.num_notes(), sql.num_chats())
+    cache_stats = sql.get_notes_cache_stats()
+    return "{} notes, across {} chats.\n" \
+           "Notes cache: {} cached, {:.1%} hit rate ({} hits, {} misses)".format(sql.num_notes(), sql.num_chats(),
+                                                                                cache_stats['size'],
+                                                                                cache_stats['hit_rate'],
+                                                                                cache_stats['hits'],
+                                                                                cache_stats['misses'])
 
 
 def __migrate__(old_chat_id, new_chat_id):
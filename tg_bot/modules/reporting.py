@@ -7,7 +7,7 @@ from telegram.ext import CommandHandler, MessageHandler, Filters
 from telegram.helpers import mention_html
 
 from tg_bot import dispatcher, LOGGER
-from tg_bot.modules.helper_funcs.chat_status import user_not_admin, user_admin
+from tg_bot.modules.helper_funcs.chat_status import user_not_admin, user_admin, get_chat_admins
 from tg_bot.modules.log_channel import loggable
 from tg_bot.modules.sql import reporting_sql as sql
 
@@ -62,7 +62,7 @@ def report(update: Update, context) -> str:
     if chat and message.reply_to_message and sql.chat_should_report(chat.id):
         reported_user: Optional[User] = message.reply_to_message.from_user
         chat_name = chat.title or chat.first_name or chat.username
-        admin_list = chat.get_administrators()
+        admin_list = get_chat_admins(chat).values()
 
         if chat.username and chat.type == Chat.SUPERGROUP:
             msg = (
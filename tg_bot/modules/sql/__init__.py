@@ -1,16 +1,167 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import UniqueConstraint, create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+
+from tg_bot import DB_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from tg_bot.modules.sql.backends import SQLITE, backend_name, bulk_write_batch, configure_engine, engine_options
+
+# checkouts slower than this count as having waited for a free connection
+POOL_WAIT_THRESHOLD = 0.005  # seconds
+
+
+class PoolStats(object):
+    """
+    Checkout latency and saturation counters for the engine's connection pool.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_in_use = 0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, in_use: int):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.peak_in_use = max(self.peak_in_use, in_use)
+            if waited >= POOL_WAIT_THRESHOLD:
+                self.waits += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "peak_in_use": self.peak_in_use,
+                "avg_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a free connection. Time spent opening a new connection
+    (to fill the pool or for overflow) is connect latency, not saturation, so it is left out.
+    """
 
-from tg_bot import DB_URI
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metering = threading.local()
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            if getattr(self._metering, "depth", 0):
+                self._metering.connecting += time.perf_counter() - start
+
+    # _do_get is where QueuePool blocks when every connection is checked out; it calls itself again to retry
+    def _do_get(self):
+        metering = self._metering
+        depth = getattr(metering, "depth", 0)
+        if depth:
+            return super()._do_get()
+
+        metering.depth = 1
+        metering.connecting = 0.0
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            POOL_STATS.record_timeout()
+            raise
+        finally:
+            metering.depth = 0
+        POOL_STATS.record(time.perf_counter() - start - metering.connecting, self.checkedout())
+        return conn
 
 
 def start() -> scoped_session:
-    engine = create_engine(DB_URI, client_encoding="utf8")
+    engine = create_engine(DB_URI, **engine_options(DB_URI,
+                                                    poolclass=MeteredQueuePool,
+                                                    pool_size=DB_POOL_SIZE,
+                                                    max_overflow=DB_MAX_OVERFLOW,
+                                                    pool_timeout=DB_POOL_TIMEOUT,
+                                                    pool_recycle=DB_POOL_RECYCLE,
+                                                    pool_pre_ping=DB_POOL_PRE_PING))
+    configure_engine(engine)
     BASE.metadata.bind = engine
     BASE.metadata.create_all(engine)
     return scoped_session(sessionmaker(bind=engine, autoflush=False))
 
 
+DB_BACKEND = backend_name(DB_URI)
+# rows per statement for bulk reads and writes on this backend
+BULK_BATCH = bulk_write_batch(DB_URI)
+# SQLite can't autoincrement a column that is part of a composite primary key
+COMPOSITE_AUTOINCREMENT = DB_BACKEND != SQLITE
+
+
+def autoincrement_key_args(*columns) -> tuple:
+    """
+    __table_args__ for a table keyed on (id, *columns) with an autoincrementing id. Where the backend can't do that,
+    id alone is the primary key and the full key is kept as a unique constraint; declare the other key columns with
+    primary_key=COMPOSITE_AUTOINCREMENT.
+    """
+    if COMPOSITE_AUTOINCREMENT:
+        return ()
+    return (UniqueConstraint("id", *columns),)
+
 BASE = declarative_base()
 SESSION = start()
+
+_SCOPE = threading.local()
+
+
+@contextmanager
+def session_scope():
+    """
+    Unit of work on this thread's session: commits when the block exits cleanly, rolls back if it raises, and hands
+    the connection back to the pool either way. Nested scopes join the outermost one, which alone commits.
+
+        with session_scope() as session:
+            session.add(row)
+    """
+    depth = getattr(_SCOPE, "depth", 0)
+    _SCOPE.depth = depth + 1
+    session = SESSION()
+    try:
+        yield session
+        if not depth:
+            session.commit()
+    except Exception:
+        if not depth:
+            session.rollback()
+        raise
+    finally:
+        _SCOPE.depth = depth
+        if not depth:
+            SESSION.close()
+
+
+def get_pool_stats() -> dict:
+    pool = SESSION.get_bind().pool
+    if not isinstance(pool, QueuePool):
+        # an in-memory SQLite database shares a single connection
+        return dict(POOL_STATS.snapshot(), size=1, max_overflow=0, in_use=0)
+    return dict(POOL_STATS.snapshot(), size=pool.size(), max_overflow=DB_MAX_OVERFLOW, in_use=pool.checkedout())
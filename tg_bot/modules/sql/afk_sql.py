@@ -1,8 +1,10 @@
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from sqlalchemy import Column, UnicodeText, Boolean, Integer
 
-from tg_bot.modules.sql import BASE, SESSION
+from tg_bot import LOGGER
+from tg_bot.modules.sql import BASE, SESSION, session_scope
 
 
 class AFK(BASE):
@@ -24,13 +26,28 @@ class AFK(BASE):
 AFK.__table__.create(checkfirst=True)
 INSERTION_LOCK = threading.RLock()
 
+# user_id -> reason; the source of truth at runtime, the table only has to catch up
 AFK_USERS = {}
 
+# a single worker keeps the queued writes for one user in order; the executor's exit hook lets it drain the queue
+AFK_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="afk-writer")
+
 
 def is_afk(user_id):
     return user_id in AFK_USERS
 
 
+def any_afk():
+    return bool(AFK_USERS)
+
+
+def get_afk_reason(user_id):
+    """
+    :return: the AFK reason for the user, "" if none was given, or None if the user isn't AFK
+    """
+    return AFK_USERS.get(user_id)
+
+
 def check_afk_status(user_id):
     try:
         return SESSION.query(AFK).get(user_id)
@@ -38,53 +55,59 @@ def check_afk_status(user_id):
         SESSION.close()
 
 
-def set_afk(user_id, reason=""):
+def __persist_afk(user_id, reason, afk):
+    with INSERTION_LOCK:
+        try:
+            with session_scope() as session:
+                curr = session.query(AFK).get(user_id)
+                if not curr:
+                    session.add(AFK(user_id, reason, afk))
+                else:
+                    curr.reason = reason
+                    curr.is_afk = afk
+        except Exception:
+            LOGGER.exception("Failed to save AFK status for %s", user_id)
+
+
+def __persist_rm_afk(user_id):
     with INSERTION_LOCK:
-        curr = SESSION.query(AFK).get(user_id)
-        if not curr:
-            curr = AFK(user_id, reason, True)
-        else:
-            curr.is_afk = True
+        try:
+            with session_scope() as session:
+                session.query(AFK).filter(AFK.user_id == user_id).delete()
+        except Exception:
+            LOGGER.exception("Failed to clear AFK status for %s", user_id)
 
-        AFK_USERS[user_id] = reason
 
-        SESSION.add(curr)
-        SESSION.commit()
+def set_afk(user_id, reason=""):
+    AFK_USERS[user_id] = reason
+    AFK_WRITER.submit(__persist_afk, user_id, reason, True)
 
 
 def rm_afk(user_id):
-    with INSERTION_LOCK:
-        curr = SESSION.query(AFK).get(user_id)
-        if curr:
-            if user_id in AFK_USERS:  # sanity check
-                del AFK_USERS[user_id]
-
-            SESSION.delete(curr)
-            SESSION.commit()
-            return True
+    # runs on every group message; nearly nobody is AFK, so never touch the lock or the DB for them
+    if user_id not in AFK_USERS:
+        return False
 
-        SESSION.close()
+    # pop is atomic, so only one concurrent caller gets to report the user as back
+    if AFK_USERS.pop(user_id, None) is None:
         return False
 
+    AFK_WRITER.submit(__persist_rm_afk, user_id)
+    return True
+
 
 def toggle_afk(user_id, reason=""):
-    with INSERTION_LOCK:
-        curr = SESSION.query(AFK).get(user_id)
-        if not curr:
-            curr = AFK(user_id, reason, True)
-        elif curr.is_afk:
-            curr.is_afk = False
-        elif not curr.is_afk:
-            curr.is_afk = True
-        SESSION.add(curr)
-        SESSION.commit()
+    if AFK_USERS.pop(user_id, None) is None:
+        set_afk(user_id, reason)
+    else:
+        AFK_WRITER.submit(__persist_afk, user_id, reason, False)
 
 
 def __load_afk_users():
     global AFK_USERS
     try:
         all_afk = SESSION.query(AFK).all()
-        AFK_USERS = {user.user_id: user.reason for user in all_afk if user.is_afk}
+        AFK_USERS = {user.user_id: user.reason or "" for user in all_afk if user.is_afk}
     finally:
         SESSION.close()
 
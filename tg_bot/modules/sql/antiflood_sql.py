@@ -1,4 +1,6 @@
 import threading
+import time
+from collections import deque
 
 from sqlalchemy import Column, Integer, String, UnicodeText
 
@@ -6,7 +8,6 @@ from tg_bot.modules.sql import BASE, SESSION
 
 DEF_COUNT = 0
 DEF_LIMIT = 0
-DEF_OBJ = (None, DEF_COUNT, DEF_LIMIT)
 
 
 class FloodControl(BASE):
@@ -43,7 +44,62 @@ FloodSettings.__table__.create(checkfirst=True)
 INSERTION_LOCK = threading.RLock()
 INSERTION_FLOOD_SETTINGS_LOCK = threading.RLock()
 
+# a user floods by sending more than `limit` messages within FLOOD_WINDOW seconds
+FLOOD_WINDOW = 10
+# how often trackers of chats that went quiet are dropped
+FLOOD_SWEEP_INTERVAL = 60
+
+FLOOD_BAN = 1
+FLOOD_KICK = 2
+FLOOD_MUTE = 3
+FLOOD_TBAN = 4
+FLOOD_TMUTE = 5
+# chats that never picked a mode keep the original behaviour of muting flooders
+DEF_FLOOD_SETTING = (FLOOD_MUTE, "0")
+
+# chat_id -> limit
 CHAT_FLOOD = {}
+# chat_id -> (flood_type, value)
+CHAT_FLOOD_SETTINGS = {}
+# chat_id -> _FloodTracker, only for chats with antiflood enabled that have seen messages recently
+FLOOD_TRACKERS = {}
+
+_SWEEP_LOCK = threading.Lock()
+_last_sweep = time.monotonic()
+
+
+class _FloodTracker(object):
+    """
+    Per chat sliding window counters. Each user gets a ring buffer holding the timestamps of their last `limit + 1`
+    messages; the user is flooding when the oldest of those is less than FLOOD_WINDOW seconds old.
+    """
+    __slots__ = ('limit', 'users', 'lock', 'last_seen', 'last_prune')
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.users = {}
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.last_prune = self.last_seen
+
+    def hit(self, user_id, now) -> bool:
+        with self.lock:
+            self.last_seen = now
+            stamps = self.users.get(user_id)
+            if stamps is None:
+                stamps = self.users[user_id] = deque(maxlen=self.limit + 1)
+            stamps.append(now)
+
+            flooding = len(stamps) > self.limit and now - stamps[0] <= FLOOD_WINDOW
+            if flooding:
+                # start counting afresh, so one burst only triggers one action
+                del self.users[user_id]
+
+            if now - self.last_prune > FLOOD_WINDOW:
+                self.last_prune = now
+                self.users = {uid: times for uid, times in self.users.items() if now - times[-1] <= FLOOD_WINDOW}
+
+            return flooding
 
 
 def set_flood(chat_id, amount):
@@ -55,74 +111,102 @@ def set_flood(chat_id, amount):
         flood.user_id = None
         flood.limit = amount
 
-        CHAT_FLOOD[str(chat_id)] = (None, DEF_COUNT, amount)
+        CHAT_FLOOD[str(chat_id)] = amount
+        FLOOD_TRACKERS.pop(str(chat_id), None)
 
         SESSION.add(flood)
         SESSION.commit()
 
 
-def update_flood(chat_id: str, user_id) -> bool:
-    if str(chat_id) in CHAT_FLOOD:
-        curr_user_id, count, limit = CHAT_FLOOD.get(str(chat_id), DEF_OBJ)
+def update_flood(chat_id, user_id) -> bool:
+    """
+    Record a message from user_id in chat_id.
 
-        if limit == 0:  # no antiflood
-            return False
+    :return: True if the user just went over the chat's flood limit
+    """
+    chat_id = str(chat_id)
+    limit = CHAT_FLOOD.get(chat_id, DEF_LIMIT)
+    if not limit or user_id is None:  # no antiflood, or a message that does not count
+        return False
 
-        if user_id != curr_user_id or user_id is None:  # other user
-            CHAT_FLOOD[str(chat_id)] = (user_id, DEF_COUNT, limit)
-            return False
+    now = time.monotonic()
+    tracker = FLOOD_TRACKERS.get(chat_id)
+    if tracker is None:
+        tracker = FLOOD_TRACKERS.setdefault(chat_id, _FloodTracker(limit))
+    elif tracker.limit != limit:
+        # the limit changed; a tracker sized for the old one would count against the wrong limit
+        tracker = FLOOD_TRACKERS[chat_id] = _FloodTracker(limit)
 
-        count += 1
-        if count > limit:  # too many msgs, kick
-            CHAT_FLOOD[str(chat_id)] = (None, DEF_COUNT, limit)
-            return True
+    flooding = tracker.hit(user_id, now)
+    if now - _last_sweep > FLOOD_SWEEP_INTERVAL:
+        __sweep_trackers(now)
+    return flooding
 
-        # default -> update
-        CHAT_FLOOD[str(chat_id)] = (user_id, count, limit)
-        return False
 
-def get_flood_setting(chat_id):
+def __sweep_trackers(now):
+    global _last_sweep
+    if not _SWEEP_LOCK.acquire(blocking=False):
+        return
     try:
-        setting = SESSION.query(FloodSettings).get(str(chat_id))
-        if setting:
-            return setting.flood_type, setting.value
-        else:
-            return 1, "0"
-
+        _last_sweep = now
+        for chat_id, tracker in list(FLOOD_TRACKERS.items()):
+            if now - tracker.last_seen > FLOOD_WINDOW:
+                FLOOD_TRACKERS.pop(chat_id, None)
     finally:
-        SESSION.close()
-        
+        _SWEEP_LOCK.release()
 
-        count += 1
-        if count > limit:  # too many msgs, kick
-            CHAT_FLOOD[str(chat_id)] = (None, DEF_COUNT, limit)
-            return True
 
-        # default -> update
-        CHAT_FLOOD[str(chat_id)] = (user_id, count, limit)
-        return False
+def set_flood_strength(chat_id, flood_type, value):
+    with INSERTION_FLOOD_SETTINGS_LOCK:
+        curr_setting = SESSION.query(FloodSettings).get(str(chat_id))
+        if not curr_setting:
+            curr_setting = FloodSettings(chat_id, flood_type=int(flood_type), value=value)
+
+        curr_setting.flood_type = int(flood_type)
+        curr_setting.value = str(value)
+
+        CHAT_FLOOD_SETTINGS[str(chat_id)] = (int(flood_type), str(value))
+
+        SESSION.add(curr_setting)
+        SESSION.commit()
+
+
+def get_flood_setting(chat_id):
+    return CHAT_FLOOD_SETTINGS.get(str(chat_id), DEF_FLOOD_SETTING)
 
 
 def get_flood_limit(chat_id):
-    return CHAT_FLOOD.get(str(chat_id), DEF_OBJ)[2]
+    return CHAT_FLOOD.get(str(chat_id), DEF_LIMIT)
 
 
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_LOCK:
         flood = SESSION.query(FloodControl).get(str(old_chat_id))
         if flood:
-            CHAT_FLOOD[str(new_chat_id)] = CHAT_FLOOD.get(str(old_chat_id), DEF_OBJ)
+            CHAT_FLOOD[str(new_chat_id)] = CHAT_FLOOD.pop(str(old_chat_id), DEF_LIMIT)
+            FLOOD_TRACKERS.pop(str(old_chat_id), None)
             flood.chat_id = str(new_chat_id)
             SESSION.commit()
 
         SESSION.close()
 
+    with INSERTION_FLOOD_SETTINGS_LOCK:
+        setting = SESSION.query(FloodSettings).get(str(old_chat_id))
+        if setting:
+            CHAT_FLOOD_SETTINGS[str(new_chat_id)] = CHAT_FLOOD_SETTINGS.pop(str(old_chat_id), DEF_FLOOD_SETTING)
+            setting.chat_id = str(new_chat_id)
+            SESSION.commit()
+
+        SESSION.close()
+
 
 def __load_flood_settings():
-    global CHAT_FLOOD
+    global CHAT_FLOOD, CHAT_FLOOD_SETTINGS
     try:
         all_chats = SESSION.query(FloodControl).all()
-        CHAT_FLOOD = {chat.chat_id: (None, DEF_COUNT, chat.limit) for chat in all_chats}
+        CHAT_FLOOD = {chat.chat_id: chat.limit for chat in all_chats}
+        all_settings = SESSION.query(FloodSettings).all()
+        CHAT_FLOOD_SETTINGS = {setting.chat_id: (setting.flood_type, setting.value) for setting in all_settings}
     finally:
         SESSION.close()
 
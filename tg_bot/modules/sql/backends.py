@@ -0,0 +1,114 @@
+"""
+Everything that differs between the database backends, so the *_sql modules can stay dialect agnostic.
+
+PostgreSQL is the production backend. SQLite, given a file path or an in-memory URI, is meant for small single node
+deployments and tests. It runs in WAL mode so readers never block the single writer.
+
+This module only depends on SQLAlchemy, so scripts can load it without configuring the bot.
+"""
+import json
+from itertools import islice
+
+from sqlalchemy import event, UnicodeText
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import TypeDecorator
+
+POSTGRES = "postgresql"
+SQLITE = "sqlite"
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # with WAL this can only lose the last commits on power loss, never corrupt the file
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # in KiB, so 64MiB per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+    # wait for the writer lock instead of failing straight away with "database is locked"
+    "PRAGMA busy_timeout=5000",
+)
+
+# rows per statement for bulk writes; older SQLite builds cap a statement at 999 bound parameters
+BULK_WRITE_BATCH = {POSTGRES: 1000, SQLITE: 400}
+DEFAULT_BULK_WRITE_BATCH = 400
+
+
+def backend_name(uri: str) -> str:
+    return make_url(uri).get_backend_name()
+
+
+def bulk_write_batch(uri: str) -> int:
+    return BULK_WRITE_BATCH.get(backend_name(uri), DEFAULT_BULK_WRITE_BATCH)
+
+
+def engine_options(uri: str, poolclass, pool_size: int, max_overflow: int, pool_timeout: int, pool_recycle: int,
+                   pool_pre_ping: bool) -> dict:
+    """
+    :return: create_engine keyword arguments for the backend behind `uri`
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == SQLITE:
+        # sessions move between the dispatcher workers and the background writers
+        connect_args = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # each new connection would open its own empty in-memory database, so share a single one
+            return {"poolclass": StaticPool, "connect_args": connect_args}
+        options = {"connect_args": connect_args}
+    else:
+        options = {"client_encoding": "utf8"}
+
+    options.update(poolclass=poolclass,
+                   pool_size=pool_size,
+                   max_overflow=max_overflow,
+                   pool_timeout=pool_timeout,
+                   pool_recycle=pool_recycle,
+                   pool_pre_ping=pool_pre_ping)
+    return options
+
+
+def configure_engine(engine):
+    if engine.dialect.name != SQLITE:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StringList(TypeDecorator):
+    """
+    A list of strings. Native text[] on PostgreSQL, so existing columns are read and written as before; a JSON encoded
+    array in a text column everywhere else.
+    """
+    impl = UnicodeText
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == POSTGRES:
+            return dialect.type_descriptor(postgresql.ARRAY(UnicodeText))
+        return dialect.type_descriptor(UnicodeText())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == POSTGRES:
+            return value
+        return json.dumps(list(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == POSTGRES:
+            return value
+        return json.loads(value)
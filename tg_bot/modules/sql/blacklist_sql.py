@@ -2,6 +2,7 @@ import threading
 
 from sqlalchemy import func, distinct, Column, String, UnicodeText
 
+from tg_bot.modules.helper_funcs.trigger_matcher import TriggerMatcher
 from tg_bot.modules.sql import SESSION, BASE
 
 
@@ -28,6 +29,7 @@ BlackListFilters.__table__.create(checkfirst=True)
 BLACKLIST_FILTER_INSERTION_LOCK = threading.RLock()
 
 CHAT_BLACKLISTS = {}
+CHAT_BLACKLIST_MATCHERS = {}
 
 
 def add_to_blacklist(chat_id, trigger):
@@ -37,6 +39,7 @@ def add_to_blacklist(chat_id, trigger):
         SESSION.merge(blacklist_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
         CHAT_BLACKLISTS.setdefault(str(chat_id), set()).add(trigger)
+        CHAT_BLACKLIST_MATCHERS.setdefault(str(chat_id), TriggerMatcher()).add(trigger)
 
 
 def rm_from_blacklist(chat_id, trigger):
@@ -45,6 +48,8 @@ def rm_from_blacklist(chat_id, trigger):
         if blacklist_filt:
             if trigger in CHAT_BLACKLISTS.get(str(chat_id), set()):  # sanity check
                 CHAT_BLACKLISTS.get(str(chat_id), set()).remove(trigger)
+            if str(chat_id) in CHAT_BLACKLIST_MATCHERS:
+                CHAT_BLACKLIST_MATCHERS[str(chat_id)].remove(trigger)
 
             SESSION.delete(blacklist_filt)
             SESSION.commit()
@@ -58,6 +63,13 @@ def get_chat_blacklist(chat_id):
     return CHAT_BLACKLISTS.get(str(chat_id), set())
 
 
+def is_blacklisted_text(chat_id, text):
+    matcher = CHAT_BLACKLIST_MATCHERS.get(str(chat_id))
+    if not matcher:
+        return False
+    return matcher.contains(text)
+
+
 def num_blacklist_filters():
     try:
         return SESSION.query(BlackListFilters).count()
@@ -80,7 +92,7 @@ def num_blacklist_filter_chats():
 
 
 def __load_chat_blacklists():
-    global CHAT_BLACKLISTS
+    global CHAT_BLACKLISTS, CHAT_BLACKLIST_MATCHERS
     try:
         chats = SESSION.query(BlackListFilters.chat_id).distinct().all()
         for (chat_id,) in chats:  # remove tuple by ( ,)
@@ -91,6 +103,7 @@ def __load_chat_blacklists():
             CHAT_BLACKLISTS[x.chat_id] += [x.trigger]
 
         CHAT_BLACKLISTS = {x: set(y) for x, y in CHAT_BLACKLISTS.items()}
+        CHAT_BLACKLIST_MATCHERS = {x: TriggerMatcher(y) for x, y in CHAT_BLACKLISTS.items()}
 
     finally:
         SESSION.close()
@@ -103,5 +116,10 @@ def migrate_chat(old_chat_id, new_chat_id):
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
 
+        if str(old_chat_id) in CHAT_BLACKLISTS:
+            CHAT_BLACKLISTS[str(new_chat_id)] = CHAT_BLACKLISTS.pop(str(old_chat_id))
+        if str(old_chat_id) in CHAT_BLACKLIST_MATCHERS:
+            CHAT_BLACKLIST_MATCHERS[str(new_chat_id)] = CHAT_BLACKLIST_MATCHERS.pop(str(old_chat_id))
+
 
 __load_chat_blacklists()
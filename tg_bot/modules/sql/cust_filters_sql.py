@@ -1,8 +1,12 @@
 import threading
 
 from sqlalchemy import Column, String, UnicodeText, Boolean, Integer, distinct, func
+from telegram import InlineKeyboardMarkup, Message, ParseMode
 
-from tg_bot.modules.sql import BASE, SESSION
+from tg_bot.modules.helper_funcs.cache import LRUCache
+from tg_bot.modules.helper_funcs.misc import build_keyboard
+from tg_bot.modules.helper_funcs.trigger_matcher import TriggerMatcher
+from tg_bot.modules.sql import BASE, SESSION, COMPOSITE_AUTOINCREMENT, autoincrement_key_args
 
 
 class CustomFilters(BASE):
@@ -47,11 +51,12 @@ class CustomFilters(BASE):
 class Buttons(BASE):
     __tablename__ = "cust_filter_urls"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    chat_id = Column(String(14), primary_key=True)
-    keyword = Column(UnicodeText, primary_key=True)
+    chat_id = Column(String(14), primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
+    keyword = Column(UnicodeText, primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
     name = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
+    __table_args__ = autoincrement_key_args('chat_id', 'keyword')
 
     def __init__(self, chat_id, keyword, name, url, same_line=False):
         self.chat_id = str(chat_id)
@@ -67,6 +72,52 @@ Buttons.__table__.create(checkfirst=True)
 CUST_FILT_LOCK = threading.RLock()
 BUTTON_LOCK = threading.RLock()
 CHAT_FILTERS = {}
+CHAT_FILTER_MATCHERS = {}
+
+FILTER_REPLY_CACHE_SIZE = 10000
+
+# (chat_id, keyword) -> FilterReply
+FILTER_REPLIES = LRUCache(FILTER_REPLY_CACHE_SIZE)
+
+
+class FilterReply(object):
+    """
+    Everything needed to answer a matched filter: the Message method to reply with, its payload and keyword
+    arguments, with the keyboard already built. Shared between threads, so treat it as read only.
+    """
+    __slots__ = ('keyword', 'send', 'reply', 'parse_mode', 'keyboard', 'send_kwargs')
+
+    def __init__(self, filt, buttons):
+        self.keyword = filt.keyword
+        self.reply = filt.reply
+        self.parse_mode = None
+        self.keyboard = None
+        self.send_kwargs = {}
+
+        if filt.is_sticker:
+            self.send = Message.reply_sticker
+        elif filt.is_document:
+            self.send = Message.reply_document
+        elif filt.is_image:
+            self.send = Message.reply_photo
+        elif filt.is_audio:
+            self.send = Message.reply_audio
+        elif filt.is_voice:
+            self.send = Message.reply_voice
+        elif filt.is_video:
+            self.send = Message.reply_video
+        else:
+            self.send = Message.reply_text
+            # LEGACY - all new filters will have has_markdown set to True.
+            if filt.has_markdown:
+                self.parse_mode = ParseMode.MARKDOWN
+                self.keyboard = InlineKeyboardMarkup(build_keyboard(buttons))
+                self.send_kwargs = {'parse_mode': self.parse_mode,
+                                    'disable_web_page_preview': True,
+                                    'reply_markup': self.keyboard}
+
+    def __repr__(self):
+        return "<Filter reply for %s>" % self.keyword
 
 
 def get_all_filters():
@@ -99,6 +150,7 @@ def add_filter(chat_id, keyword, reply, is_sticker=False, is_document=False, is_
         if keyword not in CHAT_FILTERS.get(str(chat_id), []):
             CHAT_FILTERS[str(chat_id)] = sorted(CHAT_FILTERS.get(str(chat_id), []) + [keyword],
                                                 key=lambda x: (-len(x), x))
+            CHAT_FILTER_MATCHERS.setdefault(str(chat_id), TriggerMatcher()).add(keyword)
 
         SESSION.add(filt)
         SESSION.commit()
@@ -106,6 +158,8 @@ def add_filter(chat_id, keyword, reply, is_sticker=False, is_document=False, is_
     for b_name, url, same_line in buttons:
         add_note_button_to_db(chat_id, keyword, b_name, url, same_line)
 
+    FILTER_REPLIES.pop((str(chat_id), keyword))
+
 
 def remove_filter(chat_id, keyword):
     global CHAT_FILTERS
@@ -114,6 +168,8 @@ def remove_filter(chat_id, keyword):
         if filt:
             if keyword in CHAT_FILTERS.get(str(chat_id), []):  # Sanity check
                 CHAT_FILTERS.get(str(chat_id), []).remove(keyword)
+            if str(chat_id) in CHAT_FILTER_MATCHERS:
+                CHAT_FILTER_MATCHERS[str(chat_id)].remove(keyword)
 
             with BUTTON_LOCK:
                 prev_buttons = SESSION.query(Buttons).filter(Buttons.chat_id == str(chat_id),
@@ -123,6 +179,7 @@ def remove_filter(chat_id, keyword):
 
             SESSION.delete(filt)
             SESSION.commit()
+            FILTER_REPLIES.pop((str(chat_id), keyword))
             return True
 
         SESSION.close()
@@ -133,6 +190,13 @@ def get_chat_triggers(chat_id):
     return CHAT_FILTERS.get(str(chat_id), set())
 
 
+def get_chat_filter_match(chat_id, text):
+    matcher = CHAT_FILTER_MATCHERS.get(str(chat_id))
+    if not matcher:
+        return None
+    return matcher.search(text)
+
+
 def get_chat_filters(chat_id):
     try:
         return SESSION.query(CustomFilters).filter(CustomFilters.chat_id == str(chat_id)).order_by(
@@ -148,6 +212,18 @@ def get_filter(chat_id, keyword):
         SESSION.close()
 
 
+def get_filter_reply(chat_id, keyword):
+    key = (str(chat_id), keyword)
+    filt_reply = FILTER_REPLIES.get(key)
+    if filt_reply is None:
+        filt = get_filter(chat_id, keyword)
+        if not filt:
+            return None
+        filt_reply = FilterReply(filt, get_buttons(chat_id, keyword) if filt.has_markdown else [])
+        FILTER_REPLIES.set(key, filt_reply)
+    return filt_reply
+
+
 def add_note_button_to_db(chat_id, keyword, b_name, url, same_line):
     with BUTTON_LOCK:
         button = Buttons(chat_id, keyword, b_name, url, same_line)
@@ -178,7 +254,7 @@ def num_chats():
 
 
 def __load_chat_filters():
-    global CHAT_FILTERS
+    global CHAT_FILTERS, CHAT_FILTER_MATCHERS
     try:
         chats = SESSION.query(CustomFilters.chat_id).distinct().all()
         for (chat_id,) in chats:  # remove tuple by ( ,)
@@ -189,6 +265,7 @@ def __load_chat_filters():
             CHAT_FILTERS[x.chat_id] += [x.keyword]
 
         CHAT_FILTERS = {x: sorted(set(y), key=lambda i: (-len(i), i)) for x, y in CHAT_FILTERS.items()}
+        CHAT_FILTER_MATCHERS = {x: TriggerMatcher(y) for x, y in CHAT_FILTERS.items()}
 
     finally:
         SESSION.close()
@@ -200,8 +277,9 @@ def migrate_chat(old_chat_id, new_chat_id):
         for filt in chat_filters:
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
-        CHAT_FILTERS[str(new_chat_id)] = CHAT_FILTERS[str(old_chat_id)]
-        del CHAT_FILTERS[str(old_chat_id)]
+        CHAT_FILTERS[str(new_chat_id)] = CHAT_FILTERS.pop(str(old_chat_id), [])
+        if str(old_chat_id) in CHAT_FILTER_MATCHERS:
+            CHAT_FILTER_MATCHERS[str(new_chat_id)] = CHAT_FILTER_MATCHERS.pop(str(old_chat_id))
 
         with BUTTON_LOCK:
             chat_buttons = SESSION.query(Buttons).filter(Buttons.chat_id == str(old_chat_id)).all()
@@ -209,5 +287,7 @@ def migrate_chat(old_chat_id, new_chat_id):
                 btn.chat_id = str(new_chat_id)
             SESSION.commit()
 
+        FILTER_REPLIES.pop_matching(lambda key: key[0] in (str(old_chat_id), str(new_chat_id)))
+
 
 __load_chat_filters()
@@ -1,8 +1,10 @@
+import ast
 import threading
 
 from sqlalchemy import Column, String, UnicodeText, func, distinct, Integer, Boolean
 
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot import LOGGER
+from tg_bot.modules.sql import SESSION, BASE, BULK_BATCH
 
 
 class Federations(BASE):
@@ -46,6 +48,18 @@ class BansF(BASE):
 		self.user_name = user_name
 		self.reason = reason
 
+class FedAdmins(BASE):
+	__tablename__ = "feds_admins"
+	fed_id = Column(UnicodeText, primary_key=True)
+	user_id = Column(String(14), primary_key=True)
+
+	def __init__(self, fed_id, user_id):
+		self.fed_id = fed_id
+		self.user_id = user_id
+
+	def __repr__(self):
+		return "<Fed admin {} in {}>".format(self.user_id, self.fed_id)
+
 class FedsUserSettings(BASE):
 	__tablename__ = "feds_settings"
 	user_id = Column(Integer, primary_key=True)
@@ -65,6 +79,7 @@ class FedsUserSettings(BASE):
 Federations.__table__.create(checkfirst=True)
 ChatF.__table__.create(checkfirst=True)
 BansF.__table__.create(checkfirst=True)
+FedAdmins.__table__.create(checkfirst=True)
 FedsUserSettings.__table__.create(checkfirst=True)
 
 FEDS_LOCK = threading.RLock()
@@ -82,6 +97,9 @@ FEDERATION_CHATS_BYID = {}
 FEDERATION_BANNED_FULL = {}
 FEDERATION_BANNED_USERID = {}
 
+# fed_id -> set of admin user ids, not including the owner
+FEDERATION_ADMINS = {}
+
 FEDERATION_NOTIFICATION = {}
 
 
@@ -103,12 +121,13 @@ def get_fed_id(chat_id):
 def new_fed(owner_id, fed_name, fed_id):
 	with FEDS_LOCK:
 		global FEDERATION_BYOWNER, FEDERATION_BYFEDID, FEDERATION_BYNAME
-		fed = Federations(str(owner_id), fed_name, str(fed_id), 'Rules is not set in this federation.', str({'owner': str(owner_id), 'members': '[]'}))
+		fed = Federations(str(owner_id), fed_name, str(fed_id), 'Rules is not set in this federation.', None)
 		SESSION.add(fed)
 		SESSION.commit()
-		FEDERATION_BYOWNER[str(owner_id)] = ({'fid': str(fed_id), 'fname': fed_name, 'frules': 'Rules is not set in this federation.', 'fusers': str({'owner': str(owner_id), 'members': '[]'})})
-		FEDERATION_BYFEDID[str(fed_id)] = ({'owner': str(owner_id), 'fname': fed_name, 'frules': 'Rules is not set in this federation.', 'fusers': str({'owner': str(owner_id), 'members': '[]'})})
-		FEDERATION_BYNAME[fed_name] = ({'fid': str(fed_id), 'owner': str(owner_id), 'frules': 'Rules is not set in this federation.', 'fusers': str({'owner': str(owner_id), 'members': '[]'})})
+		FEDERATION_BYOWNER[str(owner_id)] = ({'fid': str(fed_id), 'fname': fed_name, 'frules': 'Rules is not set in this federation.'})
+		FEDERATION_BYFEDID[str(fed_id)] = ({'owner': str(owner_id), 'fname': fed_name, 'frules': 'Rules is not set in this federation.'})
+		FEDERATION_BYNAME[fed_name] = ({'fid': str(fed_id), 'owner': str(owner_id), 'frules': 'Rules is not set in this federation.'})
+		FEDERATION_ADMINS[str(fed_id)] = set()
 		return fed
 
 def del_fed(fed_id):
@@ -134,15 +153,14 @@ def del_fed(fed_id):
 				FEDERATION_CHATS.pop(x)
 			FEDERATION_CHATS_BYID.pop(fed_id)
 		# Delete fedban users
-		getall = FEDERATION_BANNED_USERID.get(fed_id)
-		if getall:
-			for x in getall:
-				banlist = SESSION.query(BansF).get((fed_id, str(x)))
-				if banlist:
-					SESSION.delete(banlist)
-					SESSION.commit()
-		FEDERATION_BANNED_USERID.pop(fed_id)
-		FEDERATION_BANNED_FULL.pop(fed_id)
+		SESSION.query(BansF).filter(BansF.fed_id == fed_id).delete(synchronize_session=False)
+		SESSION.commit()
+		FEDERATION_BANNED_USERID.pop(fed_id, None)
+		FEDERATION_BANNED_FULL.pop(fed_id, None)
+		# Delete fed admins
+		SESSION.query(FedAdmins).filter(FedAdmins.fed_id == fed_id).delete(synchronize_session=False)
+		SESSION.commit()
+		FEDERATION_ADMINS.pop(fed_id, None)
 		# Delete from database
 		curr = SESSION.query(Federations).get(fed_id)
 		if curr:
@@ -170,73 +188,31 @@ def search_fed_by_name(fed_name):
 	return allfed
 
 def search_user_in_fed(fed_id, user_id):
-	getfed = FEDERATION_BYFEDID.get(fed_id)
-	if getfed == None:
-		return False
-	getfed = eval(getfed['fusers'])['members']
-	if user_id in eval(getfed):
-		return True
-	else:
+	try:
+		return int(user_id) in FEDERATION_ADMINS.get(str(fed_id), ())
+	except (TypeError, ValueError):
 		return False
 
 
 def user_demote_fed(fed_id, user_id):
 	with FEDS_LOCK:
-		global FEDERATION_BYOWNER, FEDERATION_BYFEDID, FEDERATION_BYNAME
-		# Variables
-		getfed = FEDERATION_BYFEDID.get(str(fed_id))
-		owner_id = getfed['owner']
-		fed_name = getfed['fname']
-		fed_rules = getfed['frules']
-		# Temp set
-		try:
-			members = eval(eval(getfed['fusers'])['members'])
-		except ValueError:
+		admin = SESSION.query(FedAdmins).get((str(fed_id), str(user_id)))
+		if not admin:
+			SESSION.close()
 			return False
-		members.remove(user_id)
-		# Set user
-		FEDERATION_BYOWNER[str(owner_id)]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		FEDERATION_BYFEDID[str(fed_id)]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		FEDERATION_BYNAME[fed_name]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		# Set on database
-		fed = Federations(str(owner_id), fed_name, str(fed_id), fed_rules, str({'owner': str(owner_id), 'members': str(members)}))
-		SESSION.merge(fed)
+		SESSION.delete(admin)
 		SESSION.commit()
+		FEDERATION_ADMINS.get(str(fed_id), set()).discard(int(user_id))
 		return True
 
-		curr = SESSION.query(UserF).all()
-		result = False
-		for r in curr:
-			if int(r.user_id) == int(user_id):
-				if r.fed_id == fed_id:
-					SESSION.delete(r)
-					SESSION.commit()
-					result = True
-
-		SESSION.close()
-		return result
-
 
 def user_join_fed(fed_id, user_id):
 	with FEDS_LOCK:
-		global FEDERATION_BYOWNER, FEDERATION_BYFEDID, FEDERATION_BYNAME
-		# Variables
-		getfed = FEDERATION_BYFEDID.get(str(fed_id))
-		owner_id = getfed['owner']
-		fed_name = getfed['fname']
-		fed_rules = getfed['frules']
-		# Temp set
-		members = eval(eval(getfed['fusers'])['members'])
-		members.append(user_id)
-		# Set user
-		FEDERATION_BYOWNER[str(owner_id)]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		FEDERATION_BYFEDID[str(fed_id)]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		FEDERATION_BYNAME[fed_name]['fusers'] = str({'owner': str(owner_id), 'members': str(members)})
-		# Set on database
-		fed = Federations(str(owner_id), fed_name, str(fed_id), fed_rules, str({'owner': str(owner_id), 'members': str(members)}))
-		SESSION.merge(fed)
+		if str(fed_id) not in FEDERATION_BYFEDID:
+			return False
+		SESSION.merge(FedAdmins(str(fed_id), str(user_id)))
 		SESSION.commit()
-		__load_all_feds_chats()
+		FEDERATION_ADMINS.setdefault(str(fed_id), set()).add(int(user_id))
 		return True
 
 
@@ -252,11 +228,12 @@ def chat_leave_fed(chat_id):
 		FEDERATION_CHATS.pop(str(chat_id))
 		FEDERATION_CHATS_BYID[str(fed_id)].remove(str(chat_id))
 		# Delete from db
-		curr = SESSION.query(ChatF).all()
-		for U in curr:
-			if int(U.chat_id) == int(chat_id):
-				SESSION.delete(U)
-				SESSION.commit()
+		curr = SESSION.query(ChatF).get(str(chat_id))
+		if curr:
+			SESSION.delete(curr)
+			SESSION.commit()
+		else:
+			SESSION.close()
 		return True
 
 def all_fed_chats(fed_id):
@@ -268,20 +245,22 @@ def all_fed_chats(fed_id):
 			return getfed
 
 def all_fed_users(fed_id):
-	with FEDS_LOCK:
-		getfed = FEDERATION_BYFEDID.get(str(fed_id))
-		if getfed == None:
-			return False
-		fed_owner = eval(eval(getfed['fusers'])['owner'])
-		fed_admins = eval(eval(getfed['fusers'])['members'])
-		fed_admins.append(fed_owner)
-		return fed_admins
+	getfed = FEDERATION_BYFEDID.get(str(fed_id))
+	if getfed == None:
+		return False
+	fed_admins = list(FEDERATION_ADMINS.get(str(fed_id), ()))
+	fed_admins.append(int(getfed['owner']))
+	return fed_admins
 
 def all_fed_members(fed_id):
-	with FEDS_LOCK:
-		getfed = FEDERATION_BYFEDID.get(str(fed_id))
-		fed_admins = eval(eval(getfed['fusers'])['members'])
-		return fed_admins
+	return list(FEDERATION_ADMINS.get(str(fed_id), ()))
+
+
+def is_fed_admin(fed_id, user_id):
+	getfed = FEDERATION_BYFEDID.get(str(fed_id))
+	if getfed == None:
+		return False
+	return str(user_id) == getfed['owner'] or search_user_in_fed(fed_id, user_id)
 
 
 def set_frules(fed_id, rules):
@@ -291,15 +270,14 @@ def set_frules(fed_id, rules):
 		getfed = FEDERATION_BYFEDID.get(str(fed_id))
 		owner_id = getfed['owner']
 		fed_name = getfed['fname']
-		fed_members = getfed['fusers']
 		fed_rules = str(rules)
 		# Set user
 		FEDERATION_BYOWNER[str(owner_id)]['frules'] = fed_rules
 		FEDERATION_BYFEDID[str(fed_id)]['frules'] = fed_rules
 		FEDERATION_BYNAME[fed_name]['frules'] = fed_rules
 		# Set on database
-		fed = Federations(str(owner_id), fed_name, str(fed_id), fed_rules, str(fed_members))
-		SESSION.merge(fed)
+		fed = SESSION.query(Federations).get(str(fed_id))
+		fed.fed_rules = fed_rules
 		SESSION.commit()
 		return True
 
@@ -310,81 +288,109 @@ def get_frules(fed_id):
 		return rules
 
 
+def __cache_fban(fed_id, user_id, first_name, last_name, user_name, reason):
+	FEDERATION_BANNED_USERID.setdefault(fed_id, set()).add(int(user_id))
+	FEDERATION_BANNED_FULL.setdefault(fed_id, {})[str(user_id)] = {'first_name': first_name, 'last_name': last_name, 'user_name': user_name, 'reason': reason}
+
+
+def __uncache_fban(fed_id, user_id):
+	FEDERATION_BANNED_USERID.get(fed_id, set()).discard(int(user_id))
+	FEDERATION_BANNED_FULL.get(fed_id, {}).pop(str(user_id), None)
+
+
 def fban_user(fed_id, user_id, first_name, last_name, user_name, reason):
 	with FEDS_LOCK:
-		r = SESSION.query(BansF).all()
-		for I in r:
-			if I.fed_id == fed_id:
-				if int(I.user_id) == int(user_id):
-					SESSION.delete(I)
-
 		r = BansF(str(fed_id), str(user_id), first_name, last_name, user_name, reason)
-
-		SESSION.add(r)
 		try:
+			r = SESSION.merge(r)  # keyed on (fed_id, user_id), replaces any previous ban
 			SESSION.commit()
 		except:
 			SESSION.rollback()
 			return False
-		finally:
-			SESSION.commit()
-		__load_all_feds_banned()
+		__cache_fban(str(fed_id), user_id, first_name, last_name, user_name, reason)
 		return r
 
 
 def un_fban_user(fed_id, user_id):
 	with FEDS_LOCK:
-		r = SESSION.query(BansF).all()
-		for I in r:
-			if I.fed_id == fed_id:
-				if int(I.user_id) == int(user_id):
-					SESSION.delete(I)
+		r = SESSION.query(BansF).get((str(fed_id), str(user_id)))
+		if not r:
+			SESSION.close()
+			return False
 		try:
+			SESSION.delete(r)
 			SESSION.commit()
 		except:
 			SESSION.rollback()
 			return False
-		finally:
+		__uncache_fban(str(fed_id), user_id)
+		return r
+
+FBAN_IMPORT_CHUNK = BULK_BATCH
+
+
+def __write_fban_chunk(fed_id, chunk):
+	SESSION.query(BansF).filter(BansF.fed_id == fed_id, BansF.user_id.in_(list(chunk))).delete(synchronize_session=False)
+	SESSION.bulk_insert_mappings(BansF, [{'fed_id': fed_id, 'user_id': user_id, 'first_name': first_name, 'last_name': last_name, 'user_name': user_name, 'reason': reason}
+										 for user_id, (first_name, last_name, user_name, reason) in chunk.items()])
+
+
+def multi_fban_user(fed_id, rows):
+	"""
+	Bulk fban for imports. rows is an iterable of (user_id, first_name, last_name, user_name, reason); it is consumed
+	lazily and written in chunks of FBAN_IMPORT_CHUNK inside a single transaction. The ban cache is updated once the
+	transaction is committed.
+
+	:return: number of banned users, or False if the import was rolled back
+	"""
+	fed_id = str(fed_id)
+	with FEDS_LOCK:
+		imported = {}
+		chunk = {}
+		try:
+			for user_id, first_name, last_name, user_name, reason in rows:
+				chunk[str(user_id)] = (first_name, last_name, user_name, reason)
+				if len(chunk) >= FBAN_IMPORT_CHUNK:
+					__write_fban_chunk(fed_id, chunk)
+					imported.update(chunk)
+					chunk = {}
+			if chunk:
+				__write_fban_chunk(fed_id, chunk)
+				imported.update(chunk)
 			SESSION.commit()
-		__load_all_feds_banned()
-		return I
+		except Exception:
+			LOGGER.exception("Failed to import fbans into federation %s, rolled back", fed_id)
+			SESSION.rollback()
+			return False
+		for user_id, (first_name, last_name, user_name, reason) in imported.items():
+			__cache_fban(fed_id, user_id, first_name, last_name, user_name, reason)
+		return len(imported)
 
 def get_fban_user(fed_id, user_id):
-	list_fbanned = FEDERATION_BANNED_USERID.get(fed_id)
-	if list_fbanned == None:
-		FEDERATION_BANNED_USERID[fed_id] = []
-	if user_id in FEDERATION_BANNED_USERID[fed_id]:
-		r = SESSION.query(BansF).all()
-		reason = None
-		for I in r:
-			if I.fed_id == fed_id:
-				if int(I.user_id) == int(user_id):
-					reason = I.reason
+	try:
+		user_id = int(user_id)
+	except (TypeError, ValueError):
+		return False, None
+	if user_id in FEDERATION_BANNED_USERID.get(fed_id, ()):
+		reason = FEDERATION_BANNED_FULL.get(fed_id, {}).get(str(user_id), {}).get('reason')
 		return True, reason
 	else:
 		return False, None
 
 
 def get_all_fban_users(fed_id):
-	list_fbanned = FEDERATION_BANNED_USERID.get(fed_id)
-	if list_fbanned == None:
-		FEDERATION_BANNED_USERID[fed_id] = []
-	return FEDERATION_BANNED_USERID[fed_id]
+	# a copy, since fbans and unfbans update the cached set in place
+	return set(FEDERATION_BANNED_USERID.get(fed_id, ()))
 
 def get_all_fban_users_target(fed_id, user_id):
-	list_fbanned = FEDERATION_BANNED_FULL.get(fed_id)
-	if list_fbanned == None:
-		FEDERATION_BANNED_FULL[fed_id] = []
-		return False
-	getuser = list_fbanned[str(user_id)]
-	return getuser
+	return FEDERATION_BANNED_FULL.get(fed_id, {}).get(str(user_id), False)
 
 
 def get_all_fban_users_global():
 	list_fbanned = FEDERATION_BANNED_USERID
 	total = []
 	for x in list(FEDERATION_BANNED_USERID):
-		for y in FEDERATION_BANNED_USERID[x]:
+		for y in list(FEDERATION_BANNED_USERID.get(x, ())):
 			total.append(y)
 	return total
 
@@ -437,17 +443,49 @@ def __load_all_feds():
 			check = FEDERATION_BYOWNER.get(x.owner_id)
 			if check == None:
 				FEDERATION_BYOWNER[x.owner_id] = []
-			FEDERATION_BYOWNER[str(x.owner_id)] = {'fid': str(x.fed_id), 'fname': x.fed_name, 'frules': x.fed_rules, 'fusers': str(x.fed_users)}
+			FEDERATION_BYOWNER[str(x.owner_id)] = {'fid': str(x.fed_id), 'fname': x.fed_name, 'frules': x.fed_rules}
 			# Fed By FedId
 			check = FEDERATION_BYFEDID.get(x.fed_id)
 			if check == None:
 				FEDERATION_BYFEDID[x.fed_id] = []
-			FEDERATION_BYFEDID[str(x.fed_id)] = {'owner': str(x.owner_id), 'fname': x.fed_name, 'frules': x.fed_rules, 'fusers': str(x.fed_users)}
+			FEDERATION_BYFEDID[str(x.fed_id)] = {'owner': str(x.owner_id), 'fname': x.fed_name, 'frules': x.fed_rules}
 			# Fed By Name
 			check = FEDERATION_BYNAME.get(x.fed_name)
 			if check == None:
 				FEDERATION_BYNAME[x.fed_name] = []
-			FEDERATION_BYNAME[x.fed_name] = {'fid': str(x.fed_id), 'owner': str(x.owner_id), 'frules': x.fed_rules, 'fusers': str(x.fed_users)}
+			FEDERATION_BYNAME[x.fed_name] = {'fid': str(x.fed_id), 'owner': str(x.owner_id), 'frules': x.fed_rules}
+	finally:
+		SESSION.close()
+
+def __parse_legacy_fed_users(fed_users):
+	# fed_users used to hold str({'owner': ..., 'members': str(list_of_ids)})
+	try:
+		members = ast.literal_eval(ast.literal_eval(fed_users)['members'])
+		return {int(x) for x in members}
+	except (ValueError, SyntaxError, KeyError, TypeError):
+		return None
+
+def __load_all_fed_admins():
+	global FEDERATION_ADMINS
+	try:
+		FEDERATION_ADMINS = {fed_id: set() for fed_id in FEDERATION_BYFEDID}
+		for x in SESSION.query(FedAdmins).all():
+			FEDERATION_ADMINS.setdefault(x.fed_id, set()).add(int(x.user_id))
+
+		# One-off migration of feds still storing their admins in the fed_users string
+		legacy = SESSION.query(Federations).filter(Federations.fed_users != None).all()
+		for fed in legacy:
+			members = __parse_legacy_fed_users(fed.fed_users)
+			if members is None:
+				# keep the old column, so the admins can still be recovered by hand
+				LOGGER.warning("Could not parse the admins of federation %s, leaving fed_users as it is", fed.fed_id)
+				continue
+			admins = FEDERATION_ADMINS.setdefault(fed.fed_id, set())
+			for user_id in members - admins:
+				SESSION.add(FedAdmins(fed.fed_id, str(user_id)))
+				admins.add(user_id)
+			fed.fed_users = None
+		SESSION.commit()
 	finally:
 		SESSION.close()
 
@@ -478,15 +516,7 @@ def __load_all_feds_banned():
 		FEDERATION_BANNED_FULL = {}
 		qall = SESSION.query(BansF).all()
 		for x in qall:
-			check = FEDERATION_BANNED_USERID.get(x.fed_id)
-			if check == None:
-				FEDERATION_BANNED_USERID[x.fed_id] = []
-			if int(x.user_id) not in FEDERATION_BANNED_USERID[x.fed_id]:
-				FEDERATION_BANNED_USERID[x.fed_id].append(int(x.user_id))
-			check = FEDERATION_BANNED_FULL.get(x.fed_id)
-			if check == None:
-				FEDERATION_BANNED_FULL[x.fed_id] = {}
-			FEDERATION_BANNED_FULL[x.fed_id][x.user_id] = {'first_name': x.first_name, 'last_name': x.last_name, 'user_name': x.user_name, 'reason': x.reason}
+			__cache_fban(x.fed_id, x.user_id, x.first_name, x.last_name, x.user_name, x.reason)
 	finally:
 		SESSION.close()
 
@@ -501,6 +531,7 @@ def __load_all_feds_settings():
 
 
 __load_all_feds()
+__load_all_fed_admins()
 __load_all_feds_chats()
 __load_all_feds_banned()
 __load_all_feds_settings()
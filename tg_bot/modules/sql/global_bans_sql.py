@@ -1,4 +1,5 @@
 import threading
+import uuid
 
 from sqlalchemy import Column, UnicodeText, Integer, String, Boolean
 
@@ -39,11 +40,32 @@ class GbanSettings(BASE):
         return "<Gban setting {} ({})>".format(self.chat_id, self.setting)
 
 
+class GbanFanout(BASE):
+    __tablename__ = "gban_fanout"
+    user_id = Column(Integer, primary_key=True)
+    action = Column(String(10), nullable=False)
+    # identifies one run; a newer run for the same user replaces it, even for the same action
+    run_id = Column(String(32), nullable=False)
+    # last chat_id done, chats are processed in ascending chat_id string order
+    cursor = Column(String(14), default="", nullable=False)
+
+    def __init__(self, user_id, action, run_id, cursor=""):
+        self.user_id = user_id
+        self.action = action
+        self.run_id = run_id
+        self.cursor = cursor
+
+    def __repr__(self):
+        return "<Gban fan-out {} for {} at {}>".format(self.action, self.user_id, self.cursor)
+
+
 GloballyBannedUsers.__table__.create(checkfirst=True)
 GbanSettings.__table__.create(checkfirst=True)
+GbanFanout.__table__.create(checkfirst=True)
 
 GBANNED_USERS_LOCK = threading.RLock()
 GBAN_SETTING_LOCK = threading.RLock()
+FANOUT_LOCK = threading.RLock()
 GBANNED_LIST = set()
 GBANSTAT_LIST = set()
 
@@ -133,6 +155,50 @@ def does_chat_gban(chat_id):
     return str(chat_id) not in GBANSTAT_LIST
 
 
+def start_fanout(user_id, action):
+    """
+    One fan-out per user: a new gban/ungban replaces (and so cancels) any pending one.
+
+    :return: the run id that the new fan-out reports its progress under
+    """
+    run_id = uuid.uuid4().hex
+    with FANOUT_LOCK:
+        SESSION.merge(GbanFanout(user_id, action, run_id))
+        SESSION.commit()
+    return run_id
+
+
+def set_fanout_cursor(user_id, run_id, cursor):
+    """
+    Record progress of a running fan-out.
+
+    :return: False if the fan-out was finished or replaced in the meantime, and should stop
+    """
+    with FANOUT_LOCK:
+        fanout = SESSION.query(GbanFanout).get(user_id)
+        if not fanout or fanout.run_id != run_id:
+            SESSION.close()
+            return False
+        fanout.cursor = str(cursor)
+        SESSION.commit()
+        return True
+
+
+def finish_fanout(user_id, run_id):
+    with FANOUT_LOCK:
+        fanout = SESSION.query(GbanFanout).get(user_id)
+        if fanout and fanout.run_id == run_id:
+            SESSION.delete(fanout)
+        SESSION.commit()
+
+
+def get_pending_fanouts():
+    try:
+        return [(x.user_id, x.action, x.run_id, x.cursor) for x in SESSION.query(GbanFanout).all()]
+    finally:
+        SESSION.close()
+
+
 def num_gbanned_users():
     return len(GBANNED_LIST)
 
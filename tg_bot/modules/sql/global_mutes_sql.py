@@ -58,7 +58,7 @@ def gmute_user(user_id, name, reason=None):
 
         SESSION.merge(user)
         SESSION.commit()
-        __load_gmuted_userid_list()
+        GMUTED_LIST.add(user_id)
 
 
 def update_gmute_reason(user_id, name, reason=None):
@@ -81,7 +81,7 @@ def ungmute_user(user_id):
             SESSION.delete(user)
 
         SESSION.commit()
-        __load_gmuted_userid_list()
+        GMUTED_LIST.discard(user_id)
 
 
 def is_user_gmuted(user_id):
@@ -155,10 +155,13 @@ def migrate_chat(old_chat_id, new_chat_id):
     with GMUTE_SETTING_LOCK:
         chat = SESSION.query(GmuteSettings).get(str(old_chat_id))
         if chat:
-            chat.chat_id = new_chat_id
+            chat.chat_id = str(new_chat_id)
             SESSION.add(chat)
 
         SESSION.commit()
+        if str(old_chat_id) in GMUTESTAT_LIST:
+            GMUTESTAT_LIST.discard(str(old_chat_id))
+            GMUTESTAT_LIST.add(str(new_chat_id))
 
 
 # Create in memory userid to avoid disk access
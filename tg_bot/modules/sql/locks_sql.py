@@ -71,6 +71,36 @@ Restrictions.__table__.create(checkfirst=True)
 PERM_LOCK = threading.RLock()
 RESTR_LOCK = threading.RLock()
 
+# one bit per lockable; a chat's mask has the bit set when that type is locked
+LOCK_BITS = {lock_type: 1 << i for i, lock_type in enumerate(('audio', 'voice', 'contact', 'video', 'document',
+                                                               'photo', 'sticker', 'gif', 'url', 'bots', 'forward',
+                                                               'game', 'location'))}
+RESTR_BITS = {'messages': 1 << 0,
+              'media': 1 << 1,
+              'other': 1 << 2,
+              'previews': 1 << 3}
+RESTR_BITS['all'] = RESTR_BITS['messages'] | RESTR_BITS['media'] | RESTR_BITS['other'] | RESTR_BITS['previews']
+
+# chat_id -> mask, only for chats with something locked
+CHAT_LOCKS = {}
+CHAT_RESTRICTIONS = {}
+
+
+def __perm_mask(perm):
+    return sum(bit for lock_type, bit in LOCK_BITS.items() if getattr(perm, lock_type))
+
+
+def __restr_mask(restr):
+    flags = {'messages': restr.messages, 'media': restr.media, 'other': restr.other, 'previews': restr.preview}
+    return sum(RESTR_BITS[restr_type] for restr_type, locked in flags.items() if locked)
+
+
+def __set_mask(cache, chat_id, mask):
+    if mask:
+        cache[str(chat_id)] = mask
+    else:
+        cache.pop(str(chat_id), None)
+
 
 def init_permissions(chat_id, reset=False):
     curr_perm = SESSION.query(Permissions).get(str(chat_id))
@@ -80,6 +110,7 @@ def init_permissions(chat_id, reset=False):
     perm = Permissions(str(chat_id))
     SESSION.add(perm)
     SESSION.commit()
+    __set_mask(CHAT_LOCKS, chat_id, 0)
     return perm
 
 
@@ -91,6 +122,7 @@ def init_restrictions(chat_id, reset=False):
     restr = Restrictions(str(chat_id))
     SESSION.add(restr)
     SESSION.commit()
+    __set_mask(CHAT_RESTRICTIONS, chat_id, 0)
     return restr
 
 
@@ -129,6 +161,7 @@ def update_lock(chat_id, lock_type, locked):
 
         SESSION.add(curr_perm)
         SESSION.commit()
+        __set_mask(CHAT_LOCKS, chat_id, __perm_mask(curr_perm))
 
 
 def update_restriction(chat_id, restr_type, locked):
@@ -152,60 +185,25 @@ def update_restriction(chat_id, restr_type, locked):
             curr_restr.preview = locked
         SESSION.add(curr_restr)
         SESSION.commit()
+        __set_mask(CHAT_RESTRICTIONS, chat_id, __restr_mask(curr_restr))
 
 
-def is_locked(chat_id, lock_type):
-    curr_perm = SESSION.query(Permissions).get(str(chat_id))
-    SESSION.close()
-
-    if not curr_perm:
-        return False
-
-    elif lock_type == "sticker":
-        return curr_perm.sticker
-    elif lock_type == "photo":
-        return curr_perm.photo
-    elif lock_type == "audio":
-        return curr_perm.audio
-    elif lock_type == "voice":
-        return curr_perm.voice
-    elif lock_type == "contact":
-        return curr_perm.contact
-    elif lock_type == "video":
-        return curr_perm.video
-    elif lock_type == "document":
-        return curr_perm.document
-    elif lock_type == "gif":
-        return curr_perm.gif
-    elif lock_type == "url":
-        return curr_perm.url
-    elif lock_type == "bots":
-        return curr_perm.bots
-    elif lock_type == "forward":
-        return curr_perm.forward
-    elif lock_type == "game":
-        return curr_perm.game
-    elif lock_type == "location":
-        return curr_perm.location
+def get_lock_mask(chat_id):
+    return CHAT_LOCKS.get(str(chat_id), 0)
 
 
-def is_restr_locked(chat_id, lock_type):
-    curr_restr = SESSION.query(Restrictions).get(str(chat_id))
-    SESSION.close()
+def get_restr_mask(chat_id):
+    return CHAT_RESTRICTIONS.get(str(chat_id), 0)
 
-    if not curr_restr:
-        return False
 
-    if lock_type == "messages":
-        return curr_restr.messages
-    elif lock_type == "media":
-        return curr_restr.media
-    elif lock_type == "other":
-        return curr_restr.other
-    elif lock_type == "previews":
-        return curr_restr.preview
-    elif lock_type == "all":
-        return curr_restr.messages and curr_restr.media and curr_restr.other and curr_restr.preview
+def is_locked(chat_id, lock_type):
+    bit = LOCK_BITS.get(lock_type, 0)
+    return bool(bit) and get_lock_mask(chat_id) & bit == bit
+
+
+def is_restr_locked(chat_id, lock_type):
+    bit = RESTR_BITS.get(lock_type, 0)
+    return bool(bit) and get_restr_mask(chat_id) & bit == bit
 
 
 def get_locks(chat_id):
@@ -228,9 +226,28 @@ def migrate_chat(old_chat_id, new_chat_id):
         if perms:
             perms.chat_id = str(new_chat_id)
         SESSION.commit()
+        __set_mask(CHAT_LOCKS, new_chat_id, CHAT_LOCKS.pop(str(old_chat_id), 0))
 
     with RESTR_LOCK:
         rest = SESSION.query(Restrictions).get(str(old_chat_id))
         if rest:
             rest.chat_id = str(new_chat_id)
         SESSION.commit()
+        __set_mask(CHAT_RESTRICTIONS, new_chat_id, CHAT_RESTRICTIONS.pop(str(old_chat_id), 0))
+
+
+def __load_chat_locks():
+    global CHAT_LOCKS, CHAT_RESTRICTIONS
+    try:
+        CHAT_LOCKS = {}
+        for perm in SESSION.query(Permissions).all():
+            __set_mask(CHAT_LOCKS, perm.chat_id, __perm_mask(perm))
+
+        CHAT_RESTRICTIONS = {}
+        for restr in SESSION.query(Restrictions).all():
+            __set_mask(CHAT_RESTRICTIONS, restr.chat_id, __restr_mask(restr))
+    finally:
+        SESSION.close()
+
+
+__load_chat_locks()
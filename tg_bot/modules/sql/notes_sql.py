@@ -4,9 +4,12 @@ import threading
 from typing import Union
 
 from sqlalchemy import Column, String, Boolean, UnicodeText, Integer, func, distinct
+from telegram import InlineKeyboardMarkup
 
+from tg_bot.modules.helper_funcs.cache import LRUCache
+from tg_bot.modules.helper_funcs.misc import build_keyboard
 from tg_bot.modules.helper_funcs.msg_types import Types
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import SESSION, BASE, COMPOSITE_AUTOINCREMENT, autoincrement_key_args
 
 
 class Notes(BASE):
@@ -33,11 +36,12 @@ class Notes(BASE):
 class Buttons(BASE):
     __tablename__ = "note_urls"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    chat_id = Column(String(14), primary_key=True)
-    note_name = Column(UnicodeText, primary_key=True)
+    chat_id = Column(String(14), primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
+    note_name = Column(UnicodeText, primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
     name = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
+    __table_args__ = autoincrement_key_args('chat_id', 'note_name')
 
     def __init__(self, chat_id, note_name, name, url, same_line=False):
         self.chat_id = str(chat_id)
@@ -52,6 +56,31 @@ Buttons.__table__.create(checkfirst=True)
 NOTES_INSERTION_LOCK = threading.RLock()
 BUTTONS_INSERTION_LOCK = threading.RLock()
 
+NOTES_CACHE_SIZE = 5000
+
+# (chat_id, note_name) -> CachedNote, or False for notes that don't exist
+NOTES_CACHE = LRUCache(NOTES_CACHE_SIZE)
+
+
+class CachedNote(object):
+    """
+    A note with its buttons and ready to send keyboard, detached from the database session.
+    """
+    __slots__ = ('name', 'value', 'file', 'is_reply', 'msgtype', 'buttons', 'keyboard')
+
+    def __init__(self, note, buttons):
+        self.name = note.name
+        self.value = note.value
+        self.file = note.file
+        self.is_reply = note.is_reply
+        self.msgtype = note.msgtype
+        self.buttons = tuple(buttons)
+        self.keyboard = InlineKeyboardMarkup(build_keyboard(self.buttons))
+
+    def __repr__(self):
+        return "<Cached note %s>" % self.name
+
+
 def add_note_to_db(chat_id, note_name, note_data, msgtype, buttons=None, file=None):
     if not buttons:
         buttons = []
@@ -72,6 +101,8 @@ def add_note_to_db(chat_id, note_name, note_data, msgtype, buttons=None, file=No
     for b_name, url, same_line in buttons:
         add_note_button_to_db(chat_id, note_name, b_name, url, same_line)
 
+    NOTES_CACHE.pop((str(chat_id), note_name))
+
 
 def get_note(chat_id, note_name):
     try:
@@ -80,6 +111,23 @@ def get_note(chat_id, note_name):
         SESSION.close()
 
 
+def get_cached_note(chat_id, note_name):
+    key = (str(chat_id), note_name)
+    note = NOTES_CACHE.get(key)
+    if note is None:
+        db_note = get_note(chat_id, note_name)
+        note = CachedNote(db_note, get_buttons(chat_id, note_name)) if db_note else False
+        NOTES_CACHE.set(key, note)
+    return note or None
+
+
+def get_notes_cache_stats():
+    return {'size': len(NOTES_CACHE),
+            'hits': NOTES_CACHE.hits,
+            'misses': NOTES_CACHE.misses,
+            'hit_rate': NOTES_CACHE.hit_rate()}
+
+
 def rm_note(chat_id, note_name):
     with NOTES_INSERTION_LOCK:
         note = SESSION.query(Notes).get((str(chat_id), note_name))
@@ -92,6 +140,7 @@ def rm_note(chat_id, note_name):
 
             SESSION.delete(note)
             SESSION.commit()
+            NOTES_CACHE.pop((str(chat_id), note_name))
             return True
 
         else:
@@ -147,3 +196,4 @@ def migrate_chat(old_chat_id, new_chat_id):
                 btn.chat_id = str(new_chat_id)
 
         SESSION.commit()
+        NOTES_CACHE.pop_matching(lambda key: key[0] in (str(old_chat_id), str(new_chat_id)))
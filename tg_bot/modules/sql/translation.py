@@ -14,6 +14,8 @@ class Locales(BASE):
 Locales.__table__.create(checkfirst=True)
 LOCALES_INSERTION_LOCK = threading.RLock()
 
+CHAT_LOCALES = {}
+
 def switch_to_locale(chat_id, locale_name):
     with LOCALES_INSERTION_LOCK:
         prev = SESSION.query(Locales).get((str(chat_id)))
@@ -22,9 +24,26 @@ def switch_to_locale(chat_id, locale_name):
         switch_locale = Locales(str(chat_id), locale_name)
         SESSION.add(switch_locale)
         SESSION.commit()
+        CHAT_LOCALES[str(chat_id)] = locale_name
 
 def prev_locale(chat_id):
     try:
         return SESSION.query(Locales).get((str(chat_id)))
     finally :
         SESSION.close()
+
+
+def get_chat_locale(chat_id):
+    return CHAT_LOCALES.get(str(chat_id))
+
+
+def __load_chat_locales():
+    global CHAT_LOCALES
+    try:
+        all_locales = SESSION.query(Locales).all()
+        CHAT_LOCALES = {x.chat_id: x.locale_name for x in all_locales}
+    finally:
+        SESSION.close()
+
+
+__load_chat_locales()
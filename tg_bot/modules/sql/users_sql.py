@@ -1,9 +1,12 @@
+import atexit
 import threading
 
-from sqlalchemy import Column, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func
+from sqlalchemy import Column, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func, text
 
-from tg_bot import dispatcher
-from tg_bot.modules.sql import BASE, SESSION
+from tg_bot import dispatcher, LOGGER
+from tg_bot.modules.helper_funcs.cache import LRUCache
+from tg_bot.modules.sql import BASE, BULK_BATCH, SESSION, session_scope
+from tg_bot.modules.sql.backends import chunked
 
 
 class Users(BASE):
@@ -57,11 +60,65 @@ class ChatMembers(BASE):
                                                             self.chat.chat_name, self.chat.chat_id)
 
 
+# case insensitive username lookups. Plain DDL, since checkfirst can't see expression indexes on every backend, and
+# kept out of the table definition so existing databases get it too.
+USERNAME_LOWER_INDEX = "CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))"
+
 Users.__table__.create(checkfirst=True)
 Chats.__table__.create(checkfirst=True)
 ChatMembers.__table__.create(checkfirst=True)
+with SESSION.get_bind().begin() as conn:
+    conn.execute(text(USERNAME_LOWER_INDEX))
 
 INSERTION_LOCK = threading.RLock()
+BUFFER_LOCK = threading.RLock()
+
+# write-behind buffer for log_user: {(user_id, chat_id): (username, chat_name)}
+USER_BUFFER = {}
+USER_BUFFER_FLUSH_SIZE = 500
+# entries kept while flushes keep failing
+USER_BUFFER_MAX = 50000
+# what was last written, to skip no-op updates. Bounded, cleared when full.
+LAST_WRITTEN_USERS = {}
+LAST_WRITTEN_CHATS = {}
+LAST_WRITTEN_MEMBERS = set()
+LAST_WRITTEN_MAX = 200000
+
+BUFFER_STATS = {"buffered": 0, "flushed": 0, "deduplicated": 0}
+
+# lower(username) -> user_id for recently seen users, kept in step with everything written to the users table
+USERNAME_INDEX_SIZE = 50000
+USERNAME_INDEX = LRUCache(USERNAME_INDEX_SIZE)
+# user_id -> lower(username), so a renamed user's old name can be dropped from the index
+INDEXED_NAMES = LRUCache(USERNAME_INDEX_SIZE)
+USERNAME_INDEX_LOCK = threading.RLock()
+
+
+def index_username(user_id, username):
+    name = username.lower() if username else None
+    with USERNAME_INDEX_LOCK:
+        old_name = INDEXED_NAMES.get(user_id)
+        if old_name == name:
+            if name:
+                USERNAME_INDEX.set(name, user_id)  # refresh its LRU position
+            return
+
+        # unless someone else has taken the old name over already
+        if old_name and USERNAME_INDEX.get(old_name) == user_id:
+            USERNAME_INDEX.pop(old_name)
+
+        if name:
+            USERNAME_INDEX.set(name, user_id)
+            INDEXED_NAMES.set(user_id, name)
+        else:
+            INDEXED_NAMES.pop(user_id)
+
+
+def lookup_username(username):
+    """
+    :return: the user_id last seen with this username, or None if it isn't in the index
+    """
+    return USERNAME_INDEX.get(username.lower())
 
 
 def ensure_bot_in_db():
@@ -69,6 +126,7 @@ def ensure_bot_in_db():
         bot = Users(dispatcher.bot.id, dispatcher.bot.username)
         SESSION.merge(bot)
         SESSION.commit()
+    index_username(dispatcher.bot.id, dispatcher.bot.username)
 
 
 def update_user(user_id, username, chat_id=None, chat_name=None):
@@ -80,6 +138,7 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
             SESSION.flush()
         else:
             user.username = username
+        index_username(user_id, username)
 
         if not chat_id or not chat_name:
             SESSION.commit()
@@ -103,6 +162,125 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
         SESSION.commit()
 
 
+def buffer_user(user_id, username, chat_id=None, chat_name=None):
+    if not chat_id or not chat_name:
+        chat_id = chat_name = None
+    else:
+        chat_id = str(chat_id)
+
+    # the buffer is the newest view of a user, so the index follows it rather than the DB flush
+    index_username(user_id, username)
+
+    if LAST_WRITTEN_USERS.get(user_id, False) == username \
+            and (chat_id is None or (LAST_WRITTEN_CHATS.get(chat_id) == chat_name
+                                     and (chat_id, user_id) in LAST_WRITTEN_MEMBERS)):
+        BUFFER_STATS["deduplicated"] += 1
+        return
+
+    with BUFFER_LOCK:
+        key = (user_id, chat_id)
+        if key in USER_BUFFER:
+            BUFFER_STATS["deduplicated"] += 1
+        else:
+            BUFFER_STATS["buffered"] += 1
+        USER_BUFFER[key] = (username, chat_name)
+        should_flush = len(USER_BUFFER) >= USER_BUFFER_FLUSH_SIZE
+
+    if should_flush:
+        flush_user_buffer()
+
+
+def __requeue(pending):
+    global USER_BUFFER
+    with BUFFER_LOCK:
+        # whatever was buffered while the flush ran is newer, so it wins
+        pending.update(USER_BUFFER)
+        USER_BUFFER = pending
+        overflow = len(USER_BUFFER) - USER_BUFFER_MAX
+        if overflow > 0:
+            # the database has been unreachable for a while; don't grow without bound
+            for key in list(USER_BUFFER)[:overflow]:
+                del USER_BUFFER[key]
+            LOGGER.warning("User buffer full, dropped the %s oldest entries", overflow)
+
+
+def flush_user_buffer():
+    global USER_BUFFER
+    with BUFFER_LOCK:
+        if not USER_BUFFER:
+            return 0
+        pending, USER_BUFFER = USER_BUFFER, {}
+
+    users = {}
+    chats = {}
+    members = set()
+    for (user_id, chat_id), (username, chat_name) in pending.items():
+        users[user_id] = username
+        if chat_id is not None:
+            chats[chat_id] = chat_name
+            members.add((chat_id, user_id))
+
+    with INSERTION_LOCK:
+        try:
+            with session_scope() as session:
+                # lookups are batched to keep each statement under the backend's bound parameter limit
+                known = set()
+                for batch in chunked(users, BULK_BATCH):
+                    for user in session.query(Users).filter(Users.user_id.in_(batch)).all():
+                        user.username = users[user.user_id]
+                        known.add(user.user_id)
+                session.add_all([Users(user_id, username) for user_id, username in users.items()
+                                 if user_id not in known])
+
+                if chats:
+                    known = set()
+                    for batch in chunked(chats, BULK_BATCH):
+                        for chat in session.query(Chats).filter(Chats.chat_id.in_(batch)).all():
+                            chat.chat_name = chats[chat.chat_id]
+                            known.add(chat.chat_id)
+                    session.add_all([Chats(chat_id, chat_name) for chat_id, chat_name in chats.items()
+                                     if chat_id not in known])
+                    session.flush()
+
+                    known = set()
+                    for batch in chunked(members, BULK_BATCH // 2):
+                        known.update(session.query(ChatMembers.chat, ChatMembers.user).filter(
+                            ChatMembers.chat.in_({chat_id for chat_id, _ in batch}),
+                            ChatMembers.user.in_({user_id for _, user_id in batch})).all())
+                    session.add_all([ChatMembers(chat_id, user_id) for chat_id, user_id in members
+                                     if (chat_id, user_id) not in known])
+        except Exception:
+            LOGGER.exception("Failed to flush %s buffered users, keeping them for the next flush", len(pending))
+            __requeue(pending)
+            return 0
+
+        # still under the insertion lock, so a chat removed or migrated meanwhile can't be recorded as written
+        if len(LAST_WRITTEN_USERS) > LAST_WRITTEN_MAX:
+            LAST_WRITTEN_USERS.clear()
+        if len(LAST_WRITTEN_CHATS) > LAST_WRITTEN_MAX:
+            LAST_WRITTEN_CHATS.clear()
+        if len(LAST_WRITTEN_MEMBERS) > LAST_WRITTEN_MAX:
+            LAST_WRITTEN_MEMBERS.clear()
+        LAST_WRITTEN_USERS.update(users)
+        LAST_WRITTEN_CHATS.update(chats)
+        LAST_WRITTEN_MEMBERS.update(members)
+
+    BUFFER_STATS["flushed"] += len(pending)
+    return len(pending)
+
+
+atexit.register(flush_user_buffer)
+
+
+def get_buffer_stats():
+    with BUFFER_LOCK:
+        return dict(BUFFER_STATS, pending=len(USER_BUFFER))
+
+
+def get_username_index_stats():
+    return {"size": len(USERNAME_INDEX), "hit_rate": USERNAME_INDEX.hit_rate()}
+
+
 def get_userid_by_name(username):
     try:
         return SESSION.query(Users).filter(func.lower(Users.username) == username.lower()).all()
@@ -152,8 +330,28 @@ def num_users():
         SESSION.close()
 
 
+def __forget_chat(chat_id, new_chat_id=None):
+    """
+    Drop a chat from the write-behind state, so its next messages are written again. Buffered entries move to
+    new_chat_id if it is given, and are dropped otherwise. Call with INSERTION_LOCK held.
+    """
+    global USER_BUFFER
+    with BUFFER_LOCK:
+        LAST_WRITTEN_CHATS.pop(chat_id, None)
+        LAST_WRITTEN_MEMBERS.difference_update([member for member in LAST_WRITTEN_MEMBERS if member[0] == chat_id])
+
+        buffered = {key: value for key, value in USER_BUFFER.items() if key[1] != chat_id}
+        if new_chat_id is not None:
+            for (user_id, buffered_chat_id), value in USER_BUFFER.items():
+                # anything already buffered under the new id came in after the migration
+                if buffered_chat_id == chat_id:
+                    buffered.setdefault((user_id, new_chat_id), value)
+        USER_BUFFER = buffered
+
+
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_LOCK:
+        __forget_chat(str(old_chat_id), str(new_chat_id))
         chat = SESSION.query(Chats).get(str(old_chat_id))
         if chat:
             chat.chat_id = str(new_chat_id)
@@ -173,6 +371,7 @@ ensure_bot_in_db()
 
 def rem_chat(chat_id):
     with INSERTION_LOCK:
+        __forget_chat(str(chat_id))
         chat = SESSION.query(Chats).get(str(chat_id))
         if chat:
             SESSION.delete(chat)
@@ -1,9 +1,9 @@
 import threading
 
 from sqlalchemy import Integer, Column, String, UnicodeText, func, distinct, Boolean
-from sqlalchemy.dialects import postgresql
 
 from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql.backends import StringList
 
 
 class Warns(BASE):
@@ -12,7 +12,7 @@ class Warns(BASE):
     user_id = Column(Integer, primary_key=True)
     chat_id = Column(String(14), primary_key=True)
     num_warns = Column(Integer, default=0)
-    reasons = Column(postgresql.ARRAY(UnicodeText))
+    reasons = Column(StringList)
 
     def __init__(self, user_id, chat_id):
         self.user_id = user_id
@@ -4,11 +4,14 @@ from typing import Union
 
 from sqlalchemy import Column, String, Boolean, UnicodeText, Integer, BigInteger
 
+from tg_bot.modules.helper_funcs.cache import LRUCache
 from tg_bot.modules.helper_funcs.msg_types import Types
-from tg_bot.modules.sql import SESSION, BASE
+from tg_bot.modules.sql import SESSION, BASE, COMPOSITE_AUTOINCREMENT, autoincrement_key_args
 
 DEFAULT_WELCOME = "Hey {first}, how are you?"
 DEFAULT_GOODBYE = "Nice knowing ya!"
+# joins within the raid window that switch a chat to batched welcomes; 0 never batches
+DEFAULT_RAID_LIMIT = 5
 
 
 class Welcome(BASE):
@@ -37,10 +40,11 @@ class Welcome(BASE):
 class WelcomeButtons(BASE):
     __tablename__ = "welcome_urls"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(String(14), primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
     name = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
+    __table_args__ = autoincrement_key_args('chat_id')
 
     def __init__(self, chat_id, name, url, same_line=False):
         self.chat_id = str(chat_id)
@@ -71,13 +75,27 @@ class WelcomeSecurity(BASE):
 
 
 
+class WelcomeRaid(BASE):
+    __tablename__ = "welcome_raid"
+    chat_id = Column(String(14), primary_key=True)
+    join_limit = Column(Integer, default=DEFAULT_RAID_LIMIT)
+
+    def __init__(self, chat_id, join_limit=DEFAULT_RAID_LIMIT):
+        self.chat_id = str(chat_id)  # ensure string
+        self.join_limit = join_limit
+
+    def __repr__(self):
+        return "<Chat {} batches welcomes after {} joins>".format(self.chat_id, self.join_limit)
+
+
 class GoodbyeButtons(BASE):
     __tablename__ = "leave_urls"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(String(14), primary_key=COMPOSITE_AUTOINCREMENT, nullable=False)
     name = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
+    __table_args__ = autoincrement_key_args('chat_id')
 
     def __init__(self, chat_id, name, url, same_line=False):
         self.chat_id = str(chat_id)
@@ -91,6 +109,7 @@ WelcomeButtons.__table__.create(checkfirst=True)
 GoodbyeButtons.__table__.create(checkfirst=True)
 CleanServiceSetting.__table__.create(checkfirst=True)
 WelcomeSecurity.__table__.create(checkfirst=True)
+WelcomeRaid.__table__.create(checkfirst=True)
 
 
 INSERTION_LOCK = threading.RLock()
@@ -98,18 +117,111 @@ WELC_BTN_LOCK = threading.RLock()
 CS_LOCK = threading.RLock()
 WS_LOCK = threading.RLock()
 LEAVE_BTN_LOCK = threading.RLock()
+RAID_LOCK = threading.RLock()
+
+WELCOME_CACHE_SIZE = 10000
+# backstop only: every setter below keeps the cache up to date
+WELCOME_CACHE_TTL = 3600  # seconds
+
+# chat_id -> WelcomeSettings, updated by every setter below
+WELCOME_CACHE = LRUCache(WELCOME_CACHE_SIZE, ttl=WELCOME_CACHE_TTL)
+# held while a setter commits and updates the cache, and while a cache miss reads and stores the settings, so a
+# read that raced with a write can never store the older state
+WELCOME_CACHE_LOCK = threading.RLock()
+
+
+class WelcomeSettings(object):
+    """
+    Everything the join and leave handlers need about a chat, read from all the welcome tables at once.
+    Instances are shared between threads, so treat them as read only.
+    """
+    __slots__ = ('should_welcome', 'custom_welcome', 'welcome_type', 'should_goodbye', 'custom_leave',
+                 'leave_type', 'clean_welcome', 'clean_service', 'security', 'raid_limit', 'welcome_buttons',
+                 'goodbye_buttons')
+
+    def __init__(self, welc, clean_service, security, raid_limit, welcome_buttons, goodbye_buttons):
+        if welc:
+            self.should_welcome = welc.should_welcome
+            self.custom_welcome = welc.custom_welcome
+            self.welcome_type = welc.welcome_type
+            self.should_goodbye = welc.should_goodbye
+            self.custom_leave = welc.custom_leave
+            self.leave_type = welc.leave_type
+            self.clean_welcome = welc.clean_welcome or False
+        else:
+            # Welcome by default.
+            self.should_welcome = True
+            self.custom_welcome = DEFAULT_WELCOME
+            self.welcome_type = Types.TEXT
+            self.should_goodbye = True
+            self.custom_leave = DEFAULT_GOODBYE
+            self.leave_type = Types.TEXT
+            self.clean_welcome = False
+
+        self.clean_service = clean_service
+        self.security = security
+        self.raid_limit = raid_limit
+        self.welcome_buttons = welcome_buttons
+        self.goodbye_buttons = goodbye_buttons
 
+    def replace(self, **changes) -> 'WelcomeSettings':
+        # a copy with some fields changed, since cached instances are shared
+        copy = object.__new__(WelcomeSettings)
+        for field in self.__slots__:
+            setattr(copy, field, changes.get(field, getattr(self, field)))
+        return copy
 
-def welcome_security(chat_id):
+    def __repr__(self):
+        return "<Welcome settings: welcome {}, goodbye {}>".format(self.should_welcome, self.should_goodbye)
+
+
+def __read_welcome_settings(chat_id):
     try:
+        welc = SESSION.query(Welcome).get(str(chat_id))
+        clean = SESSION.query(CleanServiceSetting).get(str(chat_id))
         security = SESSION.query(WelcomeSecurity).get(str(chat_id))
-        if security:
-            return security.security
-        return False
+        raid = SESSION.query(WelcomeRaid).get(str(chat_id))
+        welcome_buttons = SESSION.query(WelcomeButtons).filter(WelcomeButtons.chat_id == str(chat_id)).order_by(
+            WelcomeButtons.id).all()
+        goodbye_buttons = SESSION.query(GoodbyeButtons).filter(GoodbyeButtons.chat_id == str(chat_id)).order_by(
+            GoodbyeButtons.id).all()
+        return WelcomeSettings(welc,
+                               clean.clean_service if clean else False,
+                               security.security if security else False,
+                               raid.join_limit if raid else DEFAULT_RAID_LIMIT,
+                               tuple(welcome_buttons),
+                               tuple(goodbye_buttons))
     finally:
         SESSION.close()
 
 
+def __refresh_welcome_settings(chat_id):
+    # call with WELCOME_CACHE_LOCK held, after the commit
+    WELCOME_CACHE.set(str(chat_id), __read_welcome_settings(chat_id))
+
+
+def __update_welcome_settings(chat_id, **changes):
+    # call with WELCOME_CACHE_LOCK held, after the commit. Uncached chats are read in full on their next lookup.
+    settings = WELCOME_CACHE.pop(str(chat_id))
+    if settings is not None:
+        WELCOME_CACHE.set(str(chat_id), settings.replace(**changes))
+
+
+def get_welcome_settings(chat_id) -> WelcomeSettings:
+    settings = WELCOME_CACHE.get(str(chat_id))
+    if settings is None:
+        with WELCOME_CACHE_LOCK:
+            settings = WELCOME_CACHE.get(str(chat_id))
+            if settings is None:
+                settings = __read_welcome_settings(chat_id)
+                WELCOME_CACHE.set(str(chat_id), settings)
+    return settings
+
+
+def welcome_security(chat_id):
+    return get_welcome_settings(chat_id).security
+
+
 def set_welcome_security(chat_id, security):
     with WS_LOCK:
         prev = SESSION.query(WelcomeSecurity).get((str(chat_id)))
@@ -117,26 +229,36 @@ def set_welcome_security(chat_id, security):
             SESSION.delete(prev)
         welcome_s = WelcomeSecurity(str(chat_id), security)
         SESSION.add(welcome_s)
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, security=security)
         
+def get_raid_limit(chat_id):
+    return get_welcome_settings(chat_id).raid_limit
+
+
+def set_raid_limit(chat_id, join_limit):
+    with RAID_LOCK:
+        curr = SESSION.query(WelcomeRaid).get(str(chat_id))
+        if not curr:
+            curr = WelcomeRaid(chat_id)
+
+        curr.join_limit = int(join_limit)
+
+        SESSION.add(curr)
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, raid_limit=int(join_limit))
+
+
 def get_welc_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_welcome, welc.custom_welcome, welc.welcome_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_WELCOME, Types.TEXT
+    settings = get_welcome_settings(chat_id)
+    return settings.should_welcome, settings.custom_welcome, settings.welcome_type
 
 
 def get_gdbye_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_goodbye, welc.custom_leave, welc.leave_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_GOODBYE, Types.TEXT
+    settings = get_welcome_settings(chat_id)
+    return settings.should_goodbye, settings.custom_leave, settings.leave_type
 
 
 def set_clean_welcome(chat_id, clean_welcome):
@@ -148,17 +270,13 @@ def set_clean_welcome(chat_id, clean_welcome):
         curr.clean_welcome = int(clean_welcome)
 
         SESSION.add(curr)
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, clean_welcome=int(clean_welcome))
 
 
 def get_clean_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-
-    if welc:
-        return welc.clean_welcome
-
-    return False
+    return get_welcome_settings(chat_id).clean_welcome
 
 
 def set_welc_preference(chat_id, should_welcome):
@@ -170,7 +288,9 @@ def set_welc_preference(chat_id, should_welcome):
             curr.should_welcome = should_welcome
 
         SESSION.add(curr)
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, should_welcome=should_welcome)
 
 
 def set_gdbye_preference(chat_id, should_goodbye):
@@ -182,7 +302,9 @@ def set_gdbye_preference(chat_id, should_goodbye):
             curr.should_goodbye = should_goodbye
 
         SESSION.add(curr)
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, should_goodbye=should_goodbye)
 
 
 def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
@@ -213,17 +335,13 @@ def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
                 button = WelcomeButtons(chat_id, b_name, url, same_line)
                 SESSION.add(button)
 
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __refresh_welcome_settings(chat_id)
 
 
 def get_custom_welcome(chat_id):
-    welcome_settings = SESSION.query(Welcome).get(str(chat_id))
-    ret = DEFAULT_WELCOME
-    if welcome_settings and welcome_settings.custom_welcome:
-        ret = welcome_settings.custom_welcome
-
-    SESSION.close()
-    return ret
+    return get_welcome_settings(chat_id).custom_welcome or DEFAULT_WELCOME
 
 
 def set_custom_gdbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
@@ -254,33 +372,21 @@ def set_custom_gdbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
                 button = GoodbyeButtons(chat_id, b_name, url, same_line)
                 SESSION.add(button)
 
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __refresh_welcome_settings(chat_id)
 
 
 def get_custom_gdbye(chat_id):
-    welcome_settings = SESSION.query(Welcome).get(str(chat_id))
-    ret = DEFAULT_GOODBYE
-    if welcome_settings and welcome_settings.custom_leave:
-        ret = welcome_settings.custom_leave
-
-    SESSION.close()
-    return ret
+    return get_welcome_settings(chat_id).custom_leave or DEFAULT_GOODBYE
 
 
 def get_welc_buttons(chat_id):
-    try:
-        return SESSION.query(WelcomeButtons).filter(WelcomeButtons.chat_id == str(chat_id)).order_by(
-            WelcomeButtons.id).all()
-    finally:
-        SESSION.close()
+    return list(get_welcome_settings(chat_id).welcome_buttons)
 
 
 def get_gdbye_buttons(chat_id):
-    try:
-        return SESSION.query(GoodbyeButtons).filter(GoodbyeButtons.chat_id == str(chat_id)).order_by(
-            GoodbyeButtons.id).all()
-    finally:
-        SESSION.close()
+    return list(get_welcome_settings(chat_id).goodbye_buttons)
 
 
 def migrate_chat(old_chat_id, new_chat_id):
@@ -299,18 +405,30 @@ def migrate_chat(old_chat_id, new_chat_id):
             for btn in chat_buttons:
                 btn.chat_id = str(new_chat_id)
 
-        SESSION.commit()
+        with CS_LOCK:
+            clean = SESSION.query(CleanServiceSetting).get(str(old_chat_id))
+            if clean:
+                clean.chat_id = str(new_chat_id)
+
+        with WS_LOCK:
+            security = SESSION.query(WelcomeSecurity).get(str(old_chat_id))
+            if security:
+                security.chat_id = str(new_chat_id)
+
+        with RAID_LOCK:
+            raid = SESSION.query(WelcomeRaid).get(str(old_chat_id))
+            if raid:
+                raid.chat_id = str(new_chat_id)
+
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            WELCOME_CACHE.pop(str(old_chat_id))
+            WELCOME_CACHE.pop(str(new_chat_id))
         
         
  
 def clean_service(chat_id: Union[str, int]) -> bool:
-    try:
-        chat_setting = SESSION.query(CleanServiceSetting).get(str(chat_id))
-        if chat_setting:
-            return chat_setting.clean_service
-        return False
-    finally:
-        SESSION.close()
+    return get_welcome_settings(chat_id).clean_service
 
 
 def set_clean_service(chat_id: Union[int, str], setting: bool):
@@ -321,4 +439,6 @@ def set_clean_service(chat_id: Union[int, str], setting: bool):
 
         chat_setting.clean_service = setting
         SESSION.add(chat_setting)
-        SESSION.commit()
+        with WELCOME_CACHE_LOCK:
+            SESSION.commit()
+            __update_welcome_settings(chat_id, clean_service=setting)
@@ -1,13 +1,11 @@
-from tg_bot.modules.sql.translation import prev_locale
+from tg_bot.modules.sql.translation import get_chat_locale
 from tg_bot.modules.translations.English import EnglishStrings
 from tg_bot.modules.translations.Russian import RussianStrings
 from tg_bot.modules.translations.Ukraine import UkrainianStrings
 
 def tld(chat_id, t, show_none=True):
-    LANGUAGE = prev_locale(chat_id)
-    print(chat_id, t)
-    if LANGUAGE:
-        LOCALE = LANGUAGE.locale_name
+    LOCALE = get_chat_locale(chat_id)
+    if LOCALE:
         if LOCALE in ('ru') and t in RussianStrings:
            return RussianStrings[t]
         elif LOCALE in ('uk') and t in UkrainianStrings:
@@ -26,15 +24,10 @@ def tld(chat_id, t, show_none=True):
 
 
 def tld_help(chat_id, t):
-    LANGUAGE = prev_locale(chat_id)
-    print("tld_help ", chat_id, t)
-    if LANGUAGE:
-        LOCALE = LANGUAGE.locale_name
-
+    LOCALE = get_chat_locale(chat_id)
+    if LOCALE:
         t = t + "_help"
 
-        print("Test2", t)
-
         if LOCALE in ('ru') and t in RussianStrings:
             return RussianStrings[t]
         elif LOCALE in ('uk') and t in UkrainianStrings:
@@ -7,10 +7,12 @@ from telegram.error import BadRequest, Unauthorized
 from telegram.ext import CommandHandler, MessageHandler, Filters, CallbackContext
 
 import tg_bot.modules.sql.users_sql as sql
-from tg_bot import SUDO_USERS, OWNER_ID, dispatcher, LOGGER
+from tg_bot.modules.sql import get_pool_stats
+from tg_bot import SUDO_USERS, OWNER_ID, dispatcher, updater, LOGGER
 from tg_bot.modules.helper_funcs.filters import CustomFilters
 
 USERS_GROUP = 4
+USERS_FLUSH_INTERVAL = 10  # seconds between write-behind flushes of logged users
 
 
 def get_user_id(username: str) -> Optional[int]:
@@ -20,17 +22,23 @@ def get_user_id(username: str) -> Optional[int]:
     if username.startswith('@'):
         username = username[1:]
 
+    user_id = sql.lookup_username(username)
+    if user_id:
+        return user_id
+
     users = sql.get_userid_by_name(username)
 
     if not users:
         return None
     elif len(users) == 1:
+        sql.index_username(users[0].user_id, users[0].username)
         return users[0].user_id
 
     for user_obj in users:
         try:
             user_data = dispatcher.bot.get_chat(user_obj.user_id)
             if user_data.username == username:
+                sql.index_username(user_data.id, user_data.username)
                 return user_data.id
         except BadRequest as excp:
             if excp.message != 'Chat not found':
@@ -63,15 +71,19 @@ def log_user(update: Update, context: CallbackContext):
     msg: Message = update.effective_message
     chat: Chat = update.effective_chat
 
-    sql.update_user(msg.from_user.id, msg.from_user.username, chat.id, chat.title)
+    sql.buffer_user(msg.from_user.id, msg.from_user.username, chat.id, chat.title)
 
     if msg.reply_to_message:
-        sql.update_user(msg.reply_to_message.from_user.id,
+        sql.buffer_user(msg.reply_to_message.from_user.id,
                         msg.reply_to_message.from_user.username,
                         chat.id, chat.title)
 
     if msg.forward_from:
-        sql.update_user(msg.forward_from.id, msg.forward_from.username)
+        sql.buffer_user(msg.forward_from.id, msg.forward_from.username)
+
+
+def flush_users(context: CallbackContext):
+    sql.flush_user_buffer()
 
 
 def chats(update: Update, context: CallbackContext):
@@ -114,7 +126,17 @@ def __user_info__(user_id: int) -> str:
 
 
 def __stats__() -> str:
-    return f"{sql.num_users()} users, across {sql.num_chats()} chats"
+    buffer_stats = sql.get_buffer_stats()
+    index_stats = sql.get_username_index_stats()
+    pool_stats = get_pool_stats()
+    return (f"{sql.num_users()} users, across {sql.num_chats()} chats\n"
+            f"User log buffer: {buffer_stats['buffered']} buffered, {buffer_stats['flushed']} flushed, "
+            f"{buffer_stats['deduplicated']} deduplicated, {buffer_stats['pending']} pending\n"
+            f"Username index: {index_stats['size']} names, {index_stats['hit_rate']:.1%} hit rate\n"
+            f"DB pool: {pool_stats['in_use']}/{pool_stats['size']}+{pool_stats['max_overflow']} in use "
+            f"(peak {pool_stats['peak_in_use']}), {pool_stats['checkouts']} checkouts, "
+            f"{pool_stats['avg_wait_ms']:.2f}ms avg / {pool_stats['max_wait_ms']:.1f}ms max wait, "
+            f"{pool_stats['waits']} waited, {pool_stats['timeouts']} timed out")
 
 
 def __migrate__(old_chat_id: int, new_chat_id: int):
@@ -127,6 +149,8 @@ USER_HANDLER = MessageHandler(Filters.all & Filters.group, log_user)
 CHATLIST_HANDLER = CommandHandler("chatlist", chats, filters=CustomFilters.sudo_filter)
 DELETE_CHATS_HANDLER = CommandHandler("cleanchats", rem_chat, filters=Filters.user(user_id=OWNER_ID))
 
+updater.job_queue.run_repeating(flush_users, interval=USERS_FLUSH_INTERVAL, first=USERS_FLUSH_INTERVAL)
+
 # Dispatcher assignments
 dispatcher.add_handler(USER_HANDLER, USERS_GROUP)
 dispatcher.add_handler(BROADCAST_HANDLER)
@@ -1,9 +1,12 @@
 import html
 import re
+import threading
 import time
+from collections import deque
 from typing import Optional, List, Dict, Tuple
 
-from telegram import Message, Chat, Update, Bot, User, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Message, Chat, Update, Bot, User, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, \
+    ChatPermissions
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
@@ -28,6 +31,20 @@ VALID_WELCOME_FORMATTERS = ['first', 'last', 'fullname', 'username', 'id', 'coun
 SECURITY_MODES = ["off", "soft", "hard"]
 DEFAULT_MUTE_DURATION = 24 * 60 * 60  # 24 hours
 
+# Join raids: once a chat sees its raid limit of joins within JOIN_RAID_WINDOW seconds, further joins are
+# collected and welcomed together every JOIN_BATCH_DELAY seconds
+JOIN_RAID_WINDOW = 10
+JOIN_BATCH_DELAY = 5
+JOIN_BATCH_MAX_MENTIONS = 20
+JOIN_BATCH_MAX_BUTTONS = 50
+RAID_WELCOME = "Welcome to {chatname}, {mentions}! There are now {count} members here."
+
+# chat_id -> timestamps of the latest joins
+JOIN_TIMES = {}
+# chat_id -> (chat, [new members]) waiting for the batch job
+PENDING_JOINS = {}
+JOIN_LOCK = threading.Lock()
+
 # Message handler mapping
 ENUM_FUNC_MAP = {
     sql.Types.TEXT.value: dispatcher.bot.send_message,
@@ -66,14 +83,103 @@ def send_welcome_message(
             parse_mode=ParseMode.MARKDOWN
         )
 
+def apply_security(bot: Bot, chat_id: int, user_id: int, security_mode) -> None:
+    """Restrict a new member according to the chat's welcome security mode"""
+    if security_mode == "soft":
+        # Restrict media for 24 hours
+        bot.restrict_chat_member(
+            chat_id,
+            user_id,
+            until_date=int(time.time() + DEFAULT_MUTE_DURATION),
+            permissions=ChatPermissions(
+                can_send_messages=True,
+                can_send_media_messages=False,
+                can_send_other_messages=False,
+                can_add_web_page_previews=False
+            )
+        )
+    elif security_mode == "hard":
+        # Mute completely until verification
+        bot.restrict_chat_member(
+            chat_id,
+            user_id,
+            permissions=ChatPermissions(can_send_messages=False)
+        )
+
+def is_join_raid(chat_id: int, raid_limit: int) -> bool:
+    """Record a join and tell if the chat is getting more than its raid limit of joins"""
+    if not raid_limit:
+        return False
+    now = time.monotonic()
+    with JOIN_LOCK:
+        joins = JOIN_TIMES.get(chat_id)
+        if joins is None or joins.maxlen != raid_limit:
+            joins = JOIN_TIMES[chat_id] = deque(maxlen=raid_limit)
+        joins.append(now)
+        return len(joins) == raid_limit and now - joins[0] <= JOIN_RAID_WINDOW
+
+def queue_batched_welcome(context: CallbackContext, chat: Chat, new_mem: User) -> None:
+    """Add a member to the chat's pending batch, scheduling the batch job for the first one"""
+    with JOIN_LOCK:
+        pending = PENDING_JOINS.get(chat.id)
+        if pending is None:
+            pending = PENDING_JOINS[chat.id] = (chat, [])
+            context.job_queue.run_once(send_batched_welcome, JOIN_BATCH_DELAY, data=chat.id)
+        pending[1].append(new_mem)
+
+def send_batched_welcome(context: CallbackContext) -> None:
+    """Welcome every member queued during a join raid with a single message"""
+    bot = context.bot
+    with JOIN_LOCK:
+        chat, members = PENDING_JOINS.pop(context.job.data, (None, None))
+    if not members:
+        return
+
+    settings = sql.get_welcome_settings(chat.id)
+
+    mentions = ", ".join(mention_html(mem.id, mem.first_name or "PersonWithNoName")
+                         for mem in members[:JOIN_BATCH_MAX_MENTIONS])
+    if len(members) > JOIN_BATCH_MAX_MENTIONS:
+        mentions += f" and {len(members) - JOIN_BATCH_MAX_MENTIONS} others"
+    text = RAID_WELCOME.format(chatname=escape_html(chat.title), mentions=mentions,
+                               count=chat.get_members_count())
+
+    keyb = build_keyboard(settings.welcome_buttons)
+    keyboard = InlineKeyboardMarkup(keyb) if keyb else None
+
+    try:
+        sent = bot.send_message(chat.id, text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        if settings.security == "hard":
+            # One verification button per member, split to stay under Telegram's keyboard size limit
+            for i in range(0, len(members), JOIN_BATCH_MAX_BUTTONS):
+                verify_keyboard = InlineKeyboardMarkup([
+                    [InlineKeyboardButton(f"✅ {mem.first_name or mem.id}", callback_data=f"verify_user_{mem.id}")]
+                    for mem in members[i:i + JOIN_BATCH_MAX_BUTTONS]
+                ])
+                bot.send_message(chat.id, "Please verify you're human to start chatting:",
+                                 reply_markup=verify_keyboard)
+    except TelegramError as excp:
+        LOGGER.warning("Could not send batched welcome to %s: %s", chat.id, excp.message)
+        return
+
+    # Clean previous welcome message if enabled
+    if settings.clean_welcome:
+        try:
+            bot.delete_message(chat.id, settings.clean_welcome)
+        except (BadRequest, TelegramError):
+            pass
+        sql.set_clean_welcome(chat.id, sent.message_id)
+
 def new_member(update: Update, context: CallbackContext) -> None:
     """Handle new members joining the group"""
     chat = update.effective_chat
     bot = context.bot
     
-    should_welc, cust_welcome, welc_type = sql.get_welc_pref(chat.id)
-    if not should_welc:
+    settings = sql.get_welcome_settings(chat.id)
+    if not settings.should_welcome:
         return
+    cust_welcome = settings.custom_welcome
+    prev_welc = settings.clean_welcome
     
     new_members = update.effective_message.new_chat_members
     for new_mem in new_members:
@@ -94,6 +200,16 @@ def new_member(update: Update, context: CallbackContext) -> None:
             )
             continue
         
+        # During a raid, members are welcomed together by the batch job; only the greeting waits, restrictions
+        # apply straight away so raiders can't post in the meantime
+        if is_join_raid(chat.id, settings.raid_limit):
+            try:
+                apply_security(bot, chat.id, new_mem.id, settings.security)
+            except TelegramError as excp:
+                LOGGER.warning("Could not restrict %s in %s: %s", new_mem.id, chat.id, excp.message)
+            queue_batched_welcome(context, chat, new_mem)
+            continue
+        
         # Welcome message logic
         first_name = new_mem.first_name or "PersonWithNoName"
         last_name = new_mem.last_name or ""
@@ -117,8 +233,7 @@ def new_member(update: Update, context: CallbackContext) -> None:
                 chatname=escape_html(chat.title),
                 id=new_mem.id
             )
-            buttons = sql.get_welc_buttons(chat.id)
-            keyb = build_keyboard(buttons)
+            keyb = build_keyboard(settings.welcome_buttons)
             keyboard = InlineKeyboardMarkup(keyb) if keyb else None
         else:
             res = sql.DEFAULT_WELCOME.format(first=first_name)
@@ -132,30 +247,10 @@ def new_member(update: Update, context: CallbackContext) -> None:
             sql.DEFAULT_WELCOME.format(first=first_name)
         )
         
-        # Clean service message if enabled
-        if sql.clean_service(chat.id):
-            try:
-                bot.delete_message(chat.id, update.message.message_id)
-            except (BadRequest, TelegramError):
-                pass
-        
         # Apply security measures
-        security_mode = sql.welcome_security(chat.id)
-        if security_mode == "soft":
-            # Restrict media for 24 hours
-            bot.restrict_chat_member(
-                chat.id,
-                new_mem.id,
-                until_date=int(time.time() + DEFAULT_MUTE_DURATION),
-                permissions=ChatPermissions(
-                    can_send_messages=True,
-                    can_send_media_messages=False,
-                    can_send_other_messages=False,
-                    can_add_web_page_previews=False
-                )
-            )
-        elif security_mode == "hard":
-            # Mute completely until verification
+        security_mode = settings.security
+        apply_security(bot, chat.id, new_mem.id, security_mode)
+        if security_mode == "hard":
             keyboard = InlineKeyboardMarkup([[
                 InlineKeyboardButton(
                     "✅ I'm not a BOT!",
@@ -166,21 +261,22 @@ def new_member(update: Update, context: CallbackContext) -> None:
                 f"Hi {first_name}, please verify you're human:",
                 reply_markup=keyboard
             )
-            bot.restrict_chat_member(
-                chat.id,
-                new_mem.id,
-                permissions=ChatPermissions(can_send_messages=False)
-            )
         
         # Clean previous welcome message if enabled
-        if sent and sql.get_clean_pref(chat.id):
+        if sent and prev_welc:
             try:
-                prev_welc = sql.get_clean_pref(chat.id)
-                if prev_welc:
-                    bot.delete_message(chat.id, prev_welc)
+                bot.delete_message(chat.id, prev_welc)
             except (BadRequest, TelegramError):
                 pass
             sql.set_clean_welcome(chat.id, sent.message_id)
+            prev_welc = sent.message_id
+    
+    # Clean service message if enabled
+    if settings.clean_service:
+        try:
+            bot.delete_message(chat.id, update.effective_message.message_id)
+        except (BadRequest, TelegramError):
+            pass
 
 def verify_user(update: Update, context: CallbackContext) -> None:
     """Handle user verification button clicks"""
@@ -215,9 +311,10 @@ def left_member(update: Update, context: CallbackContext) -> None:
     chat = update.effective_chat
     bot = context.bot
     
-    should_goodbye, cust_goodbye, goodbye_type = sql.get_gdbye_pref(chat.id)
-    if not should_goodbye:
+    settings = sql.get_welcome_settings(chat.id)
+    if not settings.should_goodbye:
         return
+    cust_goodbye = settings.custom_leave
     
     left_mem = update.effective_message.left_chat_member
     if not left_mem or left_mem.id == bot.id:
@@ -250,8 +347,7 @@ def left_member(update: Update, context: CallbackContext) -> None:
             chatname=escape_html(chat.title),
             id=left_mem.id
         )
-        buttons = sql.get_gdbye_buttons(chat.id)
-        keyb = build_keyboard(buttons)
+        keyb = build_keyboard(settings.goodbye_buttons)
         keyboard = InlineKeyboardMarkup(keyb) if keyb else None
     else:
         res = sql.DEFAULT_GOODBYE
@@ -339,6 +435,34 @@ def security_cmd(update: Update, context: CallbackContext) -> None:
     }
     update.effective_message.reply_text(responses[mode])
 
+@user_admin
+def raid_cmd(update: Update, context: CallbackContext) -> None:
+    """Handle /welcomeraid command"""
+    chat = update.effective_chat
+    args = context.args
+    
+    if not args:
+        limit = sql.get_raid_limit(chat.id)
+        if limit:
+            update.effective_message.reply_text(
+                f"I'll welcome new members together once {limit} of them join within {JOIN_RAID_WINDOW} seconds."
+            )
+        else:
+            update.effective_message.reply_text("I'll welcome every new member separately, even during raids.")
+        return
+    
+    arg = args[0].lower()
+    if arg in ("off", "no", "0"):
+        sql.set_raid_limit(chat.id, 0)
+        update.effective_message.reply_text("Batched welcomes disabled.")
+    elif arg.isdigit() and int(arg) >= 2:
+        sql.set_raid_limit(chat.id, int(arg))
+        update.effective_message.reply_text(
+            f"I'll welcome new members together once {arg} of them join within {JOIN_RAID_WINDOW} seconds."
+        )
+    else:
+        update.effective_message.reply_text("Please give a number of joins (2 or more), or 'off'!")
+
 # MODULE SETUP
 __help__ = """
 Welcome messages can be personalized with variables:
@@ -356,6 +480,7 @@ Admin commands:
 - /setwelcome <text>: Set custom welcome message
 - /resetwelcome: Reset to default welcome
 - /welcomesecurity <off/soft/hard>: Set security mode
+- /welcomeraid <number/off>: Welcome members in one message when that many join within a few seconds
 - /cleanservice <on/off>: Clean service messages
 """
 
@@ -366,10 +491,12 @@ NEW_MEM_HANDLER = MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_memb
 LEFT_MEM_HANDLER = MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, left_member)
 WELCOME_CMD_HANDLER = CommandHandler("welcome", welcome_cmd, filters=filters.ChatType.GROUPS)
 SECURITY_HANDLER = CommandHandler("welcomesecurity", security_cmd, filters=filters.ChatType.GROUPS)
+RAID_HANDLER = CommandHandler("welcomeraid", raid_cmd, filters=filters.ChatType.GROUPS)
 VERIFY_HANDLER = CallbackQueryHandler(verify_user, pattern=r"verify_user_\d+")
 
 dispatcher.add_handler(NEW_MEM_HANDLER)
 dispatcher.add_handler(LEFT_MEM_HANDLER)
 dispatcher.add_handler(WELCOME_CMD_HANDLER)
 dispatcher.add_handler(SECURITY_HANDLER)
+dispatcher.add_handler(RAID_HANDLER)
 dispatcher.add_handler(VERIFY_HANDLER)